@@ -108,5 +108,12 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.email
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Photo as stored, so the derivatives of a replaced photo can be deleted
+        instance._saved_profile_photo = dict(zip(field_names, values)).get('profile_photo')
+        return instance
+
     def get_absolute_url(self):
         return reverse('profile:profile_detail')
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from shared.images import delete_derivatives, schedule_derivatives
+from .models import CustomUser
+
+
+@receiver(post_save, sender=CustomUser)
+def create_profile_photo_derivatives(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Create thumbnails of uploaded profile photos in the background (not on saves like last_login updates)
+    """
+    if not raw and (update_fields is None or 'profile_photo' in update_fields):
+        saved_photo = getattr(instance, '_saved_profile_photo', None)
+        if saved_photo != instance.profile_photo.name:
+            delete_derivatives(instance.profile_photo.storage, saved_photo)
+            instance._saved_profile_photo = instance.profile_photo.name
+        schedule_derivatives(instance.profile_photo)
+
+
+@receiver(post_delete, sender=CustomUser)
+def delete_profile_photo_derivatives(sender, instance, **kwargs):
+    delete_derivatives(instance.profile_photo.storage, instance.profile_photo.name)
@@ -0,0 +1,284 @@
+from contextlib import contextmanager
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Sum
+from django.utils.module_loading import import_string
+
+from .models import CartItem
+
+
+def get_cart_backend(request):
+    """
+    Get an instance of the cart backend selected in settings.CART_BACKEND
+    """
+    return import_string(settings.CART_BACKEND)(request)
+
+
+class BaseCartBackend:
+    """
+    Storage of cart lines: {variant_id (str): {'quantity': int}}
+    Backends write one line at a time, so changes don't rewrite the whole cart
+    """
+
+    def __init__(self, request, cart_id=None):
+        self.request = request
+        self.session = request.session
+        self._cart_id = cart_id
+
+    def get_cart_id(self, create=False):
+        """
+        Logged-in users have one cart; guests get an id saved in their session (only when they add something)
+        """
+        if self._cart_id:
+            return self._cart_id
+
+        user = getattr(self.request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return self.get_user_cart_id(user)
+
+        guest_id = self.session.get('cart_guest_id')
+        if guest_id is None and create:
+            guest_id = self.session['cart_guest_id'] = uuid.uuid4().hex
+        return f'guest-{guest_id}' if guest_id else None
+
+    @staticmethod
+    def get_user_cart_id(user):
+        return f'user-{user.pk}'
+
+    def load(self):
+        raise NotImplementedError
+
+    def set_quantity(self, variant_id, quantity):
+        raise NotImplementedError
+
+    def remove(self, variant_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def count(self):
+        """
+        Number of items in cart (must not load the lines if possible)
+        """
+        return sum(value['quantity'] for value in self.load().values())
+
+    def merge_guest_cart(self, user):
+        """
+        Move lines of the guest cart of this session into the user's cart (called at login)
+        """
+        guest_id = self.session.pop('cart_guest_id', None)
+        if guest_id is None:
+            return
+        guest_cart = self.__class__(self.request, cart_id=f'guest-{guest_id}')
+        lines = guest_cart.load()
+        if not lines:
+            return
+        user_cart = self.__class__(self.request, cart_id=self.get_user_cart_id(user))
+        user_lines = user_cart.load()
+        for variant_id, value in lines.items():
+            quantity = user_lines.get(variant_id, {}).get('quantity', 0) + value['quantity']
+            user_cart.set_quantity(variant_id, quantity)
+        guest_cart.clear()
+
+
+class SessionCartBackend(BaseCartBackend):
+    """
+    Keep the cart in the session (every change rewrites the session row)
+    """
+
+    def get_cart_id(self, create=False):
+        return 'session'
+
+    def load(self):
+        return {variant_id: dict(value) for variant_id, value in (self.session.get('cart') or {}).items()}
+
+    def save(self, cart):
+        self.session['cart'] = cart
+        self.session['cart_count'] = sum(value['quantity'] for value in cart.values())
+
+    def set_quantity(self, variant_id, quantity):
+        cart = self.load()
+        cart[variant_id] = {'quantity': quantity}
+        self.save(cart)
+
+    def remove(self, variant_id):
+        cart = self.load()
+        cart.pop(variant_id, None)
+        self.save(cart)
+
+    def clear(self):
+        self.save({})
+
+    def count(self):
+        count = self.session.get('cart_count')
+        if count is None:
+            count = super().count()
+        return count
+
+    def merge_guest_cart(self, user):
+        # Session data survives login, so the guest cart already is the user's cart
+        pass
+
+
+class CacheCartBackend(BaseCartBackend):
+    """
+    Keep the cart in cache (settings.CART_CACHE_ALIAS), one key per line
+    Quantities are written as they are (set), so concurrent changes of a line keep one of them.
+    The ids of the lines are kept in one key, only rewritten under a lock of the cart (new and removed lines),
+    so concurrent adds (two tabs, double submits) can't lose lines.
+    The count is computed from the lines and cached until the next change (the version counter).
+    """
+
+    # Seconds a worker may hold the lock of a cart's line ids (others wait for it as long)
+    lock_timeout = 5
+
+    def __init__(self, request, cart_id=None):
+        super().__init__(request, cart_id)
+        self.cache = caches[settings.CART_CACHE_ALIAS]
+        self.timeout = settings.CART_CACHE_TIMEOUT
+
+    def get_key(self, cart_id, name):
+        return f'cart:{cart_id}:{name}'
+
+    def get_line_key(self, cart_id, variant_id):
+        return self.get_key(cart_id, f'line:{variant_id}')
+
+    @contextmanager
+    def lock_lines(self, cart_id):
+        """
+        Hold the lock of the cart's line ids while they are read and rewritten
+        """
+        lock_key = self.get_key(cart_id, 'lock')
+        deadline = time.monotonic() + self.lock_timeout
+        # The lock expires after lock_timeout, so waiting longer than that means its holder is gone
+        while not self.cache.add(lock_key, True, self.lock_timeout) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            self.cache.delete(lock_key)
+
+    def get_quantities(self, cart_id):
+        """
+        [(variant_id, quantity)] of the lines, in the order they were added
+        """
+        variant_ids = self.cache.get(self.get_key(cart_id, 'lines'), [])
+        quantities = self.cache.get_many([self.get_line_key(cart_id, variant_id) for variant_id in variant_ids])
+        return [
+            (variant_id, quantities[self.get_line_key(cart_id, variant_id)])
+            for variant_id in variant_ids if self.get_line_key(cart_id, variant_id) in quantities
+        ]
+
+    def load(self):
+        cart_id = self.get_cart_id()
+        if cart_id is None:
+            return {}
+        return {variant_id: {'quantity': quantity} for variant_id, quantity in self.get_quantities(cart_id)}
+
+    def bump_version(self, cart_id):
+        """
+        Atomically count a change of the cart (makes its cached count stale)
+        The version starts at 0 and is touched on every change, so it outlives the count it versions
+        """
+        key = self.get_key(cart_id, 'version')
+        self.cache.add(key, 0, self.timeout)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # Evicted meanwhile
+            self.cache.set(key, 1, self.timeout)
+        self.cache.touch(key, self.timeout)
+
+    def set_quantity(self, variant_id, quantity):
+        cart_id = self.get_cart_id(create=True)
+        lines_key = self.get_key(cart_id, 'lines')
+        if variant_id in self.cache.get(lines_key, []):
+            self.cache.set(self.get_line_key(cart_id, variant_id), quantity, self.timeout)
+            self.cache.touch(lines_key, self.timeout)
+        else:
+            with self.lock_lines(cart_id):
+                variant_ids = self.cache.get(lines_key, [])
+                if variant_id not in variant_ids:
+                    self.cache.set(lines_key, [*variant_ids, variant_id], self.timeout)
+                self.cache.set(self.get_line_key(cart_id, variant_id), quantity, self.timeout)
+        self.bump_version(cart_id)
+
+    def remove(self, variant_id):
+        cart_id = self.get_cart_id()
+        if cart_id is None:
+            return
+        lines_key = self.get_key(cart_id, 'lines')
+        with self.lock_lines(cart_id):
+            variant_ids = self.cache.get(lines_key, [])
+            if variant_id not in variant_ids:
+                return
+            self.cache.set(lines_key, [pk for pk in variant_ids if pk != variant_id], self.timeout)
+            self.cache.delete(self.get_line_key(cart_id, variant_id))
+        self.bump_version(cart_id)
+
+    def clear(self):
+        cart_id = self.get_cart_id()
+        if cart_id is None:
+            return
+        lines_key = self.get_key(cart_id, 'lines')
+        with self.lock_lines(cart_id):
+            variant_ids = self.cache.get(lines_key, [])
+            self.cache.delete_many(
+                [self.get_line_key(cart_id, variant_id) for variant_id in variant_ids]
+                + [lines_key, self.get_key(cart_id, 'count')]
+            )
+        self.bump_version(cart_id)
+
+    def count(self):
+        cart_id = self.get_cart_id()
+        if cart_id is None:
+            return 0
+        version_key, count_key = self.get_key(cart_id, 'version'), self.get_key(cart_id, 'count')
+        # The version is read before the lines, so a count cached with the current version saw every change
+        cached = self.cache.get_many([version_key, count_key])
+        version = cached.get(version_key, 0)
+        if count_key in cached and cached[count_key][0] == version:
+            return cached[count_key][1]
+        count = sum(quantity for variant_id, quantity in self.get_quantities(cart_id))
+        self.cache.set(count_key, (version, count), self.timeout)
+        return count
+
+
+class DatabaseCartBackend(BaseCartBackend):
+    """
+    Persist the cart in CartItem table, one row per line
+    """
+
+    def get_items(self):
+        return CartItem.objects.filter(cart_id=self.get_cart_id())
+
+    def load(self):
+        if self.get_cart_id() is None:
+            return {}
+        return {
+            str(variant_id): {'quantity': quantity}
+            for variant_id, quantity in self.get_items().order_by('pk').values_list('product_variant_id', 'quantity')
+        }
+
+    def set_quantity(self, variant_id, quantity):
+        cart_id = self.get_cart_id(create=True)
+        updated = CartItem.objects.filter(cart_id=cart_id, product_variant_id=variant_id).update(quantity=quantity)
+        if not updated:
+            CartItem.objects.create(cart_id=cart_id, product_variant_id=variant_id, quantity=quantity)
+
+    def remove(self, variant_id):
+        if self.get_cart_id() is not None:
+            self.get_items().filter(product_variant_id=variant_id).delete()
+
+    def clear(self):
+        if self.get_cart_id() is not None:
+            self.get_items().delete()
+
+    def count(self):
+        if self.get_cart_id() is None:
+            return 0
+        return self.get_items().aggregate(count=Sum('quantity'))['count'] or 0
@@ -2,6 +2,7 @@ from django.contrib import messages
 from django.utils.translation import gettext_lazy as _
 
 from products.models import ProductVariant
+from .backends import get_cart_backend
 
 
 class Cart:
@@ -11,20 +12,31 @@ class Cart:
         """
         self.request = request
         self.session = request.session
+        # Where cart lines are stored (session, cache or database; settings.CART_BACKEND)
+        self.backend = get_cart_backend(request)
 
-        cart = self.session.get('cart')
-        if not cart:
-            cart = self.session['cart'] = {}
-        self.cart = cart
+        # Lines are loaded from the backend only when needed
+        self._cart = None
 
-        # Update variant quantities based on availability
-        self.update_variant_quantities()
+        # Variant quantities are checked against availability once, when the items are needed
+        self._checked_availability = False
+        # Variants reduced or removed by the availability check
+        self.unavailable_variant_ids = set()
+        self._items = None
+        self._totals = None
+
+    @property
+    def cart(self):
+        if self._cart is None:
+            self._cart = self.backend.load()
+        return self._cart
 
     def save(self):
         """
-        Mark session as modified to save changes
+        Forget items and totals calculated for the cart before it changed
         """
-        self.session.modified = True
+        self._items = None
+        self._totals = None
 
     def add(self, variant, quantity=1, update=False):
         """
@@ -36,23 +48,21 @@ class Cart:
 
         variant_id = str(variant.id)
 
-        if variant_id not in self.cart:
-            self.cart[variant_id] = {'quantity': 0}
-
         if update:
-            self.cart[variant_id]['quantity'] = quantity
+            new_quantity = quantity
             messages.success(self.request, _('Product quantity in cart updated'))
 
         else:
-            new_quantity = self.cart[variant_id]['quantity'] + quantity
+            new_quantity = self.cart.get(variant_id, {}).get('quantity', 0) + quantity
             if variant.is_available(new_quantity):
-                self.cart[variant_id]['quantity'] += quantity
                 messages.success(self.request, _('Product added to cart successfully'))
 
             else:
                 messages.error(self.request, _("Can not add more items. Not enough stock."))
                 return False
 
+        self.cart[variant_id] = {'quantity': new_quantity}
+        self.backend.set_quantity(variant_id, new_quantity)
         self.save()
         return True
 
@@ -63,6 +73,7 @@ class Cart:
         variant_id = str(variant.id)
         if variant_id in self.cart:
             del self.cart[variant_id]
+            self.backend.remove(variant_id)
             messages.success(self.request, _('Product variant removed from cart successfully'))
             self.save()
             return
@@ -74,47 +85,66 @@ class Cart:
         Clear the cart and remove all items from it
         """
         if self.cart:
-            del self.session['cart']
+            self._cart = {}
+            self.backend.clear()
             messages.success(self.request, _('Your cart is successfully empty'))
             self.save()
             return
         messages.info(self.request, _('Your cart is already empty'))
 
     def __len__(self):
-        return sum(value['quantity'] for value in self.cart.values())
+        """
+        Number of items in cart (cached by the backend, doesn't load the lines)
+        """
+        return self.backend.count()
 
     def __iter__(self):
         """
         Iterate over cart items and yield product/variant info
         """
-        variants = self.get_variant_objects()
-        cart = self.cart.copy()
+        if self._items is None:
+            self._items = self.get_items()
+        return iter(self._items)
 
-        for variant in variants:
-            variant_id = str(variant.id)
-            cart[variant_id]['product_obj'] = variant.product
-            cart[variant_id]['variant_obj'] = variant
+    def get_items(self):
+        """
+        Build cart items (copies of session data, so objects never leak into session)
+        Variants, products and covers are loaded once (two queries)
+        """
+        variants = {str(variant.id): variant for variant in self.get_variant_objects()}
+
+        if not self._checked_availability:
+            self._checked_availability = True
+            # Update variant quantities based on availability
+            self.update_variant_quantities(variants.values())
 
-        for item in cart.values():
-            if 'product_obj' in item and 'variant_obj' in item:
-                yield item
+        items = []
+        for variant_id, value in self.cart.items():
+            if variant_id in variants:
+                item = dict(value)
+                item['product_obj'] = variants[variant_id].product
+                item['variant_obj'] = variants[variant_id]
+                items.append(item)
+        return items
 
     def get_variant_objects(self):
         """
-        Get all variants in the cart (in a list)
+        Get all variants in the cart with their products and covers
         """
         variant_ids = [int(variant_id) for variant_id in self.cart.keys()]
-        return ProductVariant.objects.filter(id__in=variant_ids)
+        return ProductVariant.objects.filter(id__in=variant_ids).select_related('product__primary_cover')
 
-    def update_variant_quantities(self):
+    def update_variant_quantities(self, variants=None):
         """
         Update variants quantities if variants aren't available (if variant is added to someone else's order)
         """
-        variants = self.get_variant_objects()
+        if variants is None:
+            variants = self.get_variant_objects()
         for variant in variants:
             variant_id = str(variant.id)
             current_quantity = self.cart[str(variant_id)]['quantity']
             if not variant.is_available(current_quantity):
+                self.unavailable_variant_ids.add(variant.id)
 
                 if variant.quantity > 0:
                     self.add(variant, variant.quantity, update=True)
@@ -126,11 +156,23 @@ class Cart:
                     messages.warning(self.request,
                                      _('%s removed from cart due to stock limits') % variant.product.title)
 
+    def get_totals(self):
+        """
+        Calculate both totals (without and with offer) in one pass and keep them until cart changes
+        """
+        if self._totals is None:
+            total_no_offer = total = 0
+            for item in self:
+                total_no_offer += item['quantity'] * item['product_obj'].price
+                total += item['quantity'] * item['product_obj'].offer_price
+            self._totals = (total_no_offer, total)
+        return self._totals
+
     def get_total_price_no_offer(self):
         """
         Calculate total price without discount
         """
-        return sum(item['quantity'] * item['product_obj'].price for item in self)
+        return self.get_totals()[0]
 
     def get_total_price(self):
         """
@@ -138,4 +180,4 @@ class Cart:
         :param self:
         :return:
         """
-        return sum(item['quantity'] * item['product_obj'].offer_price for item in self)
+        return self.get_totals()[1]
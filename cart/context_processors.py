@@ -1,5 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
 from .cart import Cart
 
 
 def cart(request):
-    return {'cart': Cart(request)}
\ No newline at end of file
+    # Built only when a template uses the cart, so other pages make no cart queries
+    return {'cart': SimpleLazyObject(lambda: Cart(request))}
@@ -0,0 +1,27 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('products', '0004_alter_product_sell_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_id', models.CharField(db_index=True, max_length=50, verbose_name='Cart ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Quantity')),
+                ('datetime_modified', models.DateTimeField(auto_now=True, verbose_name='Datetime Modified')),
+                ('product_variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_items', to='products.productvariant', verbose_name='Product Variant')),
+            ],
+            options={
+                'unique_together': {('cart_id', 'product_variant')},
+            },
+        ),
+    ]
@@ -1,3 +1,20 @@
 from django.db import models
+from django.utils.translation import gettext_lazy as _
 
-# Create your models here.
+from products.models import ProductVariant
+
+
+class CartItem(models.Model):
+    """
+    A cart line persisted by cart.backends.DatabaseCartBackend
+    """
+    cart_id = models.CharField(_('Cart ID'), max_length=50, db_index=True)
+    product_variant = models.ForeignKey(verbose_name=_('Product Variant'), to=ProductVariant, on_delete=models.CASCADE, related_name='cart_items')
+    quantity = models.PositiveIntegerField(_('Quantity'))
+    datetime_modified = models.DateTimeField(_('Datetime Modified'), auto_now=True)
+
+    class Meta:
+        unique_together = ['cart_id', 'product_variant']
+
+    def __str__(self):
+        return f'{self.cart_id} - {self.product_variant_id}X{self.quantity}'
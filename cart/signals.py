@@ -0,0 +1,13 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .backends import get_cart_backend
+
+
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    """
+    Move what a guest added to cart into the user's cart at login
+    """
+    if request is not None and hasattr(request, 'session'):
+        get_cart_backend(request).merge_guest_cart(user)
@@ -1,3 +1,342 @@
-from django.test import TestCase
+from django.test import TestCase, RequestFactory
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.conf import settings
+from django.core.cache import caches
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-# Create your tests here.
+import threading
+import time
+
+from products.models import Product, ProductVariant, Cover
+from .cart import Cart
+from .backends import CacheCartBackend
+from .models import CartItem
+from .context_processors import cart as cart_context_processor
+
+
+User = get_user_model()
+
+
+class CartContextProcessorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.product = Product.objects.create(
+            title='TestTitle',
+            short_description='Test Short description',
+            description='TestProductDescription',
+            category='m-sport',
+            price=4560000,
+            user=cls.user,
+        )
+        cls.variant = ProductVariant.objects.create(product=cls.product, quantity=5, color='bk', size=41)
+
+    def add_to_cart(self, quantity):
+        self.client.post(reverse('cart:cart_add', kwargs={'pk': self.product.pk}), {
+            'quantity': quantity,
+            'color': 'bk',
+            'size': 41,
+        })
+
+    def get_variant_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query for query in context.captured_queries if 'products_productvariant' in query['sql']]
+
+    def test_cart_is_lazy(self):
+        """
+        Context processor doesn't build the cart (nor touch session) until it is used
+        """
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda r: None).process_request(request)
+        context = cart_context_processor(request)
+        self.assertFalse(request.session.accessed)
+        self.assertEqual(len(context['cart']), 0)
+        self.assertTrue(request.session.accessed)
+        self.assertFalse(request.session.modified)
+
+    def test_non_cart_pages_make_no_cart_queries(self):
+        """
+        Pages that only show the cart badge read the item count from session
+        """
+        self.add_to_cart(2)
+        self.add_to_cart(1)
+        response, variant_queries = self.get_variant_queries(reverse('accounts:login'))
+        self.assertEqual(variant_queries, [])
+        self.assertContains(response, '<sup class="mini-cart-count">3</sup>', html=True)
+
+        _, variant_queries = self.get_variant_queries(reverse('pages:about_page'))
+        self.assertEqual(variant_queries, [])
+
+    def test_cart_detail_checks_availability(self):
+        """
+        Cart items are checked against stock when they are listed
+        """
+        self.add_to_cart(4)
+        ProductVariant.objects.filter(pk=self.variant.pk).update(quantity=2)
+        response = self.client.get(reverse('cart:cart_detail'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session['cart'][str(self.variant.pk)]['quantity'], 2)
+        self.assertEqual(self.client.session['cart_count'], 2)
+
+
+class CartItemsQueriesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.products = []
+        for i in range(4):
+            product = Product.objects.create(
+                title=f'TestTitle {i}',
+                short_description='Test Short description',
+                description='TestProductDescription',
+                category='m-sport',
+                price=1000 * (i + 1),
+                user=cls.user,
+            )
+            ProductVariant.objects.create(product=product, quantity=5, color='bk', size=41)
+            Cover.objects.create(product=product, cover=f'products/covers/cart_{i}.jpg')
+            cls.products.append(product)
+
+    def add_to_cart(self, product):
+        self.client.post(reverse('cart:cart_add', kwargs={'pk': product.pk}), {
+            'quantity': 2,
+            'color': 'bk',
+            'size': 41,
+        })
+
+    def get_request(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        request._messages = FallbackStorage(request)
+        return request
+
+    def test_items_and_totals_are_loaded_once(self):
+        """
+        Variants, products and covers are loaded in one query and totals are memoized
+        """
+        for product in self.products:
+            self.add_to_cart(product)
+        cart = Cart(self.get_request())
+        self.assertEqual(len(cart), 8)
+
+        with self.assertNumQueries(1):
+            items = list(cart)
+            for item in items:
+                self.assertIsNotNone(item['product_obj'].get_first_cover())
+            self.assertEqual(cart.get_total_price_no_offer(), 20000)
+            self.assertEqual(cart.get_total_price(), 20000)
+            list(cart)
+        self.assertEqual([item['product_obj'] for item in items], self.products)
+
+    def test_cart_detail_queries_do_not_grow_with_cart_size(self):
+        self.add_to_cart(self.products[0])
+        with CaptureQueriesContext(connection) as small_cart:
+            self.client.get(reverse('cart:cart_detail'))
+        for product in self.products[1:]:
+            self.add_to_cart(product)
+        with CaptureQueriesContext(connection) as large_cart:
+            response = self.client.get(reverse('cart:cart_detail'))
+        self.assertContains(response, 'cart_3.jpg')
+        self.assertEqual(len(small_cart.captured_queries), len(large_cart.captured_queries))
+
+
+class CartBackendTestMixin:
+    backend = None
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.product = Product.objects.create(
+            title='TestTitle',
+            short_description='Test Short description',
+            description='TestProductDescription',
+            category='m-sport',
+            price=4560000,
+            user=cls.user,
+        )
+        cls.variant1 = ProductVariant.objects.create(product=cls.product, quantity=5, color='bk', size=41)
+        cls.variant2 = ProductVariant.objects.create(product=cls.product, quantity=5, color='we', size=42)
+
+    def setUp(self):
+        settings_override = self.settings(CART_BACKEND=self.backend)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        caches[settings.CART_CACHE_ALIAS].clear()
+
+    def add_to_cart(self, variant, quantity):
+        self.client.post(reverse('cart:cart_add', kwargs={'pk': self.product.pk}), {
+            'quantity': quantity,
+            'color': variant.color,
+            'size': variant.size,
+        })
+
+    def get_cart(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        request.user = self.user if '_auth_user_id' in request.session else AnonymousUser()
+        request._messages = FallbackStorage(request)
+        return Cart(request)
+
+    def test_add_update_remove_clear(self):
+        self.add_to_cart(self.variant1, 2)
+        self.add_to_cart(self.variant2, 1)
+        self.add_to_cart(self.variant1, 1)
+        cart = self.get_cart()
+        self.assertEqual(len(cart), 4)
+        self.assertEqual(
+            [(item['variant_obj'], item['quantity']) for item in cart],
+            [(self.variant1, 3), (self.variant2, 1)],
+        )
+
+        self.client.post(reverse('cart:cart_update', kwargs={'variant_id': self.variant2.pk}), {
+            'variant_id': self.variant2.pk,
+            'quantity': 4,
+        })
+        self.assertEqual(len(self.get_cart()), 7)
+
+        self.client.get(reverse('cart:cart_remove', kwargs={'variant_id': self.variant1.pk}))
+        cart = self.get_cart()
+        self.assertEqual(len(cart), 4)
+        self.assertEqual([item['variant_obj'] for item in cart], [self.variant2])
+
+        self.client.get(reverse('cart:cart_clear'))
+        cart = self.get_cart()
+        self.assertEqual(len(cart), 0)
+        self.assertEqual(list(cart), [])
+
+    def test_guest_cart_is_merged_at_login(self):
+        self.add_to_cart(self.variant1, 2)
+        self.client.force_login(self.user)
+        self.add_to_cart(self.variant2, 1)
+        cart = self.get_cart()
+        self.assertEqual(len(cart), 3)
+        self.assertEqual({item['variant_obj'] for item in cart}, {self.variant1, self.variant2})
+
+
+class SessionCartBackendTest(CartBackendTestMixin, TestCase):
+    backend = 'cart.backends.SessionCartBackend'
+
+
+class SlowReadCache:
+    """
+    Cache whose reads take a while, so concurrent writes interleave
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
+
+    def get(self, *args, **kwargs):
+        value = self.cache.get(*args, **kwargs)
+        time.sleep(0.01)
+        return value
+
+
+class CacheCartBackendTest(CartBackendTestMixin, TestCase):
+    backend = 'cart.backends.CacheCartBackend'
+
+    def test_cart_is_not_kept_in_session(self):
+        self.add_to_cart(self.variant1, 2)
+        session = self.client.session
+        self.assertNotIn('cart', session)
+        cache = caches[settings.CART_CACHE_ALIAS]
+        cart_id = f'guest-{session["cart_guest_id"]}'
+        self.assertEqual(cache.get(f'cart:{cart_id}:line:{self.variant1.pk}'), 2)
+        self.assertEqual(cache.get(f'cart:{cart_id}:lines'), [str(self.variant1.pk)])
+
+        # The count is computed once, then only the cached count is read for the badge until the next change
+        self.assertEqual(len(self.get_cart()), 2)
+        cache.delete(f'cart:{cart_id}:line:{self.variant1.pk}')
+        self.assertEqual(len(self.get_cart()), 2)
+        self.add_to_cart(self.variant2, 1)
+        self.assertEqual(len(self.get_cart()), 1)
+
+    def test_concurrent_adds_keep_every_line(self):
+        """
+        Test lines added at the same time to one cart (two tabs) are all kept and counted
+        """
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        variant_ids = [str(variant_id) for variant_id in range(1, 21)]
+        barrier = threading.Barrier(len(variant_ids))
+
+        def add(variant_id):
+            backend = CacheCartBackend(request, cart_id='concurrent')
+            backend.cache = SlowReadCache(backend.cache)
+            barrier.wait()
+            backend.set_quantity(variant_id, 2)
+
+        threads = [threading.Thread(target=add, args=(variant_id,)) for variant_id in variant_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        backend = CacheCartBackend(request, cart_id='concurrent')
+        self.assertEqual(set(backend.load()), set(variant_ids))
+        self.assertEqual(backend.count(), 40)
+
+        backend.remove('1')
+        backend.set_quantity('1', 1)
+        backend.set_quantity('2', 5)
+        self.assertEqual(backend.load()['1'], {'quantity': 1})
+        self.assertEqual(backend.count(), sum(value['quantity'] for value in backend.load().values()))
+        self.assertEqual(len(backend.cache.get('cart:concurrent:lines')), 20)
+
+    def test_concurrent_quantity_changes_keep_one_of_them(self):
+        """
+        Test setting a line's quantity from two requests at once leaves one of the quantities, not their sum
+        """
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        CacheCartBackend(request, cart_id='quantities').set_quantity('1', 1)
+        barrier = threading.Barrier(2)
+
+        def set_quantity(quantity):
+            backend = CacheCartBackend(request, cart_id='quantities')
+            backend.cache = SlowReadCache(backend.cache)
+            barrier.wait()
+            backend.set_quantity('1', quantity)
+
+        threads = [threading.Thread(target=set_quantity, args=(quantity,)) for quantity in (3, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        backend = CacheCartBackend(request, cart_id='quantities')
+        self.assertIn(backend.load()['1']['quantity'], (3, 5))
+        self.assertEqual(backend.count(), backend.load()['1']['quantity'])
+
+
+class DatabaseCartBackendTest(CartBackendTestMixin, TestCase):
+    backend = 'cart.backends.DatabaseCartBackend'
+
+    def test_cart_is_persisted_for_user(self):
+        self.client.force_login(self.user)
+        self.add_to_cart(self.variant1, 2)
+        self.assertEqual(CartItem.objects.get(cart_id=f'user-{self.user.pk}').quantity, 2)
+
+        # Cart remains after logout and next login
+        self.client.logout()
+        self.assertEqual(len(self.get_cart()), 0)
+        self.client.force_login(self.user)
+        self.assertEqual(len(self.get_cart()), 2)
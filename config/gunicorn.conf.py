@@ -0,0 +1,45 @@
+"""
+Gunicorn settings of the production profile (gunicorn -c config/gunicorn.conf.py config.wsgi)
+"""
+import multiprocessing
+import os
+
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Requests mostly wait on the database and cache: 2 processes per CPU (+1), each with a few threads
+# Every thread keeps its own database connection (CONN_MAX_AGE), so workers * threads must fit max_connections
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Restart workers after some requests (bounded memory growth), not all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = 100
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+# Connections from the reverse proxy are kept open between requests
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """
+    Build in-process search structures before the worker takes requests (not on the first search)
+    """
+    from django.conf import settings
+    from django.db import connections
+    from products.autocomplete import warm_up_product_suggestions
+    from products.search_index import warm_up_product_search_index
+
+    try:
+        if settings.PRODUCT_SEARCH_BACKEND == 'index':
+            warm_up_product_search_index()
+        warm_up_product_suggestions()
+    except Exception:
+        worker.log.exception('Warming up search structures failed')
+    finally:
+        connections.close_all()
@@ -35,7 +35,10 @@ SECRET_KEY = env.str("DJANGO_SECRET_KEY")
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = env.bool("DJANGO_DEBUG")
 
-ALLOWED_HOSTS = []
+# Settings profile: 'dev' (runserver) or 'prod' (gunicorn, see config/gunicorn.conf.py)
+ENVIRONMENT = env.str("DJANGO_ENV", default="dev")
+
+ALLOWED_HOSTS = env.list("DJANGO_ALLOWED_HOSTS", default=[])
 
 
 # Application definition
@@ -47,6 +50,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    # Full text search (products)
+    'django.contrib.postgres',
     # Humanize
     'django.contrib.humanize',
 
@@ -71,6 +76,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Static files, served by the app server (gunicorn) in production
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # Queries per request in the Server-Timing header (QUERY_BUDGET_ENABLED)
+    'shared.query_budget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -112,10 +121,49 @@ DATABASES = {
         'PASSWORD': 'postgres',
         'HOST': 'db',
         'PORT': 5432,
+        # Seconds a connection is kept open for the next requests (0: a new connection per request)
+        'CONN_MAX_AGE': env.int("DJANGO_DB_CONN_MAX_AGE", default=60),
+        # Check a persistent connection before reusing it, so a restarted database doesn't fail requests
+        'CONN_HEALTH_CHECKS': env.bool("DJANGO_DB_CONN_HEALTH_CHECKS", default=True),
         # 'ENGINE': 'django.db.backends.sqlite3',
         # 'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
+# Connection pool (psycopg 3) shared by the threads of a process, instead of one persistent connection per thread
+if env.bool("DJANGO_DB_POOL", default=False):
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': env.int("DJANGO_DB_POOL_MIN_SIZE", default=2),
+            'max_size': env.int("DJANGO_DB_POOL_MAX_SIZE", default=10),
+            # Seconds a request waits for a free connection
+            'timeout': env.int("DJANGO_DB_POOL_TIMEOUT", default=10),
+        },
+    }
+
+# Caches: cache URLs like locmem://name (default, one cache per process) or redis://host:6379/0
+# Use a shared cache (redis) when running several processes, so invalidations reach all of them
+CACHES = {
+    'default': env.dj_cache_url("DJANGO_CACHE_URL", default="locmem://default"),
+    'sessions': env.dj_cache_url("DJANGO_SESSION_CACHE_URL", default="locmem://sessions"),
+    # {% cache %} template fragments
+    'template_fragments': env.dj_cache_url("DJANGO_TEMPLATE_CACHE_URL", default="locmem://template_fragments"),
+    # Product catalog fragments (products.catalog_cache)
+    'catalog': env.dj_cache_url("DJANGO_CATALOG_CACHE_URL", default="locmem://catalog"),
+}
+# Count hits and misses of each cache (admin/cache-stats/)
+CACHE_STATS = env.bool("DJANGO_CACHE_STATS", default=DEBUG)
+if CACHE_STATS:
+    for alias, cache_settings in CACHES.items():
+        cache_settings.update({
+            'BACKEND': 'shared.cache_stats.InstrumentedCache',
+            'INSTRUMENTED_BACKEND': cache_settings['BACKEND'],
+            'ALIAS': alias,
+        })
+
+# Sessions are read from cache and written through to the database
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
 
 
 # Password validation
@@ -171,10 +219,30 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static'), ]
+# Collected static files (manage.py collectstatic)
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        # Production: hashed file names (cached forever by browsers) and gzip/brotli compressed copies
+        'BACKEND': (
+            'shared.storage.StaticFilesStorage' if ENVIRONMENT == 'prod'
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
 
 # Media
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Thumbnails of uploaded images (covers, profile photos), WebP and JPEG, stored next to originals (shared.images)
+IMAGE_DERIVATIVE_WIDTHS = env.list("DJANGO_IMAGE_DERIVATIVE_WIDTHS", subcast=int, default=[100, 320, 640])
+# Threads creating them after uploads; 0 creates them in the request thread (on commit)
+IMAGE_DERIVATIVE_WORKERS = env.int("DJANGO_IMAGE_DERIVATIVE_WORKERS", default=2)
+# Cache recording which images have derivatives (share it between processes, e.g. redis)
+IMAGE_DERIVATIVE_CACHE_ALIAS = env.str("DJANGO_IMAGE_DERIVATIVE_CACHE_ALIAS", default="default")
 
 # Email Backends
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
@@ -196,8 +264,39 @@ MESSAGE_TAGS = {
     messages.ERROR: 'danger',
 }
 
+# Cart storage: cart.backends.SessionCartBackend, CacheCartBackend or DatabaseCartBackend
+CART_BACKEND = env.str("DJANGO_CART_BACKEND", default="cart.backends.SessionCartBackend")
+CART_CACHE_ALIAS = env.str("DJANGO_CART_CACHE_ALIAS", default="default")
+CART_CACHE_TIMEOUT = env.int("DJANGO_CART_CACHE_TIMEOUT", default=60 * 60 * 24 * 30)
+
+# Product search: 'database' (full text search) or 'index' (in-process inverted index, products.search_index)
+PRODUCT_SEARCH_BACKEND = env.str("DJANGO_PRODUCT_SEARCH_BACKEND", default="database")
+# Snapshot loaded instead of reading all products when the index is first built (manage.py dump_search_index)
+PRODUCT_SEARCH_INDEX_SNAPSHOT = env.str("DJANGO_PRODUCT_SEARCH_INDEX_SNAPSHOT", default="")
+# Seconds before the index of a process is rebuilt (picks up changes made by other processes)
+PRODUCT_SEARCH_INDEX_MAX_AGE = env.int("DJANGO_PRODUCT_SEARCH_INDEX_MAX_AGE", default=60 * 5)
+
+# Pagination of product listings: 'offset' (page numbers) or 'keyset' (cursors, no OFFSET/COUNT per page)
+PRODUCT_LISTING_PAGINATION = env.str("DJANGO_PRODUCT_LISTING_PAGINATION", default="offset")
+# Seconds the (approximate) count of keyset paginated listings is cached
+PRODUCT_LISTING_COUNT_TIMEOUT = env.int("DJANGO_PRODUCT_LISTING_COUNT_TIMEOUT", default=60 * 5)
+
+# Cached catalog fragments (home page, product list); invalidated when products change (products.catalog_cache)
+CATALOG_CACHE_ALIAS = env.str("DJANGO_CATALOG_CACHE_ALIAS", default="catalog")
+CATALOG_CACHE_TIMEOUT = env.int("DJANGO_CATALOG_CACHE_TIMEOUT", default=60 * 60)
+
+# Count queries, DB time and duplicate SQL of each request (Server-Timing header, shared.query_budget)
+QUERY_BUDGET_ENABLED = env.bool("DJANGO_QUERY_BUDGET_ENABLED", default=DEBUG)
+# Requests running more queries are logged (with their most duplicated SQL)
+QUERY_BUDGET = env.int("DJANGO_QUERY_BUDGET", default=30)
+
 # Payment (Zarinpal)
 ZARINPAL_MERCHANT_ID = env.str("DJANGO_ZARINPAL_MERCHANT_ID")
+# Sandbox gateway base URL, ending with the /pg/ path (a missing trailing slash is added when endpoint URLs are built)
+# Load tests point it to the local stub (manage.py run_zarinpal_stub)
+ZARINPAL_SANDBOX_URL = env.str("DJANGO_ZARINPAL_SANDBOX_URL", default="https://sandbox.zarinpal.com/pg/")
+# Seconds to wait for Zarinpal API responses
+ZARINPAL_TIMEOUT = env.float("DJANGO_ZARINPAL_TIMEOUT", default=10)
 
 # Crispy forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"  # Optional
@@ -20,8 +20,11 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import include, re_path
 
+from shared.views import cache_stats_view
+
 
 urlpatterns = [
+    path('admin/cache-stats/', cache_stats_view, name='cache_stats'),
     path('admin/', admin.site.urls),
     path('', include('pages.urls')),
     path('products/', include('products.urls')),
@@ -33,7 +36,11 @@ urlpatterns = [
     path('profile/', include('profiles.urls')),
     # Tinymce
     path('tinymce/', include('tinymce.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+# Media is served by the web server in production (config/nginx.conf)
+if settings.DEBUG:
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 # Rosetta
 if 'rosetta' in settings.INSTALLED_APPS:
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Sum, F, Prefetch
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from django.shortcuts import reverse
@@ -7,10 +9,21 @@ from django.utils import timezone
 
 from datetime import datetime, timedelta
 
-from products.models import ProductVariant
+from products.models import Product, ProductVariant
+from products.stock_service import StockService
 from cart.cart import Cart
 
 
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        """
+        Prefetch items with their variants, products and primary covers (order pages render them without more queries)
+        """
+        return self.prefetch_related(Prefetch(
+            'items', queryset=OrderItem.objects.select_related('product_variant__product__primary_cover'),
+        ))
+
+
 class Order(models.Model):
     STATUSES = (
         (0, _('Not Paid')),
@@ -59,6 +72,9 @@ class Order(models.Model):
     datetime_modified = models.DateTimeField(_('Datetime Modified'), auto_now=True)
     datetime_payment = models.DateTimeField(_('Payment Datetime'), blank=True, null=True)
 
+    # Manager
+    objects = OrderQuerySet.as_manager()
+
     def __str__(self):
         return f'User:{self.user}-Order:{self.id}'
 
@@ -73,17 +89,42 @@ class Order(models.Model):
         Activate the order when payment is done
         Give onetime amount to self.total_price forever
         """
-        self.status = self.STATUSES[1][0]
-        self.is_paid = True
-        self.total_price = self.get_total_price()
-        self.datetime_payment = timezone.now()
-        self.save()
+        with transaction.atomic():
+            # Lock the order so concurrent callbacks can't count the sale twice
+            was_paid = Order.objects.select_for_update().filter(pk=self.pk).values_list('is_paid', flat=True).get()
+            self.status = self.STATUSES[1][0]
+            self.is_paid = True
+            self.total_price = self.get_total_price()
+            self.datetime_payment = timezone.now()
+            self.save()
+            if not was_paid:
+                self.update_products_sell_count()
+
+    def update_products_sell_count(self, sign=1):
+        """
+        Add (or remove with sign=-1) order's items to products' sell_count
+        """
+        quantities = self.items.values('product_variant__product').annotate(total=Sum('quantity'))
+        for row in quantities:
+            Product.objects.filter(pk=row['product_variant__product']).add_sell_count(sign * row['total'])
 
     def get_total_price(self):
         """
-        Calculate total price amount of order (Automatic product-price refresh)
+        Calculate total price amount of order (stored total of paid orders or a single SUM query)
+        """
+        if self.total_price is not None:
+            return self.total_price
+        return self.items.aggregate(total=Coalesce(Sum(F('quantity') * F('price')), 0))['total']
+
+    def create_items(self, quantities):
+        """
+        Create order items ({variant_id: quantity}) with current offer prices in bulk (prices in one query)
         """
-        return sum(item.get_total_price() for item in self.items.all())
+        prices = dict(ProductVariant.objects.filter(pk__in=quantities).values_list('pk', 'product__offer_price'))
+        return OrderItem.objects.bulk_create([
+            OrderItem(order_id=self.pk, product_variant_id=variant_id, quantity=quantity, price=prices[variant_id])
+            for variant_id, quantity in quantities.items()
+        ])
 
     def check_expiration(self):
         """
@@ -99,14 +140,22 @@ class Order(models.Model):
         """
         Cancel the order and refill the cart with order items
         """
-        self.status = self.STATUSES[4][0]
-        self.is_paid = False
-        self.datetime_payment = timezone.now()
-        self.save()
-
-        # Increase quantity of the variant when order is canceled
-        for item in self.items.all():
-            item.product_variant.increase_quantity(item.quantity)
+        with transaction.atomic():
+            was_paid, previous_status = Order.objects.select_for_update().filter(pk=self.pk).values_list(
+                'is_paid', 'status').get()
+            self.status = self.STATUSES[4][0]
+            self.is_paid = False
+            self.datetime_payment = timezone.now()
+            self.save()
+            if was_paid:
+                self.update_products_sell_count(sign=-1)
+
+            # Give quantities of the variants back when order is canceled (only once)
+            if previous_status != self.STATUSES[4][0]:
+                StockService.release_variants(dict(
+                    self.items.values('product_variant').annotate(total=Sum('quantity')).values_list(
+                        'product_variant', 'total')
+                ))
 
         # Refill the cart
         cart = Cart(request)
@@ -143,14 +192,14 @@ class OrderItem(models.Model):
 
     def save(self, *args, **kwargs):
         """
-        Auto-populate price before saving
+        Auto-populate price before saving (only once, price is fixed when order is placed)
         """
-        self.price = self.product_variant.product.offer_price
+        if self.price is None:
+            self.price = self.product_variant.product.offer_price
         super().save(*args, **kwargs)
 
     def get_total_price(self):
         """
-        Calculate total price and refresh price with related product
+        Calculate total price of the item
         """
-        self.save()
         return self.quantity * self.price
@@ -1,3 +1,274 @@
-from django.test import TestCase
+from django.test import TestCase, RequestFactory
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.management import call_command
+from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from io import StringIO
+
+from products.models import Product, ProductVariant, Cover
+from .models import Order, OrderItem
+
+
+User = get_user_model()
+
+
+class OrderSellCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.product = Product.objects.create(
+            title='TestTitle',
+            short_description='Test Short description',
+            description='TestProductDescription',
+            category='m-sport',
+            price=4560000,
+            user=cls.user,
+        )
+        cls.variant1 = ProductVariant.objects.create(product=cls.product, quantity=10, color='bk', size=41)
+        cls.variant2 = ProductVariant.objects.create(product=cls.product, quantity=10, color='we', size=42)
+
+    def setUp(self):
+        self.order = Order.objects.create(
+            first_name='First',
+            last_name='Last',
+            email='test@test.com',
+            phone_number='09123456789',
+            address='Address',
+            user=self.user,
+        )
+        OrderItem.objects.create(order=self.order, product_variant=self.variant1, quantity=2)
+        OrderItem.objects.create(order=self.order, product_variant=self.variant2, quantity=3)
+
+    def get_request(self):
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda r: None).process_request(request)
+        request._messages = FallbackStorage(request)
+        return request
+
+    def get_sell_count(self):
+        self.product.refresh_from_db()
+        return self.product.sell_count
+
+    def test_unpaid_order_is_not_sold(self):
+        self.assertEqual(self.get_sell_count(), 0)
+        self.assertEqual(self.product.get_sell_count(), 0)
+
+    def test_activate_order_increases_sell_count_once(self):
+        """
+        Paying an order adds its items to sell_count (only once)
+        """
+        self.order.activate_order()
+        self.assertEqual(self.get_sell_count(), 5)
+        self.order.activate_order()
+        self.assertEqual(self.get_sell_count(), 5)
+        self.assertEqual(self.product.get_sell_count(), 5)
+
+    def test_cancel_order_decreases_sell_count(self):
+        """
+        Canceling a paid order removes its items from sell_count, canceling an unpaid one doesn't
+        """
+        self.order.cancel_order_if_payment_failed(self.get_request())
+        self.assertEqual(self.get_sell_count(), 0)
+
+        self.order.activate_order()
+        self.order.cancel_order_if_payment_failed(self.get_request())
+        self.assertEqual(self.get_sell_count(), 0)
+
+    def test_rebuild_sell_counts_command(self):
+        Order.objects.filter(pk=self.order.pk).update(is_paid=True)
+        self.assertEqual(self.get_sell_count(), 0)
+
+        call_command('rebuild_sell_counts', stdout=StringIO())
+        self.assertEqual(self.get_sell_count(), 5)
+
+
+class OrderCreateViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+            password='859rfiok85erfj',
+            is_active=True,
+            phone_verified=True,
+        )
+        cls.product = Product.objects.create(
+            title='TestTitle',
+            short_description='Test Short description',
+            description='TestProductDescription',
+            category='m-sport',
+            price=4560000,
+            user=cls.user,
+        )
+        cls.variant = ProductVariant.objects.create(product=cls.product, quantity=3, color='bk', size=41)
+        cls.order_data = {
+            'first_name': 'First',
+            'last_name': 'Last',
+            'email': 'test@test.com',
+            'phone_number': '09123456789',
+            'address': 'Address',
+        }
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('cart:cart_add', kwargs={'pk': self.product.pk}), {
+            'quantity': 2,
+            'color': 'bk',
+            'size': 41,
+        })
+
+    def test_order_create_reserves_stock(self):
+        response = self.client.post(reverse('orders:order_create'), self.order_data)
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('orders:order_confirm', kwargs={'pk': order.pk}), fetch_redirect_response=False)
+        self.assertEqual(order.items.get().quantity, 2)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.quantity, 1)
+
+    def test_order_create_invalid_form(self):
+        response = self.client.post(reverse('orders:order_create'), {'first_name': 'First'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Order.objects.exists())
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.quantity, 3)
+
+    def test_order_create_sold_out_lines(self):
+        """
+        Test no (empty) order is created when the cart lines sold out after they were added
+        """
+        ProductVariant.objects.filter(pk=self.variant.pk).update(quantity=0)
+        response = self.client.post(reverse('orders:order_create'), self.order_data, follow=True)
+        self.assertRedirects(response, reverse('cart:cart_detail'))
+        self.assertFalse(Order.objects.exists())
+        self.assertIn(f'{self.product.title} removed from cart due to stock limits', [str(message) for message in response.context['messages']])
+
+    def test_order_create_reduced_lines(self):
+        ProductVariant.objects.filter(pk=self.variant.pk).update(quantity=1)
+        response = self.client.post(reverse('orders:order_create'), self.order_data)
+        self.assertRedirects(response, reverse('cart:cart_detail'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+        # The customer checked the reduced cart
+        response = self.client.post(reverse('orders:order_create'), self.order_data)
+        self.assertEqual(Order.objects.get().items.get().quantity, 1)
+
+
+class OrderTotalPriceTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.product1 = Product.objects.create(
+            title='TestTitle1',
+            short_description='Test Short description',
+            description='TestProductDescription',
+            category='m-sport',
+            price=1000,
+            offer=True,
+            offer_price=800,
+            user=cls.user,
+        )
+        cls.product2 = Product.objects.create(
+            title='TestTitle2',
+            short_description='Test Short description',
+            description='TestProductDescription',
+            category='hats',
+            price=500,
+            user=cls.user,
+        )
+        cls.variant1 = ProductVariant.objects.create(product=cls.product1, quantity=10, color='bk', size=41)
+        cls.variant2 = ProductVariant.objects.create(product=cls.product2, quantity=10, color='we', size=36)
+
+    def setUp(self):
+        self.order = Order.objects.create(
+            first_name='First',
+            last_name='Last',
+            email='test@test.com',
+            phone_number='09123456789',
+            address='Address',
+            user=self.user,
+        )
+
+    def test_create_items_in_bulk(self):
+        """
+        Items are created with one query for prices and one INSERT
+        """
+        with self.assertNumQueries(2):
+            self.order.create_items({self.variant1.id: 2, self.variant2.id: 3})
+        self.assertEqual(
+            sorted(self.order.items.values_list('product_variant', 'quantity', 'price')),
+            sorted([(self.variant1.id, 2, 800), (self.variant2.id, 3, 500)]),
+        )
+
+    def test_get_total_price_is_read_only(self):
+        """
+        Total price is a single SUM query; item prices don't change after the order is placed
+        """
+        self.order.create_items({self.variant1.id: 2, self.variant2.id: 3})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.order.get_total_price(), 3100)
+
+        self.product2.price = 900
+        self.product2.save()
+        self.assertEqual(self.order.get_total_price(), 3100)
+
+        # Paid orders use the stored total
+        self.order.activate_order()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.order.get_total_price(), 3100)
+
+
+class OrderPagesQueriesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.order = Order.objects.create(
+            first_name='First',
+            last_name='Last',
+            email='test@test.com',
+            phone_number='09123456789',
+            address='Address',
+            user=cls.user,
+        )
+
+    def add_items(self, count):
+        for i in range(count):
+            product = Product.objects.create(
+                title=f'Ordered product {i}',
+                short_description='Ordered short description',
+                description='Ordered description',
+                category='m-sport',
+                price=4560000,
+                user=self.user,
+            )
+            Cover.objects.create(product=product, cover=f'products/covers/ordered_{i}.jpg')
+            variant = ProductVariant.objects.create(product=product, quantity=10, color='bk', size=41)
+            OrderItem.objects.create(order=self.order, product_variant=variant, quantity=1)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('orders:order_detail', args=[self.order.pk]))
+        self.assertContains(response, 'products/covers/ordered_0.jpg')
+        return len(context.captured_queries)
+
+    def test_order_detail_queries_do_not_grow_with_items(self):
+        """
+        Items, their products and covers are loaded together (no covers.exists/first per item)
+        """
+        self.client.force_login(self.user)
+        self.add_items(1)
+        one_item = self.count_queries()
+        self.add_items(3)
+        self.assertEqual(self.count_queries(), one_item)
@@ -6,9 +6,11 @@ from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.http import HttpResponseForbidden
 from django.contrib import messages
 from django.utils.translation import gettext_lazy as _
+from django.db import transaction
 
-from orders.models import Order, OrderItem
+from orders.models import Order
 from cart.cart import Cart
+from products.stock_service import StockService, InsufficientStockError
 from .forms import OrderCreateForm
 
 @login_required
@@ -24,21 +26,30 @@ def order_create_view(request):
             messages.warning(request, _('Your cart is empty. Please add some products to your cart.'))
             return redirect('products:product_list')
 
-        if form.is_valid:
-            # Create order
-            order = form.save(commit=False)
-            order.user = request.user
-            order.save()
-            order.update_user()
-            # Create order items
-            for item in cart:
-                OrderItem.objects.create(
-                    quantity=item['quantity'],
-                    product_variant=item['variant_obj'],
-                    order=order,
-                )
-                # Decrease product variant's quantity
-                item['variant_obj'].decrease_quantity(item['quantity'])
+        if form.is_valid():
+            items = list(cart)
+            # Lines sold out or reduced since they were added (the cart has their messages): let the customer check
+            if cart.unavailable_variant_ids or not items:
+                return redirect('cart:cart_detail')
+            quantities = {item['variant_obj'].id: item['quantity'] for item in items}
+            try:
+                # Reserve all variants and create the order in one transaction (all or nothing)
+                with transaction.atomic():
+                    StockService.reserve_variants(quantities)
+                    # Create order
+                    order = form.save(commit=False)
+                    order.user = request.user
+                    order.save()
+                    order.update_user()
+                    # Create order items
+                    order.create_items(quantities)
+
+            except InsufficientStockError as error:
+                for item in items:
+                    if item['variant_obj'].id in error.failed_variant_ids:
+                        messages.error(request, _('%s is not available in the requested quantity') % item['variant_obj'])
+                return redirect('cart:cart_detail')
+
             # Empty Cart
             cart.clear()
             # Messaging
@@ -76,14 +87,12 @@ class OrderListView(LoginRequiredMixin, generic.ListView):
         context = super(OrderListView, self).get_context_data()
 
         processing_statuses = [0, 1, 2,]
-        context['processing_orders'] = Order.objects.filter(
-            user=self.request.user,
-            status__in=processing_statuses
-        ).order_by('status')
+        orders = Order.objects.filter(user=self.request.user).with_items()
+        context['processing_orders'] = orders.filter(status__in=processing_statuses).order_by('status')
 
-        context['delivered_orders'] = Order.objects.filter(user=self.request.user, status=3)
-        context['canceled_orders'] = Order.objects.filter(user=self.request.user, status=4)
-        context['returned_orders'] = Order.objects.filter(user=self.request.user, status=5)
+        context['delivered_orders'] = orders.filter(status=3)
+        context['canceled_orders'] = orders.filter(status=4)
+        context['returned_orders'] = orders.filter(status=5)
 
         return context
 
@@ -93,7 +102,7 @@ class OrderDetailView(LoginRequiredMixin, UserPassesTestMixin, generic.DetailVie
     Show order details
     If order is not paid yet, show links to order confirm view
     """
-    model = Order
+    queryset = Order.objects.with_items()
     template_name = 'orders/order_detail.html'
     context_object_name = 'order'
 
@@ -137,7 +146,7 @@ def order_confirm_view(request, pk):
     """
     Finalize and confirm order details and redirect to zarinpal-payment url
     """
-    order = get_object_or_404(Order, pk=pk)
+    order = get_object_or_404(Order.objects.with_items(), pk=pk)
 
     if order.user == request.user:
 
@@ -1,8 +1,10 @@
 from django.test import TestCase
 from django.shortcuts import reverse
 
-from products.models import Product
+from products.models import Product, ProductVariant, Cover
+from products.catalog_cache import get_cache
 from accounts.models import CustomUser
+from shared.testing import QueryBudgetMixin
 
 
 class PagesTest(TestCase):
@@ -29,6 +31,10 @@ class PagesTest(TestCase):
             user=cls.user,
         )
 
+    def setUp(self):
+        # Product fragments cached by other tests
+        get_cache().clear()
+
     def test_home_page_url(self):
         response = self.client.get('/')
         self.assertEqual(response.status_code, 200)
@@ -76,3 +82,50 @@ class PagesTest(TestCase):
         self.assertContains(response, 'Kurosh St.')
         self.assertContains(response, 'Iran, Isfahan')
         self.assertContains(response, 'form')
+
+
+class PagesQueryBudgetTest(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            email='user@email.com',
+            phone_number='09131451541',
+            username='user',
+        )
+        for i in range(3):
+            product = Product.objects.create(
+                title=f'Budget product {i}',
+                short_description='Budget short description',
+                description='Budget description',
+                price=1450000,
+                category='m-sport',
+                user=cls.user,
+            )
+            ProductVariant.objects.create(product=product, quantity=2, color='bk', size=41)
+            Cover.objects.create(product=product, cover=f'products/covers/budget_{i}.jpg')
+
+    def setUp(self):
+        # Measure rendering, not cached fragments
+        get_cache().clear()
+
+    def test_query_budgets(self):
+        """
+        Pin the number of queries of each page (raise a budget only for a reason)
+        """
+        # {url: (queries, duplicates)}
+        budgets = {
+            # Home page sections prefetch variants of their own products (best selling and men here are the same ones)
+            reverse('pages:home_page'): (5, 1),
+            reverse('pages:about_page'): (0, 0),
+            reverse('pages:contact_page'): (0, 0),
+        }
+        for url, (budget, max_duplicates) in budgets.items():
+            with self.subTest(url=url):
+                self.assertQueryBudget(url, budget, max_duplicates=max_duplicates)
+
+    def test_query_budgets_logged_in(self):
+        """
+        Test a logged in user costs one more query (the user; the session is cached)
+        """
+        self.client.force_login(self.user)
+        self.assertQueryBudget(reverse('pages:home_page'), 6, max_duplicates=1)
@@ -9,35 +9,35 @@ from products.models import Product
 
 def home_page_view(request):
     # High sell products
-    best_selling_products = Product.objects.all().order_by('-sell_count', '-is_active', )[:8]
+    best_selling_products = Product.objects.for_listing().order_by('-sell_count', '-is_active', )[:8]
 
     # New products (last 2 weeks)
     two_weeks_ago = timezone.now() - timedelta(days=14)
-    new_products = Product.objects.filter(
+    new_products = Product.objects.for_listing().filter(
         is_active=True,
         datetime_created__gte=two_weeks_ago
     ).order_by('-datetime_created')[:8]
 
     # Offer products
-    discounted_products = Product.objects.filter(
+    discounted_products = Product.objects.for_listing().filter(
         is_active=True,
         offer=True
     )[:8]
 
     # Products Based on major category
-    women_products = Product.objects.filter(
+    women_products = Product.objects.for_listing().filter(
         major_category='Women'
     ).order_by('-is_active')[:6]
 
-    men_products = Product.objects.filter(
+    men_products = Product.objects.for_listing().filter(
         major_category='Men'
     ).order_by('-is_active')[:6]
 
-    bags_products = Product.objects.filter(
+    bags_products = Product.objects.for_listing().filter(
         major_category='Bags'
     ).order_by('-is_active')[:6]
 
-    clothing_products = Product.objects.filter(
+    clothing_products = Product.objects.for_listing().filter(
         major_category='Clothing'
     ).order_by('-is_active')[:6]
 
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from payment.zarinpal_stub import ZarinpalStub, make_stub_server
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve a local stand-in of the Zarinpal sandbox (request.json, StartPay, verify.json) for load tests. '
+        'Point the site to it with DJANGO_ZARINPAL_SANDBOX_URL=http://<host>:<port>/pg/'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0, help='Milliseconds added to every response')
+        parser.add_argument('--jitter', type=float, default=0, help='Up to this many more random milliseconds')
+        parser.add_argument('--failure-rate', type=float, default=0, help='Share (0-1) of API calls answered with an error')
+        parser.add_argument('--cancel-rate', type=float, default=0, help='Share (0-1) of payments canceled at StartPay')
+        parser.add_argument('--seed', type=int, help='Random seed of failures and cancellations')
+        parser.add_argument('--verbose-requests', action='store_true', help='Log every request')
+
+    def handle(self, *args, **options):
+        stub = ZarinpalStub(
+            latency=options['latency'] / 1000, jitter=options['jitter'] / 1000,
+            failure_rate=options['failure_rate'], cancel_rate=options['cancel_rate'], seed=options['seed'],
+        )
+        server = make_stub_server(stub, options['host'], options['port'], quiet=not options['verbose_requests'])
+        self.stdout.write(
+            f'Zarinpal stub on http://{options["host"]}:{server.server_port}/pg/ '
+            f'(DJANGO_ZARINPAL_SANDBOX_URL=http://{options["host"]}:{server.server_port}/pg/), CONTROL-C to quit'
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f'Stub stats: {dict(stub.stats)}')
@@ -1,3 +1,122 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
 
-# Create your tests here.
+import threading
+from urllib.parse import urlsplit
+
+import requests
+
+from orders.models import Order
+from products.models import Product, ProductVariant
+from .zarinpal_stub import ZarinpalStub, make_stub_server
+
+
+User = get_user_model()
+
+
+class ZarinpalSandboxPaymentTest(TestCase):
+    """
+    Payment of an order through the local Zarinpal stub
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = ZarinpalStub(seed=0)
+        server = make_stub_server(cls.stub)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(server.server_close)
+        cls.addClassCleanup(server.shutdown)
+        cls.stub_url = f'http://127.0.0.1:{server.server_port}/pg/'
+        settings_override = override_settings(ZARINPAL_SANDBOX_URL=cls.stub_url)
+        settings_override.enable()
+        cls.addClassCleanup(settings_override.disable)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.product = Product.objects.create(
+            title='TestTitle',
+            short_description='Test Short description',
+            description='TestProductDescription',
+            category='m-sport',
+            price=4560000,
+            user=cls.user,
+        )
+        cls.variant = ProductVariant.objects.create(product=cls.product, quantity=3, color='bk', size=41)
+
+    def setUp(self):
+        self.stub.failure_rate = self.stub.cancel_rate = 0
+        self.client.force_login(self.user)
+        self.client.post(reverse('cart:cart_add', kwargs={'pk': self.product.pk}), {
+            'quantity': 2,
+            'color': 'bk',
+            'size': 41,
+        })
+        self.client.post(reverse('orders:order_create'), {
+            'first_name': 'First',
+            'last_name': 'Last',
+            'email': 'test@test.com',
+            'phone_number': '09123456789',
+            'address': 'Address',
+        })
+        self.order = Order.objects.get()
+
+    def pay(self):
+        """
+        Go to the gateway and come back to the callback, like the customer's browser
+        """
+        self.client.post(reverse('orders:order_confirm', kwargs={'pk': self.order.pk}))
+        response = self.client.get(reverse('payment:payment_process_sandbox'))
+        gateway_response = requests.get(response['Location'], allow_redirects=False, timeout=5)
+        callback_url = urlsplit(gateway_response.headers['Location'])
+        response = self.client.get(f'{callback_url.path}?{callback_url.query}')
+        self.order.refresh_from_db()
+        return response
+
+    def test_sandbox_url_without_trailing_slash(self):
+        with override_settings(ZARINPAL_SANDBOX_URL=self.stub_url.rstrip('/')):
+            self.pay()
+        self.assertTrue(self.order.is_paid)
+
+    def test_payment(self):
+        response = self.pay()
+        self.assertRedirects(response, self.order.get_absolute_url(), fetch_redirect_response=False)
+        self.assertTrue(self.order.is_paid)
+        self.assertTrue(self.order.zarinpal_ref_id)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.sell_count, 2)
+
+    def test_canceled_payment(self):
+        """
+        Test the order is canceled and its stock released when the customer cancels at the gateway
+        """
+        self.stub.cancel_rate = 1
+        self.pay()
+        self.assertFalse(self.order.is_paid)
+        self.assertEqual(self.order.status, 4)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.quantity, 3)
+
+    def test_payment_request_error(self):
+        """
+        Test gateway errors (empty data) send the customer back to the confirm page
+        """
+        self.stub.failure_rate = 1
+        self.client.post(reverse('orders:order_confirm', kwargs={'pk': self.order.pk}))
+        response = self.client.get(reverse('payment:payment_process_sandbox'))
+        self.assertRedirects(
+            response, reverse('orders:order_confirm', kwargs={'pk': self.order.pk}), fetch_redirect_response=False,
+        )
+
+    @override_settings(ZARINPAL_SANDBOX_URL='http://127.0.0.1:9/pg/', ZARINPAL_TIMEOUT=1)
+    def test_gateway_unavailable(self):
+        self.client.post(reverse('orders:order_confirm', kwargs={'pk': self.order.pk}))
+        response = self.client.get(reverse('payment:payment_process_sandbox'))
+        self.assertRedirects(
+            response, reverse('orders:order_confirm', kwargs={'pk': self.order.pk}), fetch_redirect_response=False,
+        )
@@ -10,6 +10,14 @@ import json
 
 from orders.models import Order
 
+
+def get_zarinpal_url(path):
+    """
+    URL of a Zarinpal sandbox endpoint (settings.ZARINPAL_SANDBOX_URL with or without a trailing slash)
+    """
+    return f"{settings.ZARINPAL_SANDBOX_URL.rstrip('/')}/{path}"
+
+
 @login_required
 def payment_process_sandbox(request):
     order_id = request.session['order_id']
@@ -24,7 +32,7 @@ def payment_process_sandbox(request):
 
         # Gathering data to send request to zarinpal
         rial_total_price = order.get_total_price() * 10
-        zarinpal_sandbox_request_url = 'https://sandbox.zarinpal.com/pg/v4/payment/request.json'
+        zarinpal_sandbox_request_url = get_zarinpal_url('v4/payment/request.json')
         request_data = {
             'merchant_id': settings.ZARINPAL_MERCHANT_ID,
             'amount': rial_total_price,
@@ -38,10 +46,19 @@ def payment_process_sandbox(request):
 #         print('Sending request to zarinpal')
 
         # Send request to zarinpal and analyze the response
-        response = requests.post(url=zarinpal_sandbox_request_url, data=json.dumps(request_data), headers=request_header)
-
-        data = response.json()['data']
-        errors = response.json()['errors']
+        try:
+            response = requests.post(
+                url=zarinpal_sandbox_request_url, data=json.dumps(request_data), headers=request_header,
+                timeout=settings.ZARINPAL_TIMEOUT,
+            )
+            response_data = response.json()
+        except (requests.RequestException, ValueError):
+            messages.error(request, _('Zarinpal is not available. Please try again in a few minutes'))
+            return redirect('orders:order_confirm', pk=order_id)
+
+        # Data is an empty list when there are errors
+        data = response_data['data'] or {}
+        errors = response_data['errors']
 #         print(f'response={response.json()}\ndata={data}\nerrors={errors}')
 
         code = data.get('code')
@@ -53,12 +70,13 @@ def payment_process_sandbox(request):
             order.zarinpal_authority = authority
             order.save()
 
-            zarinpal_sandbox_redirect_url = 'https://sandbox.zarinpal.com/pg/StartPay/{authority}'.format(authority=authority)
+            zarinpal_sandbox_redirect_url = get_zarinpal_url(f'StartPay/{authority}')
             return redirect(zarinpal_sandbox_redirect_url)
 
 #         print('Not all conditions were True')
         messages.error(request, _('Some errors happened from Zarinpal'))
-        messages.error(request, errors['message'])
+        if errors:
+            messages.error(request, errors['message'])
         messages.info(request, _('Please try again or contact support. We can only hold your order for 15 minutes'))
         return redirect('orders:order_confirm', pk=order_id)
 #     print(f'Order_user != request_user. forbidden')
@@ -83,7 +101,7 @@ def payment_callback_sandbox(request):
     if payment_status == 'OK':
         # Gather data to send to zarinpal for confirmation
         rial_total_price = order.get_total_price() * 10
-        zarinpal_verify_url = 'https://sandbox.zarinpal.com/pg/v4/payment/verify.json'
+        zarinpal_verify_url = get_zarinpal_url('v4/payment/verify.json')
         request_data = {
             'merchant_id': settings.ZARINPAL_MERCHANT_ID,
             'amount': rial_total_price,
@@ -95,10 +113,19 @@ def payment_callback_sandbox(request):
         }
 #         print('Status is ok. Ready to post request to zarinpal')
 
-        response = requests.post(url=zarinpal_verify_url, data=json.dumps(request_data), headers=request_header)
+        try:
+            response = requests.post(
+                url=zarinpal_verify_url, data=json.dumps(request_data), headers=request_header,
+                timeout=settings.ZARINPAL_TIMEOUT,
+            )
+            response_data = response.json()
+        except (requests.RequestException, ValueError):
+            # The payment may be done: keep the order for a retry of the callback
+            messages.error(request, _('Zarinpal is not available. Please try again in a few minutes'))
+            return redirect('orders:order_detail', pk=order_id)
 
-        data = response.json()['data']
-        errors = response.json()['errors']
+        data = response_data['data'] or {}
+        errors = response_data['errors']
 #         print(f'response={response.json()}')
 #         print(f'data={data}\nerrors={errors}')
 
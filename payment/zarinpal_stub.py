@@ -0,0 +1,141 @@
+import json
+import random
+import secrets
+import threading
+import time
+from collections import Counter
+from socketserver import ThreadingMixIn
+from urllib.parse import urlencode
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+
+class ZarinpalStub:
+    """
+    WSGI app answering like the Zarinpal sandbox (settings.ZARINPAL_SANDBOX_URL = 'http://<host>:<port>/pg/')
+    for load tests: request.json, StartPay (the customer pays at once) and verify.json
+
+    latency, jitter: seconds added to every response (latency plus up to jitter)
+    failure_rate: share of request.json and verify.json calls answered with an error
+    cancel_rate: share of payments the customer cancels at StartPay (callback with Status=NOK)
+    """
+    prefix = '/pg/'
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, cancel_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.cancel_rate = cancel_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # {authority: {'amount':, 'callback_url':, 'status': 'pending'/'paid'/'canceled', 'ref_id':}}
+        self.payments = {}
+        self.stats = Counter()
+        self.next_ref_id = 1000
+
+    def __call__(self, environ, start_response):
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        method, path = environ['REQUEST_METHOD'], environ['PATH_INFO']
+        if method == 'POST' and path == f'{self.prefix}v4/payment/request.json':
+            return self.json_response(start_response, self.request_payment(self.read_json(environ)))
+        if method == 'POST' and path == f'{self.prefix}v4/payment/verify.json':
+            return self.json_response(start_response, self.verify_payment(self.read_json(environ)))
+        if method == 'GET' and path.startswith(f'{self.prefix}StartPay/'):
+            return self.start_pay(start_response, path.removeprefix(f'{self.prefix}StartPay/'))
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return [b'Not found']
+
+    def read_json(self, environ):
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        try:
+            return json.loads(environ['wsgi.input'].read(length) or b'{}')
+        except ValueError:
+            return {}
+
+    def json_response(self, start_response, body):
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return [json.dumps(body).encode()]
+
+    def error(self, code, message):
+        # Zarinpal answers errors with an empty data list
+        return {'data': [], 'errors': {'code': code, 'message': message, 'validations': []}}
+
+    def fails(self):
+        with self.lock:
+            return self.random.random() < self.failure_rate
+
+    def request_payment(self, data):
+        if not data.get('merchant_id') or not data.get('amount') or not data.get('callback_url'):
+            self.stats['request_errors'] += 1
+            return self.error(-9, 'The input params invalid, validation error.')
+        if self.fails():
+            self.stats['request_failures'] += 1
+            return self.error(-12, 'Too many attempts, please try again later.')
+
+        authority = 'A' + secrets.token_hex(18)[:35]
+        with self.lock:
+            self.payments[authority] = {
+                'amount': data['amount'], 'callback_url': data['callback_url'], 'status': 'pending', 'ref_id': None,
+            }
+            self.stats['requests'] += 1
+        return {'data': {'code': 100, 'message': 'Success', 'authority': authority, 'fee_type': 'Merchant', 'fee': 0}, 'errors': []}
+
+    def start_pay(self, start_response, authority):
+        with self.lock:
+            payment = self.payments.get(authority)
+            if payment is None or payment['status'] != 'pending':
+                start_response('404 Not Found', [('Content-Type', 'text/plain')])
+                return [b'Unknown payment']
+            status = 'NOK' if self.random.random() < self.cancel_rate else 'OK'
+            payment['status'] = 'paid' if status == 'OK' else 'canceled'
+            self.stats['paid' if status == 'OK' else 'canceled'] += 1
+
+        callback_url = payment['callback_url']
+        separator = '&' if '?' in callback_url else '?'
+        location = f'{callback_url}{separator}{urlencode({"Authority": authority, "Status": status})}'
+        start_response('302 Found', [('Location', location), ('Content-Type', 'text/plain')])
+        return [b'']
+
+    def verify_payment(self, data):
+        if self.fails():
+            self.stats['verify_failures'] += 1
+            return self.error(-12, 'Too many attempts, please try again later.')
+
+        with self.lock:
+            payment = self.payments.get(data.get('authority'))
+            if payment is None:
+                return self.error(-54, 'Invalid authority.')
+            if payment['amount'] != data.get('amount'):
+                return self.error(-50, 'Session is not valid, amounts values is not the same.')
+            if payment['status'] != 'paid':
+                return self.error(-51, 'Session is not valid, session is not active paid try.')
+            if payment['ref_id'] is not None:
+                code, message = 101, 'Verified'
+            else:
+                code, message = 100, 'Paid'
+                payment['ref_id'] = self.next_ref_id
+                self.next_ref_id += 1
+            self.stats['verified'] += 1
+        return {'data': {
+            'code': code, 'message': message, 'card_hash': '', 'card_pan': '502229******5995',
+            'ref_id': payment['ref_id'], 'fee_type': 'Merchant', 'fee': 0,
+        }, 'errors': []}
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def make_stub_server(app, host='127.0.0.1', port=0, quiet=True):
+    """
+    Threaded HTTP server of the stub (port 0: any free port, see server.server_port)
+    """
+    handler_class = QuietWSGIRequestHandler if quiet else WSGIRequestHandler
+    return make_server(host, port, app, server_class=ThreadingWSGIServer, handler_class=handler_class)
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from .models import Product, ProductVariant, Comment, Cover
+from .stock_service import StockService
 
 
 class CommentAdmin(admin.ModelAdmin):
@@ -11,8 +12,8 @@ class CommentAdmin(admin.ModelAdmin):
 
 class CoverAdmin(admin.ModelAdmin):
     model = Comment
-    list_display = ('product__title', )
-    ordering = ('product', )
+    list_display = ('product__title', 'position', )
+    ordering = ('product', 'position', )
 
 
 class CoverInline(admin.StackedInline):
@@ -65,6 +66,14 @@ class ProductAdmin(admin.ModelAdmin):
         ProductVariantInline,
     ]
 
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not ProductVariant:
+            return super().save_formset(request, form, formset, change)
+        # Save all variants in batches and sync product's is_active once
+        variants = formset.save(commit=False)
+        StockService.bulk_save_variants(variants, deleted_variants=formset.deleted_objects)
+        formset.save_m2m()
+
 
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Cover, CoverAdmin)
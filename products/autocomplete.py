@@ -0,0 +1,191 @@
+import bisect
+import heapq
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils.translation import get_language
+
+from .search_index import tokenize
+
+
+logger = logging.getLogger(__name__)
+
+# Most entries looked at for one prefix (short prefixes match a big part of the catalog, so latency stays bounded)
+# Prefixes matching more entries get the best sellers among the first ones (alphabetically), not of all matches
+MAX_SCANNED_ENTRIES = 2000
+
+
+def get_keys(text):
+    """
+    Normalized text from the start of each of its words ('Leather Boots' -> 'leather boots', 'boots')
+    """
+    words = tokenize(text)
+    return {' '.join(words[position:]) for position in range(len(words))}
+
+
+class ProductSuggestions:
+    """
+    Sorted array of (key, product_id) of active products, answering prefix queries with a binary search
+    """
+
+    def __init__(self):
+        self.entries = []
+        # {product_id: (title, sell_count, keys)}
+        self.products = {}
+        self.built_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.products)
+
+    def add(self, product_id, title, sell_count):
+        with self.lock:
+            self._remove(product_id)
+            keys = get_keys(title)
+            self.products[product_id] = (title, sell_count, keys)
+            for key in keys:
+                bisect.insort(self.entries, (key, product_id))
+
+    def add_product(self, product):
+        """
+        Add or update product (inactive products are removed)
+        """
+        if product.is_active:
+            self.add(product.pk, product.title, product.sell_count)
+        else:
+            self.remove(product.pk)
+
+    def remove(self, product_id):
+        with self.lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id):
+        product = self.products.pop(product_id, None)
+        if product is None:
+            return
+        for key in product[2]:
+            del self.entries[bisect.bisect_left(self.entries, (key, product_id))]
+
+    def suggest(self, prefix, limit):
+        """
+        Best sellers among the products having a word of title (and the words after it) starting with prefix
+        Approximate when the prefix matches more than MAX_SCANNED_ENTRIES entries (only those are ranked)
+        Returns [(product_id, title)]
+        """
+        product_ids = set()
+        with self.lock:
+            position = bisect.bisect_left(self.entries, (prefix,))
+            end = min(position + MAX_SCANNED_ENTRIES, len(self.entries))
+            while position < end and self.entries[position][0].startswith(prefix):
+                product_ids.add(self.entries[position][1])
+                position += 1
+            best = heapq.nlargest(limit, product_ids, key=lambda product_id: (self.products[product_id][1], product_id))
+            return [(product_id, self.products[product_id][0]) for product_id in best]
+
+    @classmethod
+    def build(cls, products):
+        """
+        Build from active products, sorting the entries once (not one insertion per entry)
+        """
+        suggestions = cls()
+        for product in products.iterator(chunk_size=2000):
+            keys = get_keys(product.title)
+            suggestions.products[product.pk] = (product.title, product.sell_count, keys)
+            suggestions.entries.extend((key, product.pk) for key in keys)
+        suggestions.entries.sort()
+        return suggestions
+
+
+# {language: [(keys, category display, category, major category)]}
+_category_suggestions = {}
+
+
+def suggest_categories(prefix, limit):
+    """
+    Categories whose display name (in the active language) has a word starting with prefix
+    """
+    from .models import Product
+
+    language = get_language()
+    categories = _category_suggestions.get(language)
+    if categories is None:
+        categories = _category_suggestions[language] = [
+            (get_keys(display), str(display), category, Product.CATEGORY_MAJOR_CATEGORIES[category])
+            for category, display in Product.CATEGORY_DISPLAYS.items()
+        ]
+    matches = [
+        (display, category, major_category) for keys, display, category, major_category in categories
+        if any(key.startswith(prefix) for key in keys)
+    ]
+    return matches[:limit]
+
+
+_suggestions = None
+# Held while the suggestions are built (one builder at a time)
+_suggestions_lock = threading.Lock()
+
+
+def get_product_suggestions():
+    """
+    Get the suggestions of this process, built from the database on first use unless warmed up at startup
+    Rebuilt after PRODUCT_SEARCH_INDEX_MAX_AGE to pick up changes made by other processes (and sell counts),
+    in the background: requests keep using the stale suggestions meanwhile
+    """
+    suggestions = _suggestions
+    if suggestions is None:
+        return warm_up_product_suggestions()
+    if (
+        time.monotonic() - suggestions.built_at >= settings.PRODUCT_SEARCH_INDEX_MAX_AGE
+        and _suggestions_lock.acquire(blocking=False)
+    ):
+        threading.Thread(target=rebuild_suggestions, args=(suggestions,), daemon=True).start()
+    return suggestions
+
+
+def build_suggestions():
+    from .models import Product
+
+    return ProductSuggestions.build(Product.active_product_manager.only('pk', 'is_active', 'title', 'sell_count'))
+
+
+def warm_up_product_suggestions():
+    """
+    Build the suggestions of this process if they aren't built yet (gunicorn workers do it at startup)
+    """
+    global _suggestions
+    with _suggestions_lock:
+        if _suggestions is None:
+            _suggestions = build_suggestions()
+        return _suggestions
+
+
+def rebuild_suggestions(stale_suggestions):
+    """
+    Replace the stale suggestions (runs in the background, holding _suggestions_lock)
+    """
+    global _suggestions
+    try:
+        suggestions = build_suggestions()
+        if _suggestions is stale_suggestions:
+            _suggestions = suggestions
+    except Exception:
+        logger.exception('Rebuilding the product suggestions failed')
+    finally:
+        # Background threads don't close their connections with requests
+        connections.close_all()
+        _suggestions_lock.release()
+
+
+def get_built_product_suggestions():
+    """
+    Get the suggestions only if this process has already built them (signals don't build them)
+    """
+    return _suggestions
+
+
+def reset_product_suggestions():
+    global _suggestions
+    _suggestions = None
@@ -0,0 +1,170 @@
+from contextvars import ContextVar
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import get_language
+
+
+GENERATION_KEY = 'catalog:generation'
+
+# Seconds one worker may take to rebuild an entry before another one is allowed to
+REBUILD_LOCK_TIMEOUT = 30
+
+# Seconds a worker waits for the first build of an entry by another one (then it builds the entry itself)
+FIRST_BUILD_WAIT = 2
+FIRST_BUILD_POLL_INTERVAL = 0.05
+
+# Fragments listing products by a counter product cards don't show: {counter field: fragment names}
+FRAGMENTS_BY_COUNTER = {
+    'sell_count': ('home-best-selling',),
+}
+
+# Changes of more products than this invalidate every entry (instead of one generation per product)
+MAX_INVALIDATED_PRODUCTS = 100
+
+# Ids of products shown by the fragment being built (see show_product)
+_shown_products = ContextVar('catalog_cache_shown_products', default=None)
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def get_fragment_generation_key(name):
+    return f'catalog:generation:fragment:{name}'
+
+
+def get_product_generation_key(product_id):
+    return f'catalog:generation:product:{product_id}'
+
+
+def get_generation():
+    """
+    Version of the catalog; cached entries of older generations are stale
+    """
+    return get_cache().get_or_set(GENERATION_KEY, 1, None)
+
+
+def get_generations(keys):
+    """
+    Versions of the catalog, fragments or products (1 if never changed)
+    """
+    generations = get_cache().get_many(keys)
+    return tuple(generations.get(key, 1) for key in keys)
+
+
+def bump_generations(keys):
+    cache = get_cache()
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 2, None)
+
+
+def bump_generation():
+    bump_generations([GENERATION_KEY])
+
+
+def invalidate(keys):
+    """
+    Bump generations now (this worker sees its own changes) and again once the transaction is committed
+    (entries rebuilt meanwhile by other workers read the old data)
+    """
+    keys = list(keys)
+    if not keys:
+        return
+    bump_generations(keys)
+    transaction.on_commit(lambda: bump_generations(keys))
+
+
+def invalidate_catalog():
+    """
+    Make every cached catalog entry stale
+    """
+    invalidate([GENERATION_KEY])
+
+
+def invalidate_products(product_ids):
+    """
+    Make cached entries showing the products stale (changes of what cards show, not of which products are listed)
+    """
+    product_ids = list(product_ids)
+    if len(product_ids) > MAX_INVALIDATED_PRODUCTS:
+        invalidate_catalog()
+    else:
+        invalidate(map(get_product_generation_key, product_ids))
+
+
+def invalidate_counters(fields):
+    """
+    Make cached fragments listing products by the counters stale
+    """
+    invalidate(
+        get_fragment_generation_key(name) for field in fields for name in FRAGMENTS_BY_COUNTER.get(field, ())
+    )
+
+
+def show_product(product_id):
+    """
+    Record the product is shown by the fragment being built (changes of the product invalidate the fragment)
+    """
+    shown_products = _shown_products.get()
+    if shown_products is not None:
+        shown_products.add(product_id)
+
+
+def build_recording_products(build):
+    """
+    (value, ids of products shown) of build()
+    """
+    token = _shown_products.set(set())
+    try:
+        value = build()
+        return value, _shown_products.get()
+    finally:
+        _shown_products.reset(token)
+
+
+def get_or_build(name, build, vary_on=()):
+    """
+    Get entry of the current generations (catalog, fragment and products it shows) or build it
+    Only one worker rebuilds a stale entry (the one which gets the lock); the others keep serving the stale one,
+    or wait for the first build if there is none
+    """
+    cache = get_cache()
+    key = ':'.join(['catalog', name, get_language() or '', *map(str, vary_on)])
+    generation_keys = [GENERATION_KEY, get_fragment_generation_key(name)]
+
+    # (generations, product ids, value)
+    cached = cache.get(key)
+    product_ids = cached[1] if cached is not None else []
+    generations = get_generations(generation_keys + [get_product_generation_key(pk) for pk in product_ids])
+    if cached is not None and cached[0] == generations:
+        return cached[2]
+    generations = generations[:len(generation_keys)]
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, True, REBUILD_LOCK_TIMEOUT):
+        try:
+            value, product_ids = build_recording_products(build)
+            # Products are known once built: a change committed while building is seen when the entry expires
+            product_ids = sorted(product_ids)
+            generations += get_generations([get_product_generation_key(pk) for pk in product_ids])
+            cache.set(key, (generations, product_ids, value), settings.CATALOG_CACHE_TIMEOUT)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    if cached is not None:
+        return cached[2]
+    # Nothing to serve yet: wait for the first build in progress elsewhere
+    deadline = time.monotonic() + FIRST_BUILD_WAIT
+    while time.monotonic() < deadline and cache.get(lock_key):
+        time.sleep(FIRST_BUILD_POLL_INTERVAL)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached[2]
+    return build()
@@ -1,6 +1,7 @@
 from django import forms
+from django.utils.translation import gettext_lazy as _
 
-from products.models import Comment
+from products.models import Comment, ProductVariant
 
 
 class CommentForm(forms.ModelForm):
@@ -15,3 +16,45 @@ class CommentForm(forms.ModelForm):
         if not self.user or not self.user.is_authenticated:
             self.fields['name'] = forms.CharField(max_length=100, required=False,)
             self.fields['email'] = forms.EmailField(max_length=100,required=False,)
+
+
+class ProductFilterForm(forms.Form):
+    """
+    Facet filters of category listings (GET)
+    """
+    colors = forms.MultipleChoiceField(
+        label=_('Color'), choices=ProductVariant.COLORS, required=False, widget=forms.CheckboxSelectMultiple,
+    )
+    sizes = forms.TypedMultipleChoiceField(
+        label=_('Size'), coerce=int, required=False, widget=forms.CheckboxSelectMultiple,
+    )
+    min_price = forms.IntegerField(label=_('Min Price'), min_value=0, required=False)
+    max_price = forms.IntegerField(label=_('Max Price'), min_value=0, required=False)
+    offer = forms.BooleanField(label=_('Special Offer'), required=False)
+
+    def __init__(self, *args, **kwargs):
+        major_category = kwargs.pop('major_category', None)
+        super().__init__(*args, **kwargs)
+        self.fields['sizes'].choices = ProductVariant.SIZES_BY_MAJOR_CATEGORY.get(major_category, ())
+
+    def get_filters(self):
+        """
+        Values of valid filters (invalid ones are ignored)
+        """
+        self.is_valid()
+        return {name: value for name, value in self.cleaned_data.items() if value not in (None, [], False)}
+
+    def get_size_values(self):
+        return [value for value, label in self.fields['sizes'].choices]
+
+    def set_facet_counts(self, counts):
+        """
+        Show number of products next to each facet value
+        """
+        self.fields['colors'].choices = [
+            (value, f'{label} ({counts["colors"][value]})') for value, label in self.fields['colors'].choices
+        ]
+        self.fields['sizes'].choices = [
+            (value, f'{label} ({counts["sizes"][value]})') for value, label in self.fields['sizes'].choices
+        ]
+        self.fields['offer'].label = f'{self.fields["offer"].label} ({counts["offer"]})'
@@ -0,0 +1,48 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.autocomplete import get_product_suggestions
+from products.models import Product
+from products.search_index import tokenize
+
+
+class Command(BaseCommand):
+    help = 'Measure search latency (first result page and count) and autocomplete latency (prefixes of the queries) on the current catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='+', help='Search queries to measure')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs of each query')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Catalog size: {Product.objects.count()} products')
+        for query in options['queries']:
+            for name, search in (('search', Product.objects.search), ('similar', Product.objects.search_similar)):
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    products = search(query)
+                    count = products.count()
+                    list(products.for_listing()[:25])
+                    timings.append((time.perf_counter() - start) * 1000)
+                self.stdout.write(
+                    f'{name} {query!r}: {count} results, '
+                    f'median {statistics.median(timings):.1f} ms, max {max(timings):.1f} ms'
+                )
+
+        # Suggestions are built before they are timed (workers warm them up at startup)
+        suggestions = get_product_suggestions()
+        for query in options['queries']:
+            prefix = ' '.join(tokenize(query))
+            timings = []
+            for _ in range(options['repeat']):
+                for end in range(2, len(prefix) + 1):
+                    start = time.perf_counter()
+                    suggestions.suggest(prefix[:end], limit=8)
+                    timings.append((time.perf_counter() - start) * 1000)
+            if len(timings) > 1:
+                self.stdout.write(
+                    f'autocomplete {query!r}: median {statistics.median(timings):.3f} ms, '
+                    f'p99 {statistics.quantiles(timings, n=100, method="inclusive")[98]:.3f} ms, max {max(timings):.3f} ms'
+                )
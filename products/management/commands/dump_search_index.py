@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from products.search_index import load_or_build_index
+
+
+class Command(BaseCommand):
+    help = 'Build the product search index from the database and save its snapshot (loaded at startup)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=settings.PRODUCT_SEARCH_INDEX_SNAPSHOT,
+                            help='Snapshot file (default: PRODUCT_SEARCH_INDEX_SNAPSHOT)')
+
+    def handle(self, *args, **options):
+        if not options['path']:
+            raise CommandError('Give a path or set PRODUCT_SEARCH_INDEX_SNAPSHOT')
+        index = load_or_build_index(use_snapshot=False)
+        index.dump(options['path'])
+        self.stdout.write(self.style.SUCCESS(f'Saved search index of {len(index)} products to {options["path"]}'))
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def rebuild_sell_counts(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    sold_variants = ProductVariant.objects.filter(
+        product=OuterRef('pk'),
+        order_items__order__is_paid=True,
+    ).values('product')
+    Product.objects.update(
+        sell_count=Coalesce(Subquery(sold_variants.annotate(total=Sum('order_items__quantity')).values('total')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_rating_aggregates'),
+        ('orders', '0002_order_datetime_payment'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='sell_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='How many items of this product were sold?'),
+        ),
+        migrations.RunPython(rebuild_sell_counts, migrations.RunPython.noop),
+    ]
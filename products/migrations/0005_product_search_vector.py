@@ -0,0 +1,73 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+# Migrations don't import app code: the index name and the vector below are fixed as of this migration
+TITLE_TRIGRAM_INDEX = 'products_product_title_trgm'
+
+SEARCH_INDEX = django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='products_product_search_gin')
+
+
+def create_search_indexes(apps, schema_editor):
+    """
+    GIN indexes only exist on postgres; the trigram index only when pg_trgm can be installed
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Product = apps.get_model('products', 'Product')
+    schema_editor.add_index(Product, SEARCH_INDEX)
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {TITLE_TRIGRAM_INDEX} ON products_product USING gin (title gin_trgm_ops)'
+    )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Product = apps.get_model('products', 'Product')
+    schema_editor.remove_index(Product, SEARCH_INDEX)
+    schema_editor.execute(f'DROP INDEX IF EXISTS {TITLE_TRIGRAM_INDEX}')
+
+
+def build_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Product = apps.get_model('products', 'Product')
+    Product.objects.update(search_vector=(
+        SearchVector('title', weight='A', config='simple')
+        + SearchVector('category', 'major_category', weight='B', config='simple')
+        + SearchVector('short_description', weight='C', config='simple')
+        + SearchVector('material', weight='D', config='simple')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_alter_product_sell_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='product', index=SEARCH_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(create_search_indexes, drop_search_indexes),
+            ],
+        ),
+        migrations.RunPython(build_search_vectors, migrations.RunPython.noop),
+    ]
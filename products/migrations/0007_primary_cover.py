@@ -0,0 +1,35 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def set_primary_covers(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Cover = apps.get_model('products', 'Cover')
+    Product.objects.update(primary_cover=models.Subquery(
+        Cover.objects.filter(product=models.OuterRef('pk')).order_by('position', 'pk').values('pk')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='cover',
+            options={'ordering': ('position', 'pk')},
+        ),
+        migrations.AddField(
+            model_name='cover',
+            name='position',
+            field=models.PositiveIntegerField(default=0, verbose_name='Position'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='primary_cover',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.cover', verbose_name='Primary Cover'),
+        ),
+        migrations.RunPython(set_primary_covers, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,224 @@
-from django.db import models
+from types import MappingProxyType
+
+from django.db import models, router, transaction
+from django.db.models import F, Q, OuterRef, Subquery, Sum, Count, Exists, Value
+from django.db.models.functions import Cast, Coalesce
 from django.conf import settings
 from django.urls import reverse
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import gettext_lazy as _, get_language
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField, TrigramWordSimilarity
 
 from tinymce.models import HTMLField
 
+from .catalog_cache import (
+    FRAGMENTS_BY_COUNTER, invalidate_catalog, invalidate_counters, invalidate_products,
+)
+from .search import SEARCH_CONFIG, SEARCHED_FIELDS, get_search_vector, is_full_text_search_available, is_trigram_search_available
+
+
+# {language: {category display: category}}, filled by Product.find_category_from_category_display
+_categories_by_display = {}
+
 
 class ActiveModelManager(models.Manager):
     def get_queryset(self):
         return super(ActiveModelManager, self).get_queryset().exclude(is_active=False)
 
 
+class ProductQuerySet(models.QuerySet):
+    # Fields cached fragments don't show
+    UNSHOWN_FIELDS = frozenset({'search_vector'})
+
+    def update(self, **kwargs):
+        """
+        Bulk updates (counters, activation) don't send signals, so they invalidate cached catalog fragments here:
+        only the fragments listing by a counter when nothing else changes (see update_cards for card fields)
+        """
+        fields = set(kwargs) - self.UNSHOWN_FIELDS
+        rows = super().update(**kwargs)
+        if rows and fields:
+            if fields <= FRAGMENTS_BY_COUNTER.keys():
+                invalidate_counters(fields)
+            else:
+                invalidate_catalog()
+        return rows
+
+    def update_cards(self, product_ids, **kwargs):
+        """
+        Update fields product cards show but which don't change which products are listed (ratings, primary cover)
+        Only cached entries showing these products become stale
+        """
+        product_ids = list(product_ids)
+        rows = super(ProductQuerySet, self.filter(pk__in=product_ids)).update(**kwargs)
+        if rows:
+            invalidate_products(product_ids)
+        return rows
+
+    def for_listing(self):
+        """
+        Join primary covers and prefetch active variants for product cards
+        The number of queries stays the same whatever the number of products
+        """
+        return self.select_related('primary_cover').prefetch_related(
+            models.Prefetch(
+                'variants',
+                queryset=ProductVariant.objects.filter(is_active=True),
+                to_attr='listing_active_variants',
+            ),
+        )
+
+    def update_primary_covers(self, product_ids):
+        """
+        Set primary_cover of the products to their first cover (by position), in one update query
+        """
+        return self.update_cards(product_ids, primary_cover=Subquery(
+            Cover.objects.filter(product=OuterRef('pk')).order_by('position', 'pk').values('pk')[:1]
+        ))
+
+    def add_rating(self, product_ids, rate_delta, count_delta):
+        """
+        Atomically shift rating aggregates of the products with F-expressions (no read-modify-write)
+        """
+        return self.update_cards(
+            product_ids,
+            rating_sum=F('rating_sum') + rate_delta,
+            rating_count=F('rating_count') + count_delta,
+        )
+
+    def sync_activation(self):
+        """
+        Set is_active of products based on their active variants with a single UPDATE
+        Only products whose activation changes are written (and invalidate cached fragments)
+        """
+        is_active = Exists(ProductVariant.objects.filter(product=OuterRef('pk'), is_active=True))
+        return self.exclude(is_active=is_active).update(is_active=is_active)
+
+    def add_sell_count(self, delta):
+        """
+        Atomically shift sell_count with an F-expression (no read-modify-write)
+        """
+        return self.update(sell_count=F('sell_count') + delta)
+
+    def rebuild_sell_counts(self):
+        """
+        Recalculate sell_count (items of paid orders) from scratch with a single UPDATE
+        """
+        sold_variants = ProductVariant.objects.filter(
+            product=OuterRef('pk'),
+            order_items__order__is_paid=True,
+        ).values('product')
+        return self.update(
+            sell_count=Coalesce(Subquery(sold_variants.annotate(total=Sum('order_items__quantity')).values('total')), 0),
+        )
+
+    def update_search_vectors(self):
+        """
+        Rebuild the stored full text search vector of products with a single UPDATE (postgres only)
+        """
+        if not is_full_text_search_available(self.db):
+            return 0
+        return self.update(search_vector=get_search_vector())
+
+    def search(self, query):
+        """
+        Full text search ranked by relevance (uses the GIN index of search_vector)
+        Falls back to substring matching on databases without full text search (sqlite)
+        """
+        if not is_full_text_search_available(self.db):
+            return self.filter(
+                Q(title__icontains=query) |
+                Q(category__icontains=query) |
+                Q(major_category__icontains=query) |
+                Q(short_description__icontains=query)
+            ).annotate(rank=Value(1.0)).order_by('-is_active', '-pk')
+
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        # Ranks are cast to double precision, so they can be compared exactly with cursors of keyset pagination
+        return self.filter(search_vector=search_query).annotate(
+            rank=Cast(SearchRank(F('search_vector'), search_query), models.FloatField()),
+        ).order_by('-is_active', '-rank', '-pk')
+
+    def search_similar(self, query):
+        """
+        Typo tolerant search on titles by trigram similarity (when pg_trgm is installed), else substring matching
+        """
+        if not is_trigram_search_available(self.db):
+            return self.filter(title__icontains=query).annotate(similarity=Value(1.0)).order_by('-is_active', '-pk')
+        return self.filter(title__trigram_word_similar=query).annotate(
+            similarity=Cast(TrigramWordSimilarity(query, 'title'), models.FloatField()),
+        ).order_by('-is_active', '-similarity', '-pk')
+
+    def filter_price(self, min_price=None, max_price=None):
+        """
+        Filter by price paid (offer_price is the price when there is no offer)
+        """
+        if min_price is not None:
+            self = self.filter(offer_price__gte=min_price)
+        if max_price is not None:
+            self = self.filter(offer_price__lte=max_price)
+        return self
+
+    def filter_facets(self, colors=(), sizes=(), min_price=None, max_price=None, offer=False):
+        """
+        Filter by facets: an active variant with one of colors and one of sizes, price range and offer
+        """
+        products = self.filter_price(min_price, max_price)
+        if offer:
+            products = products.filter(offer=True)
+        variant_filter = ProductVariant.get_facet_filter(colors, sizes)
+        if variant_filter:
+            products = products.filter(Exists(
+                ProductVariant.objects.filter(variant_filter, product=OuterRef('pk'), is_active=True)
+            ))
+        return products
+
+    def get_facet_counts(self, size_values, colors=(), sizes=(), min_price=None, max_price=None, offer=False):
+        """
+        Count products for every facet value with one grouped aggregate query
+        Each facet is counted with the filters of the other facets (choosing a color doesn't hide other colors)
+        """
+        color_filter = ProductVariant.get_facet_filter(colors=colors)
+        size_filter = ProductVariant.get_facet_filter(sizes=sizes)
+        offer_filter = Q(product__offer=True) if offer else Q()
+
+        aggregates = {
+            f'color_{color}': Count('product', distinct=True, filter=Q(color=color) & size_filter & offer_filter)
+            for color, label in ProductVariant.COLORS
+        }
+        aggregates.update({
+            f'size_{size}': Count('product', distinct=True, filter=Q(size=size) & color_filter & offer_filter)
+            for size in size_values
+        })
+        aggregates['offer'] = Count('product', distinct=True, filter=Q(product__offer=True) & color_filter & size_filter)
+
+        counts = ProductVariant.objects.filter(
+            is_active=True,
+            product__in=self.filter_price(min_price, max_price).values('pk'),
+        ).aggregate(**aggregates)
+        return {
+            'colors': {color: counts[f'color_{color}'] for color, label in ProductVariant.COLORS},
+            'sizes': {size: counts[f'size_{size}'] for size in size_values},
+            'offer': counts['offer'],
+        }
+
+    def rebuild_ratings(self):
+        """
+        Recalculate rating aggregates from scratch with a single UPDATE
+        """
+        rated_comments = Comment.objects.filter(
+            product=OuterRef('pk'),
+            is_active=True,
+            rate__isnull=False,
+        ).values('product')
+        return self.update(
+            rating_sum=Coalesce(Subquery(rated_comments.annotate(total=Sum('rate')).values('total')), 0),
+            rating_count=Coalesce(Subquery(rated_comments.annotate(total=Count('pk')).values('total')), 0),
+        )
+
+
 class Product(models.Model):
     MAJOR_CATEGORIES = (
         ('Women', 'Women'),
@@ -70,13 +276,20 @@ class Product(models.Model):
         )),
     )
 
+    # Lookup tables built once from CATEGORIES (category helpers must not scan the nested tuple)
+    CATEGORY_DISPLAYS = {value: label for group_name, choices in CATEGORIES for value, label in choices}
+    CATEGORY_MAJOR_CATEGORIES = {value: group_name for group_name, choices in CATEGORIES for value, label in choices}
+    MAJOR_CATEGORY_CATEGORIES = {group_name: MappingProxyType(dict(choices)) for group_name, choices in CATEGORIES}
+    CATEGORY_SET = frozenset(CATEGORY_DISPLAYS)
+    MAJOR_CATEGORY_SET = frozenset(MAJOR_CATEGORY_CATEGORIES)
+
     title = models.CharField(_('Title'), max_length=150)
     short_description = models.CharField(_('Short Description'), max_length=700)
     description = HTMLField(verbose_name=_('Description'), )
     material = models.CharField(_('Materials'), max_length=400, blank=True)
     price = models.PositiveIntegerField(_('Price'), )
     is_active = models.BooleanField(_('Is The Product Active ?'), default=True)
-    sell_count = models.PositiveIntegerField(_('How many items of this product were sold?'), default=0)
+    sell_count = models.PositiveIntegerField(_('How many items of this product were sold?'), default=0, editable=False)
 
     # If product is in offer
     offer = models.BooleanField(_('Does this product have an offer?'), default=False)
@@ -89,9 +302,34 @@ class Product(models.Model):
     datetime_modified = models.DateTimeField(_('Datetime Modified'), auto_now=True)
     user = models.ForeignKey(verbose_name=_('User'), to=settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='products')
 
+    # Full text search document of the product (maintained by save)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+
+    # Rating aggregates of active comments (maintained by Comment)
+    rating_sum = models.PositiveIntegerField(_('Sum of Ratings'), default=0, editable=False)
+    rating_count = models.PositiveIntegerField(_('Number of Ratings'), default=0, editable=False)
+
+    # First cover (by position), denormalized so listings show covers without querying them; kept by Cover signals
+    primary_cover = models.ForeignKey(
+        verbose_name=_('Primary Cover'), to='Cover', on_delete=models.SET_NULL, related_name='+',
+        blank=True, null=True, editable=False,
+    )
+
+    # Fields only changed through F-expression updates; never written back from a (maybe stale) instance
+    COUNTER_FIELDS = ('rating_sum', 'rating_count', 'sell_count', )
+    # Fields kept by update queries of other rows (counters, covers, activation by variants)
+    SYNCED_FIELDS = (*COUNTER_FIELDS, 'primary_cover', 'is_active', )
+
     # Manager
-    objects = models.Manager()
-    active_product_manager = ActiveModelManager()
+    objects = ProductQuerySet.as_manager()
+    active_product_manager = ActiveModelManager.from_queryset(ProductQuerySet)()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='products_product_search_gin'),
+            # Category listings (ordered by sell_count)
+            models.Index(fields=['category', 'is_active', '-sell_count'], name='products_category_listing_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -99,28 +337,80 @@ class Product(models.Model):
     def get_absolute_url(self):
         return reverse("products:product_detail", kwargs={"pk": self.pk})
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.set_saved_search_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        self.set_saved_search_values(fields or SEARCHED_FIELDS)
+
+    def get_search_values(self):
+        """
+        Values of the fields the search vector is built from (deferred ones are None)
+        """
+        deferred_fields = self.get_deferred_fields()
+        return {field: None if field in deferred_fields else getattr(self, field) for field in SEARCHED_FIELDS}
+
+    def set_saved_search_values(self, fields=SEARCHED_FIELDS, values=None):
+        """
+        Record the values of the fields as stored in the database (saves rebuild the search vector if they change)
+        """
+        values = values or self.get_search_values()
+        saved_values = dict(getattr(self, '_saved_search_values', {}))
+        saved_values.update((field, values[field]) for field in SEARCHED_FIELDS.intersection(fields))
+        self._saved_search_values = saved_values
+
     def save(self, *args, **kwargs):
         # First, validate the model
         self.full_clean()
 
-        # Save first to get a primary key
-        super().save(*args, **kwargs)
+        # Compute everything before the write, so the row is written only once
+        self.update_derived_fields()
+        update_fields = kwargs.get('update_fields')
+        # Product is active only if it has active variants: variant writes keep it, so it's only computed
+        # for new products (no variants yet) or if asked for
+        if self._state.adding:
+            self.is_active = False
+        elif update_fields is not None and 'is_active' in update_fields:
+            self.is_active = self.variants.filter(is_active=True).exists()
+
+        # Search document is written with the row when a searched field changes (full text search databases only)
+        search_values = self.get_search_values()
+        update_search_vector = is_full_text_search_available(kwargs.get('using') or router.db_for_write(Product)) and (
+            update_fields is None or not SEARCHED_FIELDS.isdisjoint(update_fields)
+        ) and (self._state.adding or search_values != getattr(self, '_saved_search_values', None))
+        if update_search_vector:
+            self.search_vector = get_search_vector(self)
+
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'major_category', 'offer_price'}
+            if update_search_vector:
+                kwargs['update_fields'].add('search_vector')
+        # Don't overwrite counters updated concurrently by other rows
+        elif not self._state.adding:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.SYNCED_FIELDS
+                and (update_search_vector or field.name != 'search_vector')
+            ]
 
-        # Now we can safely check variants (only for existing products)
-        if self.pk:  # Only if product has been saved and has a primary key
-            has_active_variants = self.variants.filter(is_active=True).exists()
-            if self.is_active != has_active_variants:
-                self.is_active = has_active_variants
-                # Save again if changed, but avoid infinite recursion
-                super().save(update_fields=['is_active'])
+        super().save(*args, **kwargs)
+        self.set_saved_search_values(kwargs.get('update_fields') or SEARCHED_FIELDS, search_values)
 
-            self.sell_count = self.get_sell_count()
-            super().save(update_fields=['sell_count'])
+        # The stored vector is an expression result; load it from the database only if it's needed
+        if update_search_vector:
+            del self.search_vector
 
+    def update_derived_fields(self):
+        """
+        Set fields calculated from the product's own fields (major_category, offer_price)
+        """
         self.major_category = self.get_major_category()
         if not self.offer:
             self.offer_price = self.price
-        super().save(update_fields=['major_category', 'offer_price', ])
 
     def clean(self):
         super().clean()
@@ -145,94 +435,88 @@ class Product(models.Model):
         """
         Calculate how many rates given to product
         """
-        return len(self.comments.filter(rate__isnull=False))
+        return self.rating_count
 
     def get_rating_average(self):
         """
         Calculate average rating for product
         """
-        comments = self.comments.filter(rate__isnull=False)
-        if not comments:
+        if not self.rating_count:
             return 0
-        avg_rating = sum(comment.rate for comment in comments) / len(comments)
-        return avg_rating
+        return self.rating_sum / self.rating_count
 
     def get_major_category(self):
         """
         Get the major category group for this product
         """
-        for group_name, choices in self.CATEGORIES:
-            for value, display_name in choices:
-                if value == self.category:
-                    return group_name
-        return None
+        return self.CATEGORY_MAJOR_CATEGORIES.get(self.category)
 
     @classmethod
     def get_categories_from_major_cat(cls, major_category):
         """
-        Get categories in each major category by having major_category
+        Get categories in each major category by having major_category (read-only {category: display})
         """
-        for key, values in cls.CATEGORIES:
-            if key == major_category:
-                categories = {value[0]:value[1] for value in values}
-                return categories
-        return None
+        return cls.MAJOR_CATEGORY_CATEGORIES.get(major_category)
 
     @classmethod
     def get_major_categories_list(cls):
         """
         A class method to get all major categories in a list
         """
-        return [group_name for group_name, subgroups in cls.CATEGORIES]
+        return list(cls.MAJOR_CATEGORY_CATEGORIES)
 
     @classmethod
     def get_categories_list(cls):
         """
         A class method to get all categories of the model in a list
         """
-        categories_list = []
-        for group_name, subgroups in cls.CATEGORIES:
-            for value, label in subgroups:
-                categories_list.append(value)
-        return categories_list
+        return list(cls.CATEGORY_DISPLAYS)
 
     @classmethod
     def find_category_display_from_category(cls, category):
-        for group_name, subgroups in cls.CATEGORIES:
-            for value, label in subgroups:
-                if value == category:
-                    return label
-        return None
+        return cls.CATEGORY_DISPLAYS.get(category)
 
     @classmethod
     def find_category_from_category_display(cls, display):
-        for group_name, subgroups in cls.CATEGORIES:
-            for value, label in subgroups:
-                if label == display:
-                    return value
-        return None
+        """
+        Find category by its display name in the active language (the map is built once per language)
+        """
+        language = get_language()
+        categories = _categories_by_display.get(language)
+        if categories is None:
+            categories = {}
+            for value, label in cls.CATEGORY_DISPLAYS.items():
+                categories.setdefault(str(label), value)
+            _categories_by_display[language] = categories
+        return categories.get(str(display))
 
     def sync_is_active_and_variants(self):
         """
-        Set 'is_active' False if there is no active variants
+        Set 'is_active' False if there is no active variants (writes the row only if it changes)
         """
-        self.is_active = True if self.variants.filter(is_active=True).exists() else False
-        self.save()
+        self.is_active = self.variants.filter(is_active=True).exists()
+        Product.objects.filter(pk=self.pk).exclude(is_active=self.is_active).update(is_active=self.is_active)
 
     def get_sell_count(self):
         """
-        Calculate how many variants from product were sold (from order_items)
+        Calculate how many variants from product were sold (from order_items of paid orders)
         """
-        sell_count = 0
-        for variant in self.variants.all():
-            for item in variant.order_items.all():
-                sell_count += item.quantity
-        return sell_count
+        return self.variants.filter(order_items__order__is_paid=True).aggregate(
+            total=Coalesce(Sum('order_items__quantity'), 0)
+        )['total']
 
     @property
     def active_variants(self):
+        if hasattr(self, 'listing_active_variants'):
+            return self.listing_active_variants
         return self.variants.filter(is_active=True)
 
+    def get_first_cover(self):
+        """
+        Get the first cover of the product (no query if primary_cover is selected, like in for_listing)
+        """
+        return self.primary_cover
+
     def get_active_variants_colors(self):
         colors = {}
         for variant in self.active_variants:
@@ -282,6 +566,7 @@ class ProductVariant(models.Model):
 
         ('ShoesCare', tuple((i, str(i)) for i in range(36,46))),
     )
+    SIZES_BY_MAJOR_CATEGORY = dict(SIZES)
 
     color = models.CharField(_('Color'), max_length=2, choices=COLORS)
     size = models.PositiveIntegerField(_('Size'), choices=SIZES)
@@ -292,26 +577,58 @@ class ProductVariant(models.Model):
 
     class Meta:
         unique_together = ['product', 'color', 'size']  # Prevent duplicates
+        indexes = [
+            # Facet filters and counts of listings
+            models.Index(fields=['product', 'is_active', 'color', 'size'], name='products_variant_facets_idx'),
+        ]
 
     def __str__(self):
         return f'{self.product.title} - Color: {self.get_color_display()} - Size: {self.size}'
 
+    @staticmethod
+    def get_facet_filter(colors=(), sizes=()):
+        """
+        Q of variants having one of colors and one of sizes (empty Q if there is no filter)
+        """
+        variant_filter = Q()
+        if colors:
+            variant_filter &= Q(color__in=colors)
+        if sizes:
+            variant_filter &= Q(size__in=sizes)
+        return variant_filter
+
     def save(self, *args, **kwargs):
         """
-        Auto-sync is_active before saving
+        Auto-sync is_active before saving (single write) and sync product's is_active
         """
-        super().save(*args, **kwargs)
         self.is_active = self.quantity > 0
-        super().save(update_fields=['is_active',])
-        self.product.sync_is_active_and_variants()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'is_active'}
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.sync_product_is_active()
+
+    def sync_product_is_active(self):
+        """
+        Activate or deactivate the product of variant (writes the product row only if it changes)
+        """
+        if self.is_active:
+            product_is_active = True
+        else:
+            product_is_active = ProductVariant.objects.filter(product_id=self.product_id, is_active=True).exists()
+        Product.objects.filter(pk=self.product_id).exclude(is_active=product_is_active).update(
+            is_active=product_is_active
+        )
+        if ProductVariant.product.is_cached(self):
+            self.product.is_active = product_is_active
 
     def sync_is_active_quantity(self):
         """
         Set variant active based on quantity
         """
-        self.as_active = self.quantity > 0
-        self.save()
-        self.product.sync_is_active_and_variants()
+        self.save(update_fields=['is_active'])
 
     def is_available(self, requested_quantity):
         """
@@ -325,18 +642,20 @@ class ProductVariant(models.Model):
         """
         if self.is_available(quantity):
             self.quantity -= quantity
-            self.save()
-            self.sync_is_active_quantity()
+            self.save(update_fields=['quantity'])
 
     def increase_quantity(self, quantity):
         self.quantity += quantity
-        self.save()
-        self.sync_is_active_quantity()
+        self.save(update_fields=['quantity'])
 
 
 class Cover(models.Model):
     product = models.ForeignKey(verbose_name=_('Product'), to=Product, on_delete=models.CASCADE, related_name='covers')
     cover = models.ImageField(_('Product Cover'), upload_to='products/covers/')
+    position = models.PositiveIntegerField(_('Position'), default=0)
+
+    class Meta:
+        ordering = ('position', 'pk', )
 
     def __str__(self):
         return str(self.product)
@@ -373,5 +692,34 @@ class Comment(models.Model):
     def __str__(self):
         return f'{self.product} - {self.rate}'
 
+    def save(self, *args, **kwargs):
+        """
+        Keep product's rating aggregates in sync with the comment
+        """
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = Comment.objects.select_for_update().filter(pk=self.pk).values(
+                    'product_id', 'rate', 'is_active'
+                ).first()
+            super().save(*args, **kwargs)
+
+            current = {'product_id': self.product_id, 'rate': self.rate, 'is_active': self.is_active}
+            if previous == current:
+                return
+            if previous:
+                Comment.shift_product_rating(
+                    previous['product_id'], previous['rate'], previous['is_active'], sign=-1
+                )
+            Comment.shift_product_rating(self.product_id, self.rate, self.is_active)
+
+    @staticmethod
+    def shift_product_rating(product_id, rate, is_active, sign=1):
+        """
+        Add (or remove with sign=-1) a rating to product's aggregates
+        """
+        if rate and is_active:
+            Product.objects.add_rating([product_id], sign * rate, sign)
+
     def get_absolute_url(self):
         return reverse("products:product_detail", kwargs={"pk": self.product.pk})
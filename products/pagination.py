@@ -0,0 +1,152 @@
+import hashlib
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination: pages continue from the ordering values of the last (or first) row of the previous page
+    So deep pages cost the same as the first one (no OFFSET) and pages don't run COUNT(*)
+    Ordering fields must be not null and end with a unique field (pk)
+    """
+    is_keyset = True
+    salt = 'products.pagination.cursor'
+
+    def __init__(self, queryset, per_page, ordering, count_timeout=None):
+        self.queryset = queryset.order_by(*ordering)
+        self.per_page = per_page
+        self.ordering = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        self.count_timeout = settings.PRODUCT_LISTING_COUNT_TIMEOUT if count_timeout is None else count_timeout
+
+    @cached_property
+    def count(self):
+        """
+        Approximate number of rows: counted only if it's used (templates), then kept in cache for count_timeout seconds
+        """
+        key = 'keyset-count:' + hashlib.md5(str(self.queryset.query).encode()).hexdigest()
+        return cache.get_or_set(key, self.queryset.order_by().count, self.count_timeout)
+
+    @property
+    def num_pages(self):
+        return max(1, -(-self.count // self.per_page))
+
+    def get_field_value(self, obj, name):
+        return obj.pk if name == 'pk' else getattr(obj, name)
+
+    def encode_cursor(self, obj, before=False):
+        values = []
+        for name, descending in self.ordering:
+            value = self.get_field_value(obj, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return signing.dumps({'values': values, 'before': before}, salt=self.salt)
+
+    def decode_cursor(self, cursor):
+        """
+        Ordering values and direction of cursor (None for invalid cursors, so they show the first page)
+        """
+        try:
+            data = signing.loads(cursor, salt=self.salt)
+            values = []
+            for (name, descending), value in zip(self.ordering, data['values'], strict=True):
+                try:
+                    field = self.queryset.model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    # Annotations (like search rank) are numbers
+                    values.append(value)
+                else:
+                    values.append(field.to_python(value))
+            return values, bool(data['before'])
+        except (signing.BadSignature, KeyError, TypeError, ValueError, ValidationError):
+            return None
+
+    def get_filter(self, values, before):
+        """
+        Rows after (or before) the row having values in the ordering
+        """
+        keyset_filter = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.ordering, values):
+            lookup = 'lt' if descending != before else 'gt'
+            keyset_filter |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return keyset_filter
+
+    def get_page(self, cursor=None):
+        decoded = self.decode_cursor(cursor) if cursor else None
+
+        if decoded is None:
+            rows = list(self.queryset[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], self, has_next=len(rows) > self.per_page, has_previous=False)
+
+        values, before = decoded
+        queryset = self.queryset.filter(self.get_filter(values, before))
+        if before:
+            queryset = queryset.reverse()
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if before:
+            return KeysetPage(rows[::-1], self, has_next=True, has_previous=has_more)
+        return KeysetPage(rows, self, has_next=has_more, has_previous=True)
+
+
+class KeysetPage:
+    """
+    Page of KeysetPaginator (like django.core.paginator.Page without page numbers)
+    """
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<Keyset page of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @cached_property
+    def next_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[-1]) if self._has_next and self.object_list else None
+
+    @cached_property
+    def previous_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[0], before=True) if self._has_previous and self.object_list else None
+
+
+def paginate_listing(request, queryset, per_page, ordering):
+    """
+    Paginate a product listing with keyset or offset pagination (settings.PRODUCT_LISTING_PAGINATION)
+    Returns (paginator, page)
+    """
+    if settings.PRODUCT_LISTING_PAGINATION == 'keyset':
+        paginator = KeysetPaginator(queryset, per_page, ordering)
+        return paginator, paginator.get_page(request.GET.get('cursor'))
+
+    paginator = Paginator(queryset.order_by(*ordering), per_page)
+    return paginator, paginator.get_page(request.GET.get('page'))
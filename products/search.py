@@ -0,0 +1,57 @@
+from django.contrib.postgres.search import SearchVector
+from django.db import connections
+from django.db.models import Value
+
+
+# Persian has no stemming dictionary in Postgres; 'simple' works the same for Persian and English words
+SEARCH_CONFIG = 'simple'
+
+# Columns of the stored search vector, most relevant first
+SEARCH_VECTOR_FIELDS = (
+    (('title',), 'A'),
+    (('category', 'major_category'), 'B'),
+    (('short_description',), 'C'),
+    (('material',), 'D'),
+)
+SEARCHED_FIELDS = frozenset(field for fields, weight in SEARCH_VECTOR_FIELDS for field in fields)
+
+# Name of the trigram index on Product.title (only created when pg_trgm is available)
+TITLE_TRIGRAM_INDEX = 'products_product_title_trgm'
+
+# {database alias: whether pg_trgm is installed}
+_trigram_extension_installed = {}
+
+
+def get_search_vector(product=None):
+    """
+    Weighted search vector of product columns (stored in Product.search_vector)
+    With a product, the vector is built from its values, so it can be written in the same INSERT/UPDATE
+    """
+    vector = None
+    for fields, weight in SEARCH_VECTOR_FIELDS:
+        if product is not None:
+            fields = [Value(getattr(product, field) or '') for field in fields]
+        field_vector = SearchVector(*fields, weight=weight, config=SEARCH_CONFIG)
+        vector = field_vector if vector is None else vector + field_vector
+    return vector
+
+
+def is_full_text_search_available(using='default'):
+    """
+    Full text search needs postgres (other databases fall back to substring matching)
+    """
+    return connections[using].vendor == 'postgresql'
+
+
+def is_trigram_search_available(using='default'):
+    """
+    Check once per database whether pg_trgm extension is installed
+    """
+    if using not in _trigram_extension_installed:
+        installed = False
+        if is_full_text_search_available(using):
+            with connections[using].cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                installed = cursor.fetchone() is not None
+        _trigram_extension_installed[using] = installed
+    return _trigram_extension_installed[using]
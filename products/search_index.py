@@ -0,0 +1,245 @@
+import bisect
+import json
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils import translation
+
+
+logger = logging.getLogger(__name__)
+
+# Arabic letters typed instead of Persian ones, diacritics and ZWNJ (half space) are normalized away
+PERSIAN_TRANSLATION = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ك': 'ک', 'ة': 'ه', 'ۀ': 'ه', 'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا',
+    '\u200c': ' ', '\u200f': None, '\u200e': None, '\u0640': None,
+    **{chr(code): None for code in range(0x064B, 0x0653)},
+    # Persian and Arabic-Indic digits (as written by number_farsi)
+    **dict(zip('۰۱۲۳۴۵۶۷۸۹', '0123456789')),
+    **dict(zip('٠١٢٣٤٥٦٧٨٩', '0123456789')),
+})
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """
+    Normalize Persian/English text for search (letters, digits, half spaces and case)
+    """
+    return str(text).translate(PERSIAN_TRANSLATION).casefold()
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(normalize(text))
+
+
+# {category: tokens of its labels in every language}, filled on first use (translations aren't ready at import)
+_category_tokens = {}
+
+
+def get_category_tokens(product):
+    tokens = _category_tokens.get(product.category)
+    if tokens is None:
+        tokens = set(tokenize(product.category))
+        label = product.CATEGORY_DISPLAYS.get(product.category)
+        if label is not None:
+            for language, name in settings.LANGUAGES:
+                with translation.override(language):
+                    tokens.update(tokenize(label))
+        tokens = _category_tokens[product.category] = frozenset(tokens)
+    return tokens
+
+
+def get_product_tokens(product):
+    """
+    Tokens of a product: title, short description, material, category and its labels in every language
+    """
+    texts = [product.title, product.short_description, product.material]
+    return get_category_tokens(product).union(token for text in texts if text for token in tokenize(text))
+
+
+class ProductSearchIndex:
+    """
+    In-process inverted index of products: {token: {product_id}}
+    Tokens are also kept sorted, so each query term matches as a prefix with a binary search
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.sorted_tokens = []
+        # {product_id: (is_active, tokens)}, needed to order results and to remove old tokens on updates
+        self.documents = {}
+        self.built_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, product_id, is_active, tokens):
+        with self.lock:
+            self._remove(product_id)
+            self.documents[product_id] = (is_active, frozenset(tokens))
+            for token in tokens:
+                product_ids = self.postings.get(token)
+                if product_ids is None:
+                    product_ids = self.postings[token] = set()
+                    bisect.insort(self.sorted_tokens, token)
+                product_ids.add(product_id)
+
+    def add_product(self, product):
+        self.add(product.pk, product.is_active, get_product_tokens(product))
+
+    def remove(self, product_id):
+        with self.lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id):
+        document = self.documents.pop(product_id, None)
+        if document is None:
+            return
+        for token in document[1]:
+            product_ids = self.postings[token]
+            product_ids.discard(product_id)
+            if not product_ids:
+                del self.postings[token]
+                del self.sorted_tokens[bisect.bisect_left(self.sorted_tokens, token)]
+
+    def match_prefix(self, prefix):
+        """
+        Ids of products having a token starting with prefix
+        """
+        product_ids = set()
+        position = bisect.bisect_left(self.sorted_tokens, prefix)
+        while position < len(self.sorted_tokens) and self.sorted_tokens[position].startswith(prefix):
+            product_ids |= self.postings[self.sorted_tokens[position]]
+            position += 1
+        return product_ids
+
+    def search(self, query):
+        """
+        Ids of products matching every term of query (as prefix), active and newest products first
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self.lock:
+            # Rarest terms first, so the intersection shrinks as early as possible
+            matches = sorted((self.match_prefix(term) for term in set(terms)), key=len)
+            product_ids = set.intersection(*matches)
+            return sorted(product_ids, key=lambda product_id: (not self.documents[product_id][0], -product_id))
+
+    def dump(self, path):
+        """
+        Save a snapshot of the index (JSON) to be loaded at startup instead of reading all products
+        """
+        with self.lock:
+            documents = {
+                product_id: [is_active, sorted(tokens)] for product_id, (is_active, tokens) in self.documents.items()
+            }
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(documents, file, ensure_ascii=False)
+
+    @classmethod
+    def from_documents(cls, documents):
+        """
+        Build from (product_id, is_active, tokens), sorting the tokens once (not one insertion per token)
+        """
+        index = cls()
+        for product_id, is_active, tokens in documents:
+            tokens = frozenset(tokens)
+            index.documents[product_id] = (is_active, tokens)
+            for token in tokens:
+                index.postings.setdefault(token, set()).add(product_id)
+        index.sorted_tokens = sorted(index.postings)
+        return index
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as file:
+            documents = json.load(file)
+        return cls.from_documents(
+            (int(product_id), is_active, tokens) for product_id, (is_active, tokens) in documents.items()
+        )
+
+    @classmethod
+    def build(cls, products):
+        return cls.from_documents(
+            (product.pk, product.is_active, get_product_tokens(product)) for product in products.iterator(chunk_size=2000)
+        )
+
+
+_index = None
+# Held while the index is built (one builder at a time)
+_index_lock = threading.Lock()
+
+
+def get_product_search_index():
+    """
+    Get the index of this process; built from the snapshot (if there is one) or from the database on first use,
+    unless it was warmed up at startup (warm_up_product_search_index)
+    Other processes update their own index, so it is rebuilt from the database after PRODUCT_SEARCH_INDEX_MAX_AGE,
+    in the background: searches keep using the stale index meanwhile
+    """
+    index = _index
+    if index is None:
+        return warm_up_product_search_index()
+    if time.monotonic() - index.built_at >= settings.PRODUCT_SEARCH_INDEX_MAX_AGE and _index_lock.acquire(blocking=False):
+        threading.Thread(target=rebuild_index, args=(index,), daemon=True).start()
+    return index
+
+
+def warm_up_product_search_index():
+    """
+    Load or build the index of this process if it isn't built yet (gunicorn workers do it at startup)
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = load_or_build_index()
+        return _index
+
+
+def rebuild_index(stale_index):
+    """
+    Replace the stale index by one built from the database (runs in the background, holding _index_lock)
+    """
+    global _index
+    try:
+        index = load_or_build_index(use_snapshot=False)
+        if _index is stale_index:
+            _index = index
+    except Exception:
+        logger.exception('Rebuilding the product search index failed')
+    finally:
+        # Background threads don't close their connections with requests
+        connections.close_all()
+        _index_lock.release()
+
+
+def load_or_build_index(use_snapshot=True):
+    from .models import Product
+
+    snapshot = settings.PRODUCT_SEARCH_INDEX_SNAPSHOT
+    if use_snapshot and snapshot:
+        try:
+            return ProductSearchIndex.load(snapshot)
+        except FileNotFoundError:
+            pass
+    return ProductSearchIndex.build(Product.objects.only(
+        'pk', 'is_active', 'title', 'short_description', 'material', 'category',
+    ))
+
+
+def get_built_product_search_index():
+    """
+    Get the index only if this process has already built it (signals don't build it)
+    """
+    return _index
+
+
+def reset_product_search_index():
+    global _index
+    _index = None
@@ -0,0 +1,105 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Comment, Cover, Product, ProductVariant
+from .catalog_cache import invalidate_catalog, invalidate_products
+from .search_index import get_built_product_search_index
+from .autocomplete import get_built_product_suggestions
+from shared.images import delete_derivatives, schedule_derivatives
+
+
+@receiver(post_save, sender=Cover)
+def create_cover_derivatives(sender, instance, raw=False, **kwargs):
+    """
+    Create thumbnails (WebP/JPEG at fixed widths) of uploaded covers in the background
+    """
+    if not raw:
+        schedule_derivatives(instance.cover)
+
+
+@receiver(post_delete, sender=Cover)
+def delete_cover_derivatives(sender, instance, **kwargs):
+    delete_derivatives(instance.cover.storage, instance.cover.name)
+
+
+@receiver(post_save, sender=Cover)
+@receiver(post_delete, sender=Cover)
+def update_primary_cover(sender, instance, raw=False, **kwargs):
+    """
+    Keep product's primary_cover the first of its covers (runs on cascade deletes too)
+    """
+    if not raw:
+        Product.objects.update_primary_covers([instance.product_id])
+
+
+@receiver(post_delete, sender=Comment)
+def remove_comment_rating(sender, instance, **kwargs):
+    """
+    Remove deleted comment's rate from product's aggregates (runs on cascade deletes too)
+    """
+    Comment.shift_product_rating(instance.product_id, instance.rate, instance.is_active, sign=-1)
+
+
+def get_built_indexes():
+    """
+    Search structures already built by this process (signals don't build them)
+    """
+    return [index for index in (get_built_product_search_index(), get_built_product_suggestions()) if index is not None]
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """
+    Update the product in the search index and autocomplete suggestions of this process
+    """
+    for index in get_built_indexes():
+        index.add_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    for index in get_built_indexes():
+        index.remove(instance.pk)
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def update_indexed_product_activation(sender, instance, **kwargs):
+    """
+    Variants change product's is_active (after their own write), so read the product once the transaction is committed
+    """
+    indexes = get_built_indexes()
+    if indexes:
+        product_id = instance.product_id
+        transaction.on_commit(lambda: reindex_product(product_id, indexes))
+
+
+def reindex_product(product_id, indexes):
+    product = Product.objects.only(
+        'pk', 'is_active', 'title', 'short_description', 'material', 'category', 'sell_count',
+    ).filter(pk=product_id).first()
+    for index in indexes:
+        if product is None:
+            index.remove(product_id)
+        else:
+            index.add_product(product)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_cache(sender, **kwargs):
+    """
+    Product changes may change which products cached catalog fragments list
+    (covers, comments and product activation are handled by their updates of products)
+    """
+    invalidate_catalog()
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def invalidate_product_catalog_cache(sender, instance, **kwargs):
+    """
+    Product cards show whether the product has active variants
+    """
+    invalidate_products([instance.product_id])
@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.db.models import F, Case, When, Value
+
+from .models import Product, ProductVariant
+
+
+class InsufficientStockError(Exception):
+    """
+    Raised when some variants don't have enough quantity for a reservation
+    """
+
+    def __init__(self, failed_variant_ids):
+        self.failed_variant_ids = failed_variant_ids
+        super().__init__(f'Not enough stock for variants: {failed_variant_ids}')
+
+
+class StockService:
+    """
+    Write paths for stock and activation of products and variants
+    Every row is written at most once; product activation is synced with one UPDATE per batch
+    """
+
+    @staticmethod
+    def bulk_create_products(products, batch_size=500):
+        """
+        Validate and insert new products in batches (for import jobs), with their search vectors
+        """
+        for product in products:
+            product.full_clean()
+            product.update_derived_fields()
+            # New products don't have variants yet
+            product.is_active = False
+        with transaction.atomic():
+            products = Product.objects.bulk_create(products, batch_size=batch_size)
+            Product.objects.filter(pk__in=[product.pk for product in products]).update_search_vectors()
+        return products
+
+    @staticmethod
+    def bulk_save_variants(variants, deleted_variants=(), batch_size=500):
+        """
+        Insert, update and delete variants in batches and sync activation of their products once
+        """
+        new_variants, existing_variants = [], []
+        for variant in variants:
+            variant.is_active = variant.quantity > 0
+            if variant.pk:
+                existing_variants.append(variant)
+            else:
+                new_variants.append(variant)
+
+        product_ids = {variant.product_id for variant in variants}
+        product_ids.update(variant.product_id for variant in deleted_variants)
+
+        with transaction.atomic():
+            ProductVariant.objects.filter(pk__in=[variant.pk for variant in deleted_variants]).delete()
+            ProductVariant.objects.bulk_create(new_variants, batch_size=batch_size)
+            ProductVariant.objects.bulk_update(
+                existing_variants,
+                ['color', 'size', 'quantity', 'is_active'],
+                batch_size=batch_size,
+            )
+            Product.objects.filter(pk__in=product_ids).sync_activation()
+
+        return new_variants + existing_variants
+
+    @staticmethod
+    def reserve_variants(quantities):
+        """
+        Decrease quantities of variants ({variant_id: quantity}) all or nothing
+        Each variant is decremented by one conditional UPDATE (quantity >= requested), so concurrent
+        buyers can't oversell. Raises InsufficientStockError with all failed variant ids and rolls back.
+        """
+        failed_variant_ids = []
+        with transaction.atomic():
+            # Always lock rows in the same order to avoid deadlocks between concurrent checkouts
+            for variant_id, quantity in sorted(quantities.items()):
+                updated = ProductVariant.objects.filter(pk=variant_id, is_active=True, quantity__gte=quantity).update(
+                    quantity=F('quantity') - quantity,
+                    is_active=Case(When(quantity__gt=quantity, then=Value(True)), default=Value(False)),
+                )
+                if not updated:
+                    failed_variant_ids.append(variant_id)
+
+            if failed_variant_ids:
+                raise InsufficientStockError(failed_variant_ids)
+
+            Product.objects.filter(variants__in=list(quantities)).sync_activation()
+
+    @staticmethod
+    def release_variants(quantities):
+        """
+        Give reserved quantities ({variant_id: quantity}) back to variants (e.g. canceled orders)
+        """
+        with transaction.atomic():
+            for variant_id, quantity in sorted(quantities.items()):
+                if quantity > 0:
+                    ProductVariant.objects.filter(pk=variant_id).update(quantity=F('quantity') + quantity, is_active=True)
+            Product.objects.filter(variants__in=list(quantities)).sync_activation()
@@ -1,6 +1,7 @@
 from django import template
 
 from products.models import Product
+from products.catalog_cache import get_or_build, show_product
 
 
 register = template.Library()
@@ -18,8 +19,47 @@ def turn_number_to_letter(value):
 
 @register.filter
 def find_category_from_category_display_product(display):
-    for group_name, subgroups in Product.CATEGORIES:
-        for value, label in subgroups:
-            if label == display:
-                return value
-    return None
+    return Product.find_category_from_category_display(display)
+
+
+class CatalogCacheNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        return get_or_build(
+            self.name.resolve(context),
+            lambda: self.nodelist.render(context),
+            [value.resolve(context) for value in self.vary_on],
+        )
+
+
+@register.tag
+def catalog_cache(parser, token):
+    """
+    Cache a fragment showing products until the catalog changes (products.catalog_cache)
+    Querysets used only inside the fragment aren't evaluated when it's cached
+
+        {% catalog_cache 'name' [vary_on ...] %} ... {% endcatalog_cache %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a fragment name")
+    nodelist = parser.parse(('endcatalog_cache',))
+    parser.delete_first_token()
+    return CatalogCacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        [parser.compile_filter(bit) for bit in bits[2:]],
+    )
+
+
+@register.simple_tag
+def catalog_product(product):
+    """
+    Changes of the product invalidate the cached fragment showing it (products.catalog_cache)
+    """
+    show_product(product.pk)
+    return ''
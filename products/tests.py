@@ -1,12 +1,58 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
 from django.contrib.auth import get_user_model, login
 from django.urls import reverse
+from django.db import connection
+from django.utils import translation
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+
+from io import StringIO
+import gc
+import os
+import statistics
+import tempfile
+from unittest import mock, skipUnless
+import threading
+import time
 
 from .models import Product, ProductVariant, Cover, Comment
+from .stock_service import StockService, InsufficientStockError
+from .search_index import (
+    ProductSearchIndex, get_product_search_index, get_built_product_search_index, normalize,
+    reset_product_search_index,
+)
+from .autocomplete import (
+    ProductSuggestions, get_built_product_suggestions, get_keys, get_product_suggestions, reset_product_suggestions,
+)
+from .pagination import KeysetPaginator
+from .catalog_cache import get_cache, get_generation, bump_generation, get_or_build
+from shared.testing import QueryBudgetMixin
 
 
 User = get_user_model()
 
+
+def make_product(user, variants=(), **fields):
+    """
+    Create a product of user (a men's sport shoe unless fields say otherwise) with variants: (color, size, quantity)
+    Products with variants are read again (variants change their activation)
+    """
+    product = Product.objects.create(user=user, **{
+        'title': 'TestTitle',
+        'short_description': 'Test Short description',
+        'description': 'TestProductDescription',
+        'category': 'm-sport',
+        'price': 4560000,
+        **fields,
+    })
+    for color, size, quantity in variants:
+        ProductVariant.objects.create(product=product, color=color, size=size, quantity=quantity)
+    if variants:
+        product.refresh_from_db()
+    return product
+
+
 class ProductTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -112,6 +158,42 @@ class ProductTest(TestCase):
         )
 
 
+class CategoryLookupTest(TestCase):
+    def test_lookups(self):
+        """
+        Category helpers answer from the precomputed tables
+        """
+        self.assertEqual(Product.CATEGORY_MAJOR_CATEGORIES['hats'], 'Clothing')
+        self.assertIn('wax', Product.CATEGORY_SET)
+        self.assertNotIn('Men', Product.CATEGORY_SET)
+        self.assertIn('Men', Product.MAJOR_CATEGORY_SET)
+        with self.assertRaises(TypeError):
+            Product.get_categories_from_major_cat('Men')['m-new'] = 'New'
+        self.assertIsNone(Product.get_categories_from_major_cat('Nothing'))
+        self.assertIsNone(Product.find_category_display_from_category('nothing'))
+
+    def test_display_lookup_per_language(self):
+        """
+        Display -> category map is built once for each language
+        """
+        for language in ('en', 'fa'):
+            with translation.override(language):
+                display = str(Product.find_category_display_from_category('w-heels'))
+                self.assertEqual(Product.find_category_from_category_display(display), 'w-heels')
+                self.assertEqual(Product.find_category_from_category_display('nothing'), None)
+        # First match wins for duplicate labels
+        self.assertEqual(Product.find_category_from_category_display('Men'), 'm-accessories')
+
+    def test_category_view_checks_major_category(self):
+        """
+        Category must belong to the major category in the url
+        """
+        url = reverse('products:product_category_list', args=['Men', 'w-heels'])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        url = reverse('products:product_category_list', args=['Women', 'w-heels'])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
 class ProductVariantTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -206,6 +288,174 @@ class ProductVariantTest(TestCase):
         self.assertTrue(self.variant.is_active)
 
 
+class StockWritePathTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+
+    def count_writes(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return {
+            table: sum(1 for query in context.captured_queries
+                       if query['sql'].startswith(('INSERT', 'UPDATE')) and f'"{table}"' in query['sql'].split(' SET ')[0])
+            for table in ('products_product', 'products_productvariant')
+        }
+
+    def test_product_save_writes_once(self):
+        product = make_product(self.user)
+        self.assertEqual(product.major_category, 'Men')
+        self.assertEqual(product.offer_price, product.price)
+
+        product.price = 5000000
+        writes = self.count_writes(product.save)
+        self.assertEqual(writes['products_product'], 1)
+        product.refresh_from_db()
+        self.assertEqual(product.offer_price, 5000000)
+
+    def test_product_save_keeps_activation_of_variants(self):
+        """
+        Product saves don't query variants (their writes keep is_active), even with a stale product
+        """
+        product = make_product(self.user)
+        stale_product = Product.objects.get(pk=product.pk)
+        ProductVariant.objects.create(product=product, quantity=3, color='bk', size=41)
+
+        stale_product.price = 5000000
+        with CaptureQueriesContext(connection) as context:
+            stale_product.save()
+        self.assertFalse([query for query in context.captured_queries if 'products_productvariant' in query['sql']])
+        self.assertTrue(Product.objects.get(pk=product.pk).is_active)
+
+    def test_variant_save_writes_each_row_at_most_once(self):
+        product = make_product(self.user)
+        variant = ProductVariant(product=product, quantity=3, color='bk', size=41)
+        writes = self.count_writes(variant.save)
+        self.assertEqual(writes, {'products_product': 1, 'products_productvariant': 1})
+        self.assertTrue(product.is_active)
+
+        # Product is already active: its conditional UPDATE doesn't match any row
+        writes = self.count_writes(lambda: variant.decrease_quantity(1))
+        self.assertEqual(writes, {'products_product': 1, 'products_productvariant': 1})
+        self.assertTrue(Product.objects.get(pk=product.pk).is_active)
+
+        writes = self.count_writes(lambda: variant.decrease_quantity(2))
+        self.assertEqual(writes, {'products_product': 1, 'products_productvariant': 1})
+        product.refresh_from_db()
+        self.assertFalse(product.is_active)
+
+    def test_bulk_save_variants(self):
+        products = StockService.bulk_create_products([
+            Product(title=f'Bulk {i}', short_description='Short', description='Description',
+                    category='hats', price=100000, user=self.user)
+            for i in range(3)
+        ])
+        self.assertTrue(all(product.major_category == 'Clothing' for product in products))
+        self.assertTrue(all(product.offer_price == 100000 for product in products))
+        self.assertEqual(set(Product.objects.search('bulk')), set(products))
+
+        variants = [
+            ProductVariant(product=product, quantity=quantity, color='bk', size=40)
+            for product, quantity in zip(products, [2, 0, 5])
+        ]
+        with self.assertNumQueries(4):
+            StockService.bulk_save_variants(variants)
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=[p.pk for p in products]).order_by('pk').values_list('is_active', flat=True)),
+            [True, False, True],
+        )
+
+        # Update one variant and delete another
+        variants[0].quantity = 0
+        StockService.bulk_save_variants([variants[0]], deleted_variants=[variants[2]])
+        self.assertFalse(Product.objects.filter(pk__in=[products[0].pk, products[2].pk], is_active=True).exists())
+        self.assertFalse(ProductVariant.objects.filter(pk=variants[2].pk).exists())
+
+
+class StockReservationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.product = make_product(cls.user, variants=[('bk', 41, 2), ('we', 42, 1)])
+        cls.variant1, cls.variant2 = cls.product.variants.order_by('pk')
+
+    def test_reserve_variants(self):
+        """
+        Reserve all quantities and deactivate sold-out variants and products
+        """
+        StockService.reserve_variants({self.variant1.id: 2, self.variant2.id: 1})
+        self.variant1.refresh_from_db()
+        self.variant2.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((self.variant1.quantity, self.variant1.is_active), (0, False))
+        self.assertEqual((self.variant2.quantity, self.variant2.is_active), (0, False))
+        self.assertFalse(self.product.is_active)
+
+        StockService.release_variants({self.variant2.id: 1})
+        self.variant2.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((self.variant2.quantity, self.variant2.is_active), (1, True))
+        self.assertTrue(self.product.is_active)
+
+    def test_reserve_variants_failure_rolls_back(self):
+        """
+        If a line can't be reserved nothing is reserved and all failed lines are reported
+        """
+        with self.assertRaises(InsufficientStockError) as context:
+            StockService.reserve_variants({self.variant1.id: 1, self.variant2.id: 2})
+        self.assertEqual(context.exception.failed_variant_ids, [self.variant2.id])
+
+        self.variant1.refresh_from_db()
+        self.variant2.refresh_from_db()
+        self.assertEqual(self.variant1.quantity, 2)
+        self.assertEqual(self.variant2.quantity, 1)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentStockReservationTest(TransactionTestCase):
+    def test_concurrent_buyers_of_last_unit(self):
+        """
+        Many buyers reserve the last unit at the same time; exactly one of them gets it
+        """
+        user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        variant = make_product(user, variants=[('bk', 41, 1)]).variants.get()
+
+        buyers_count = 8
+        barrier = threading.Barrier(buyers_count)
+        results = []
+
+        def buy():
+            try:
+                barrier.wait()
+                StockService.reserve_variants({variant.id: 1})
+                results.append(True)
+            except InsufficientStockError:
+                results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(buyers_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(results.count(False), buyers_count - 1)
+        variant.refresh_from_db()
+        self.assertEqual(variant.quantity, 0)
+        self.assertFalse(variant.is_active)
+
+
 class CommentTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -239,6 +489,67 @@ class CommentTest(TestCase):
         self.assertEqual(self.comment.get_absolute_url(), url)
 
 
+class CommentRatingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.product = make_product(cls.user, category='w-jackets')
+
+    def assertRating(self, rating_sum, rating_count):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_sum, rating_sum)
+        self.assertEqual(self.product.rating_count, rating_count)
+
+    def test_rating_aggregates(self):
+        """
+        Test rating aggregates through creating, editing, deactivating and deleting comments
+        """
+        comment1 = Comment.objects.create(text='comment 1', product=self.product, rate=5)
+        comment2 = Comment.objects.create(text='comment 2', product=self.product, rate=2)
+        Comment.objects.create(text='comment without rate', product=self.product)
+        self.assertRating(7, 2)
+        self.assertEqual(self.product.get_rating_average(), 3.5)
+        self.assertEqual(self.product.get_rating_counts(), 2)
+
+        # Edit rate
+        comment2.rate = 4
+        comment2.save()
+        self.assertRating(9, 2)
+
+        # Deactivate and reactivate
+        comment1.is_active = False
+        comment1.save()
+        self.assertRating(4, 1)
+        comment1.is_active = True
+        comment1.save()
+        self.assertRating(9, 2)
+
+        # Delete
+        comment1.delete()
+        self.assertRating(4, 1)
+        self.assertEqual(self.product.get_rating_average(), 4)
+
+    def test_product_save_does_not_overwrite_rating(self):
+        """
+        Saving a stale product instance must keep ratings added meanwhile
+        """
+        Comment.objects.create(text='comment', product=self.product, rate=3)
+        self.product.title = 'New title'
+        self.product.save()
+        self.assertRating(3, 1)
+
+    def test_rebuild_product_ratings_command(self):
+        Comment.objects.create(text='comment 1', product=self.product, rate=5)
+        Comment.objects.create(text='comment 2', product=self.product, rate=1, is_active=False)
+        Product.objects.update(rating_sum=0, rating_count=0)
+
+        call_command('rebuild_product_ratings', stdout=StringIO())
+        self.assertRating(5, 1)
+
+
 class CoverTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -293,6 +604,9 @@ class ProductListView(TestCase):
             user=cls.user,
         )
 
+    def setUp(self):
+        get_cache().clear()
+
     def test_product_list_view_get_url_and_url_by_name(self):
         """
         Test GET request by url or name
@@ -300,6 +614,8 @@ class ProductListView(TestCase):
         response = self.client.get('/products/')
         self.assertEqual(response.status_code, 200)
 
+        # Render the cached fragments again
+        get_cache().clear()
         response = self.client.get(reverse('products:product_list'))
         self.assertEqual(response.status_code, 200)
         # Check templates used
@@ -468,3 +784,687 @@ class CommentCreateView(TestCase):
         self.assertEqual(comment.recommend, True)
         self.assertEqual(comment.name, self.user.username)
         self.assertEqual(comment.email, self.user.email)
+
+
+class ProductListingQueriesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+
+    def create_products(self, count):
+        for i in range(count):
+            product = make_product(self.user, variants=[('bk', 41, 2)], title=f'Listing product {i}')
+            Cover.objects.create(product=product, cover=f'products/covers/listing_{i}.jpg')
+            Comment.objects.create(text='Listing comment', product=product, rate=4)
+
+    def count_queries(self, url):
+        # Measure rendering, not cached fragments
+        get_cache().clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_for_listing_annotations(self):
+        """
+        Test prefetched covers and active variants
+        """
+        self.create_products(1)
+        product = Product.objects.for_listing().get()
+        with self.assertNumQueries(0):
+            self.assertEqual(product.get_first_cover().cover, 'products/covers/listing_0.jpg')
+            self.assertEqual(len(product.active_variants), 1)
+
+    def test_category_list_queries_do_not_grow_with_page_size(self):
+        """
+        Number of queries on listing pages must not depend on the number of products
+        """
+        urls = [
+            reverse('products:product_list'),
+            reverse('products:product_category_list', kwargs={'major_category': 'Men', 'category': 'm-sport'}),
+            reverse('products:product_major_cat_list', kwargs={'major_category': 'Men'}),
+            reverse('pages:home_page'),
+        ]
+        self.create_products(2)
+        small_page_queries = [self.count_queries(url) for url in urls]
+        self.create_products(4)
+        large_page_queries = [self.count_queries(url) for url in urls]
+        self.assertEqual(small_page_queries, large_page_queries)
+
+
+class ProductSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='search@test.com', phone_number='09123456780')
+        variants = [('bk', 41, 2)]
+        cls.title_match = make_product(
+            cls.user, variants, title='Leather Boots', short_description='Warm shoes for winter', category='m-winter',
+        )
+        cls.description_match = make_product(
+            cls.user, variants, title='Runner', short_description='Light shoes, not leather', category='m-sport',
+        )
+        cls.other = make_product(
+            cls.user, variants, title='Handbag', short_description='A bag for every day', category='hand-bag',
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'Ranking needs postgres full text search')
+    def test_search_ranks_title_matches_first(self):
+        """
+        Products matching in title come before products matching in description
+        """
+        results = list(Product.objects.search('leather'))
+        self.assertEqual(results, [self.title_match, self.description_match])
+        self.assertEqual(list(Product.objects.search('Men')), [self.description_match, self.title_match])
+
+    def test_search_vector_follows_saves(self):
+        """
+        Search document is written with the product row
+        """
+        self.other.title = 'Leather Handbag'
+        self.other.save()
+        self.assertIn(self.other, Product.objects.search('leather'))
+
+        self.other.short_description = 'Suede'
+        self.other.save(update_fields=['short_description'])
+        self.assertIn(self.other, Product.objects.search('suede'))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Search vector is only stored on postgres')
+    def test_search_vector_is_not_rebuilt_if_searched_fields_are_unchanged(self):
+        """
+        Saves changing only other fields don't rebuild the search document
+        """
+        product = Product.objects.get(pk=self.other.pk)
+        product.price = 100
+        with CaptureQueriesContext(connection) as context:
+            product.save()
+        self.assertFalse([query for query in context.captured_queries if 'search_vector' in query['sql']])
+
+        product.material = 'Leather'
+        with CaptureQueriesContext(connection) as context:
+            product.save()
+        self.assertTrue([query for query in context.captured_queries if 'search_vector' in query['sql']])
+        self.assertIn(product, Product.objects.search('leather'))
+
+    def test_search_view_falls_back_to_similar_titles(self):
+        """
+        If full text search finds nothing, similar titles are searched
+        """
+        response = self.client.get(reverse('products:search'), {'q': 'Boot'})
+        self.assertEqual(response.context['results_count'], 1)
+        self.assertEqual(list(response.context['page_obj']), [self.title_match])
+
+        response = self.client.get(reverse('products:search'), {'q': 'nothing like this'})
+        self.assertEqual(response.context['results_count'], 0)
+        self.assertEqual(len(response.context['page_obj']), 3)
+
+
+class ProductSearchIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='index@test.com', phone_number='09123456781')
+        cls.boots = make_product(
+            cls.user, [('bk', 41, 2)], title='Leather Boots', short_description='Warm shoes', category='m-winter',
+        )
+        cls.sandals = make_product(
+            cls.user, [('bk', 41, 2)], title='کفش تابستانی چرم', short_description='سایز ۴۲', category='w-summer',
+        )
+        cls.old_boots = make_product(
+            cls.user, [('bk', 41, 0)], title='Leather Boots Classic', short_description='Out of stock', category='m-winter',
+        )
+
+    def setUp(self):
+        reset_product_search_index()
+        self.addCleanup(reset_product_search_index)
+
+    def test_normalize(self):
+        """
+        Arabic letters, Persian digits and half spaces are normalized
+        """
+        self.assertEqual(normalize('كيف ۴۲'), 'کیف 42')
+        self.assertEqual(normalize('می\u200cروم'), 'می روم')
+
+    def test_prefix_and_multi_term_search(self):
+        """
+        Every term matches as a prefix; active products come first
+        """
+        index = get_product_search_index()
+        with self.assertNumQueries(0):
+            self.assertEqual(index.search('leath'), [self.boots.pk, self.old_boots.pk])
+            self.assertEqual(index.search('boots clas'), [self.old_boots.pk])
+            self.assertEqual(index.search('چرم 42'), [self.sandals.pk])
+            self.assertEqual(index.search('چرم ۴۲'), [self.sandals.pk])
+            self.assertEqual(index.search('summer'), [self.sandals.pk])
+            self.assertEqual(index.search('leather nothing'), [])
+            self.assertEqual(index.search('!!'), [])
+
+    def test_signals_update_built_index(self):
+        """
+        Saved and deleted products update the index incrementally
+        """
+        index = get_product_search_index()
+        self.sandals.title = 'Leather Sandals'
+        self.sandals.save()
+        self.assertEqual(index.search('leather'), [self.sandals.pk, self.boots.pk, self.old_boots.pk])
+        self.assertEqual(index.search('تابستانی'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.create(product=self.old_boots, quantity=1, color='bk', size=42)
+        self.assertEqual(index.search('classic'), [self.old_boots.pk])
+        self.assertEqual(index.search('leather boots'), [self.old_boots.pk, self.boots.pk])
+
+        self.boots.delete()
+        self.assertEqual(index.search('boots'), [self.old_boots.pk])
+        self.assertNotIn('warm', index.sorted_tokens)
+
+    def test_snapshot(self):
+        """
+        Index is loaded from its snapshot instead of the database
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'search_index.json')
+            call_command('dump_search_index', path, stdout=StringIO())
+            with override_settings(PRODUCT_SEARCH_INDEX_SNAPSHOT=path), self.assertNumQueries(0):
+                index = get_product_search_index()
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.search('leath'), [self.boots.pk, self.old_boots.pk])
+
+    @override_settings(PRODUCT_SEARCH_INDEX_MAX_AGE=0)
+    def test_stale_index_rebuilt_in_background(self):
+        """
+        Test searches keep using the stale index while one background thread rebuilds it
+        """
+        stale_index = get_product_search_index()
+        rebuilding = threading.Event()
+        rebuilt = ProductSearchIndex()
+
+        def build(use_snapshot=True):
+            rebuilding.wait(5)
+            return rebuilt
+
+        with mock.patch('products.search_index.load_or_build_index', side_effect=build) as load_or_build_index:
+            self.assertIs(get_product_search_index(), stale_index)
+            self.assertIs(get_product_search_index(), stale_index)
+            rebuilding.set()
+            for _ in range(100):
+                if get_built_product_search_index() is rebuilt:
+                    break
+                time.sleep(0.01)
+        self.assertIs(get_built_product_search_index(), rebuilt)
+        load_or_build_index.assert_called_once_with(use_snapshot=False)
+
+    @override_settings(PRODUCT_SEARCH_BACKEND='index')
+    def test_search_view(self):
+        """
+        Search view answers from the index and reads only the products of the page
+        """
+        response = self.client.get(reverse('products:search'), {'q': 'leather'})
+        self.assertEqual(response.context['results_count'], 2)
+        self.assertEqual(list(response.context['page_obj']), [self.boots, self.old_boots])
+        self.assertIsInstance(get_built_product_search_index(), ProductSearchIndex)
+
+
+class AutocompleteTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='autocomplete@test.com', phone_number='09123456782')
+        cls.boots = make_product(cls.user, [('bk', 41, 2)], title='Leather Boots', category='m-winter')
+        cls.best_seller = make_product(cls.user, [('bk', 41, 2)], title='Leather Bag', category='m-winter')
+        cls.inactive = make_product(cls.user, [('bk', 41, 0)], title='Leather Belt', category='m-winter')
+        Product.objects.filter(pk=cls.best_seller.pk).add_sell_count(10)
+
+    def setUp(self):
+        reset_product_suggestions()
+        self.addCleanup(reset_product_suggestions)
+
+    def get_suggestions(self, query):
+        response = self.client.get(reverse('products:autocomplete'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_suggestions(self):
+        """
+        Active products with a word starting with the prefix, best sellers first; and matching categories
+        """
+        response = self.get_suggestions('Leath')
+        self.assertIn('max-age=60', response['Cache-Control'])
+        self.assertEqual([product['title'] for product in response.json()['products']], ['Leather Bag', 'Leather Boots'])
+        self.assertEqual(response.json()['products'][1]['url'], self.boots.get_absolute_url())
+
+        with self.assertNumQueries(0):
+            response = self.get_suggestions('leather bo')
+        self.assertEqual([product['title'] for product in response.json()['products']], ['Leather Boots'])
+        self.assertEqual([product['title'] for product in self.get_suggestions('boo').json()['products']], ['Leather Boots'])
+
+        categories = self.get_suggestions('Winte').json()['categories']
+        self.assertEqual(len(categories), 2)
+        self.assertIn(
+            reverse('products:product_category_list', args=['Men', 'm-winter']),
+            [category['url'] for category in categories],
+        )
+        self.assertEqual(self.get_suggestions('l').json(), {'products': [], 'categories': []})
+
+    def test_suggestions_follow_product_changes(self):
+        """
+        Suggestions are updated incrementally when products or their activation change
+        """
+        suggestions = get_product_suggestions()
+        self.boots.title = 'Suede Boots'
+        self.boots.save()
+        self.assertEqual(suggestions.suggest('suede', limit=8), [(self.boots.pk, 'Suede Boots')])
+        self.assertEqual(suggestions.suggest('leather', limit=8), [(self.best_seller.pk, 'Leather Bag')])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.inactive.variants.get().increase_quantity(1)
+        self.assertEqual(suggestions.suggest('leather be', limit=8), [(self.inactive.pk, 'Leather Belt')])
+
+        self.best_seller.delete()
+        self.assertEqual(suggestions.suggest('leather', limit=8), [(self.inactive.pk, 'Leather Belt')])
+
+    @override_settings(PRODUCT_SEARCH_INDEX_MAX_AGE=0)
+    def test_stale_suggestions_rebuilt_in_background(self):
+        """
+        Test requests keep getting the stale suggestions while one background thread rebuilds them
+        """
+        stale_suggestions = get_product_suggestions()
+        rebuilding = threading.Event()
+        rebuilt = ProductSuggestions()
+
+        def build():
+            rebuilding.wait(5)
+            return rebuilt
+
+        with mock.patch('products.autocomplete.build_suggestions', side_effect=build) as build_suggestions:
+            with self.assertNumQueries(0):
+                self.assertIs(get_product_suggestions(), stale_suggestions)
+                self.assertIs(get_product_suggestions(), stale_suggestions)
+            rebuilding.set()
+            for _ in range(100):
+                if get_built_product_suggestions() is rebuilt:
+                    break
+                time.sleep(0.01)
+        self.assertIs(get_built_product_suggestions(), rebuilt)
+        build_suggestions.assert_called_once_with()
+
+    def test_suggest_latency(self):
+        """
+        Test p99 latency of suggestions stays under 5 ms on a big catalog (short prefixes match most of it)
+        """
+        suggestions = ProductSuggestions()
+        words = ['leather', 'light', 'loafer', 'boot', 'sneaker', 'sandal', 'classic', 'canvas', 'suede', 'slim']
+        for product_id in range(50000):
+            title = f'{words[product_id % 10]} {words[product_id // 10 % 10]} {words[product_id // 100 % 10]} {product_id}'
+            suggestions.products[product_id] = (title, product_id % 97, get_keys(title))
+            suggestions.entries.extend((key, product_id) for key in get_keys(title))
+        suggestions.entries.sort()
+
+        timings = []
+        # Collections of the test process's garbage aren't part of the latency
+        gc.collect()
+        gc.disable()
+        try:
+            for prefix in ['le', 'lea', 'leather', 'leather bo', 'sn', 'cl', 'su', 'boot s', '12', 'zz'] * 100:
+                start = time.perf_counter()
+                suggestions.suggest(prefix, limit=8)
+                timings.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+        self.assertLess(statistics.quantiles(timings, n=100, method='inclusive')[98], 0.005)
+
+
+class ProductFacetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='facet@test.com', phone_number='09123456783')
+        cls.black_41 = make_product(cls.user, [('bk', 41, 2)], title='Black 41', price=1000000)
+        cls.black_white = make_product(
+            cls.user, [('bk', 42, 2), ('we', 41, 2)], title='Black and White', price=2000000,
+            offer=True, offer_price=1500000,
+        )
+        cls.white_42 = make_product(cls.user, [('we', 42, 2)], title='White 42', price=3000000)
+        cls.url = reverse('products:product_category_list', args=['Men', 'm-sport'])
+
+    def get_products(self, **filters):
+        response = self.client.get(self.url, filters)
+        self.assertEqual(response.status_code, 200)
+        return response, set(response.context['products_page_obj'])
+
+    def test_filters(self):
+        """
+        Color and size must match the same variant; price range uses the price paid
+        """
+        self.assertEqual(self.get_products(colors='bk')[1], {self.black_41, self.black_white})
+        self.assertEqual(self.get_products(colors='bk', sizes=41)[1], {self.black_41})
+        self.assertEqual(self.get_products(colors=['bk', 'we'], sizes=42)[1], {self.black_white, self.white_42})
+        self.assertEqual(self.get_products(min_price=1200000, max_price=2000000)[1], {self.black_white})
+        self.assertEqual(self.get_products(offer='on')[1], {self.black_white})
+        # Invalid filters are ignored
+        self.assertEqual(len(self.get_products(sizes='abc', min_price=-1)[1]), 3)
+
+    def test_facet_counts(self):
+        """
+        Facet counts are computed in one query, each facet with the filters of the other facets
+        """
+        size_values = ProductVariant.SIZES_BY_MAJOR_CATEGORY['Men']
+        size_values = [value for value, label in size_values]
+        products = Product.objects.filter(category='m-sport', is_active=True)
+        with self.assertNumQueries(1):
+            counts = products.get_facet_counts(size_values, colors=['bk'], sizes=[41])
+        self.assertEqual(counts['colors']['bk'], 1)
+        self.assertEqual(counts['colors']['we'], 1)
+        self.assertEqual(counts['colors']['rd'], 0)
+        self.assertEqual(counts['sizes'][41], 1)
+        self.assertEqual(counts['sizes'][42], 1)
+        self.assertEqual(counts['offer'], 0)
+
+        response = self.get_products(colors='we')[0]
+        self.assertContains(response, 'Black (2)')
+        self.assertContains(response, 'value="42"')
+
+
+class KeysetPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='keyset@test.com', phone_number='09123456784')
+        cls.products = []
+        for i in range(7):
+            product = make_product(
+                cls.user, [('bk', 41, 2)], title=f'Keyset Sneaker {i}', price=1000000, offer=True, offer_price=900000,
+            )
+            cls.products.append(product)
+        # Ties in sell_count are ordered by pk
+        Product.objects.filter(pk__in=[product.pk for product in cls.products[:4]]).add_sell_count(5)
+        cls.ordered_pks = [product.pk for product in cls.products[3::-1] + cls.products[:3:-1]]
+
+    def walk(self, paginator):
+        """
+        Go to the last page with next cursors, then back to the first page with previous cursors
+        """
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            with CaptureQueriesContext(connection) as context:
+                pages.append(paginator.get_page(pages[-1].next_cursor))
+            self.assertNotIn('OFFSET', context.captured_queries[0]['sql'])
+        forward = [product.pk for page in pages for product in page]
+
+        back_pages = [pages[-1]]
+        while back_pages[-1].has_previous():
+            back_pages.append(paginator.get_page(back_pages[-1].previous_cursor))
+        backward = [product.pk for page in reversed(back_pages) for product in page]
+        return forward, backward, len(pages)
+
+    def test_keyset_paginator(self):
+        """
+        Pages follow each other without gaps or duplicates in both directions
+        """
+        paginator = KeysetPaginator(Product.objects.filter(category='m-sport'), 3, ['-sell_count', '-pk'])
+        forward, backward, pages_count = self.walk(paginator)
+        self.assertEqual(forward, self.ordered_pks)
+        self.assertEqual(backward, self.ordered_pks)
+        self.assertEqual(pages_count, 3)
+        self.assertEqual(paginator.count, 7)
+        self.assertEqual(paginator.num_pages, 3)
+
+        paginator = KeysetPaginator(Product.objects.all(), 3, ['-datetime_created', '-pk'])
+        forward, backward, pages_count = self.walk(paginator)
+        self.assertEqual(forward, backward)
+        self.assertEqual(sorted(forward), sorted(self.ordered_pks))
+
+        # Invalid cursors show the first page
+        self.assertEqual(list(paginator.get_page('invalid')), list(paginator.get_page()))
+
+    @override_settings(PRODUCT_LISTING_PAGINATION='keyset')
+    def test_listings(self):
+        """
+        Category, offer and search listings paginate with cursors
+        """
+        response = self.client.get(reverse('products:product_category_list', args=['Men', 'm-sport']))
+        page = response.context['products_page_obj']
+        self.assertEqual(len(page), 7)
+        self.assertFalse(page.has_other_pages())
+
+        response = self.client.get(reverse('products:product_offer_list'))
+        self.assertEqual(len(response.context['page_obj']), 7)
+
+        response = self.client.get(reverse('products:search'), {'q': 'sneaker'})
+        self.assertEqual(response.context['results_count'], 7)
+        self.assertTrue(response.context['page_obj'].is_keyset)
+
+    def test_search_cursor(self):
+        """
+        Search results (ordered by rank) continue on the next page
+        """
+        products = Product.objects.search('sneaker')
+        paginator = KeysetPaginator(products, 2, ['-is_active', '-rank', '-pk'])
+        forward, backward, pages_count = self.walk(paginator)
+        self.assertEqual(forward, list(products.values_list('pk', flat=True)))
+        self.assertEqual(backward, forward)
+
+
+class CatalogCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.product = make_product(cls.user, title='Cached Loafer')
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_home_page_fragments_are_cached(self):
+        """
+        Test second home page request doesn't query products
+        """
+        self.client.get(reverse('pages:home_page'))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('pages:home_page'))
+        self.assertContains(response, 'Cached Loafer')
+        self.assertFalse([query for query in context.captured_queries if 'products_product' in query['sql']])
+
+    def test_product_change_invalidates_fragments(self):
+        """
+        Test saving a product shows the change on the next request (after commit too)
+        """
+        self.client.get(reverse('pages:home_page'))
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.product.title = 'Renamed Loafer'
+            self.product.save()
+        self.assertTrue(callbacks)
+
+        response = self.client.get(reverse('pages:home_page'))
+        self.assertContains(response, 'Renamed Loafer')
+        self.assertNotContains(response, 'Cached Loafer')
+
+    def test_queryset_update_invalidates_fragments(self):
+        """
+        Test bulk updates (no signals) invalidate cached fragments
+        """
+        generation = get_generation()
+        Product.objects.filter(pk=self.product.pk).update(offer=True, offer_price=4000000)
+        self.assertGreater(get_generation(), generation)
+
+    def test_unchanged_activation_is_not_written(self):
+        generation = get_generation()
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(Product.objects.filter(pk=self.product.pk).sync_activation(), 0)
+        self.assertEqual(get_generation(), generation)
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_counter_update_invalidates_fragments_listing_by_it(self):
+        """
+        Test sell counts invalidate only the best sellers, not the whole catalog
+        """
+        builds = []
+        for name in ('home-best-selling', 'home-new-products'):
+            get_or_build(name, lambda: builds.append(name))
+        generation = get_generation()
+
+        Product.objects.filter(pk=self.product.pk).add_sell_count(2)
+        self.assertEqual(get_generation(), generation)
+        for name in ('home-best-selling', 'home-new-products'):
+            get_or_build(name, lambda: builds.append(name))
+        self.assertEqual(builds, ['home-best-selling', 'home-new-products', 'home-best-selling'])
+
+    def test_rating_update_invalidates_fragments_showing_product(self):
+        """
+        Test a new rating invalidates only the fragments showing the product
+        """
+        other = make_product(self.user, title='Other Loafer')
+        builds = []
+
+        def build(product):
+            builds.append(product.pk)
+            return Template('{% load product_tags %}{% catalog_product product %}').render(Context({'product': product}))
+
+        get_or_build('shows-product', lambda: build(self.product))
+        get_or_build('shows-other', lambda: build(other))
+        generation = get_generation()
+
+        with self.assertNumQueries(1):
+            Product.objects.add_rating([self.product.pk], 5, 1)
+        self.assertEqual(get_generation(), generation)
+        get_or_build('shows-product', lambda: build(self.product))
+        get_or_build('shows-other', lambda: build(other))
+        self.assertEqual(builds, [self.product.pk, other.pk, self.product.pk])
+
+    def test_stale_entry_served_while_rebuilding(self):
+        """
+        Test only the worker holding the lock rebuilds; the others get the stale entry
+        """
+        self.assertEqual(get_or_build('test-fragment', lambda: 'old'), 'old')
+        bump_generation()
+        get_cache().add(f'catalog:test-fragment:{translation.get_language()}:lock', True)
+
+        def build():
+            raise AssertionError('Rebuilt without the lock')
+
+        self.assertEqual(get_or_build('test-fragment', build), 'old')
+
+    def test_first_build_is_awaited(self):
+        """
+        Test a cold entry being built elsewhere is waited for, not built again
+        """
+        key = f'catalog:test-fragment:{translation.get_language()}'
+        get_cache().add(f'{key}:lock', True)
+
+        def build():
+            raise AssertionError('Built twice')
+
+        def build_elsewhere(seconds):
+            get_cache().set(key, ((get_generation(), 1), [], 'built'))
+
+        with mock.patch('products.catalog_cache.time.sleep', side_effect=build_elsewhere):
+            self.assertEqual(get_or_build('test-fragment', build), 'built')
+
+    def test_first_build_without_lock_holder(self):
+        """
+        Test a cold entry is built if the worker holding the lock gave up
+        """
+        key = f'catalog:test-fragment:{translation.get_language()}'
+        get_cache().add(f'{key}:lock', True)
+
+        def give_up(seconds):
+            get_cache().delete(f'{key}:lock')
+
+        with mock.patch('products.catalog_cache.time.sleep', side_effect=give_up) as sleep:
+            self.assertEqual(get_or_build('test-fragment', lambda: 'built'), 'built')
+        self.assertEqual(sleep.call_count, 1)
+
+
+class PrimaryCoverTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.product = make_product(cls.user, title='Covered Loafer')
+
+    def get_primary_cover(self):
+        return Product.objects.get(pk=self.product.pk).primary_cover
+
+    def test_primary_cover_follows_covers(self):
+        """
+        Test primary cover is the first cover by position, after adds, moves and deletes
+        """
+        self.assertIsNone(self.get_primary_cover())
+
+        second = Cover.objects.create(product=self.product, cover='products/covers/second.jpg', position=2)
+        self.assertEqual(self.get_primary_cover(), second)
+        first = Cover.objects.create(product=self.product, cover='products/covers/first.jpg', position=1)
+        self.assertEqual(self.get_primary_cover(), first)
+
+        first.position = 3
+        first.save()
+        self.assertEqual(self.get_primary_cover(), second)
+        self.assertEqual(list(self.product.covers.all()), [second, first])
+
+        second.delete()
+        self.assertEqual(self.get_primary_cover(), first)
+        first.delete()
+        self.assertIsNone(self.get_primary_cover())
+
+    def test_stale_product_save_keeps_primary_cover(self):
+        """
+        Test saving a product loaded before its covers changed doesn't write back the old primary cover
+        """
+        stale_product = Product.objects.get(pk=self.product.pk)
+        cover = Cover.objects.create(product=self.product, cover='products/covers/new.jpg')
+
+        stale_product.title = 'Renamed Loafer'
+        stale_product.save()
+        self.assertEqual(self.get_primary_cover(), cover)
+
+    def test_product_deletion_with_covers(self):
+        Cover.objects.create(product=self.product, cover='products/covers/deleted.jpg')
+        self.product.delete()
+        self.assertFalse(Cover.objects.exists())
+
+
+class ProductPagesQueryBudgetTest(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        for i in range(3):
+            product = make_product(
+                cls.user, [('bk', 41, 2), ('wh', 42, 1)], title=f'Budget sneaker {i}', offer=True, offer_price=3990000,
+            )
+            Cover.objects.create(product=product, cover=f'products/covers/budget_{i}.jpg')
+            Comment.objects.create(text='Budget comment', product=product, rate=4)
+        cls.product = product
+
+    def setUp(self):
+        # Measure rendering, not cached fragments or the (per process) search indexes
+        get_cache().clear()
+        reset_product_search_index()
+        reset_product_suggestions()
+        self.addCleanup(reset_product_search_index)
+        self.addCleanup(reset_product_suggestions)
+        get_built_product_search_index()
+        get_product_suggestions()
+
+    def test_query_budgets(self):
+        """
+        Pin the number of queries of each product page (raise a budget only for a reason)
+        """
+        # {(url, GET data): (queries, duplicates)}
+        budgets = {
+            # Duplicates of these two are one listing (and its variants) per category section
+            (reverse('products:product_list'), None): (9, 6),
+            (reverse('products:product_major_cat_list', args=['Men']), None): (14, 10),
+            (reverse('products:product_offer_list'), None): (3, 0),
+            (reverse('products:product_category_list', args=['Men', 'm-sport']), None): (4, 0),
+            (reverse('products:product_detail', kwargs={'pk': self.product.pk}), None): (6, 0),
+            (reverse('products:search'), (('q', 'sneaker'),)): (4, 0),
+            (reverse('products:autocomplete'), (('q', 'sne'),)): (0, 0),
+        }
+        for (url, data), (budget, max_duplicates) in budgets.items():
+            with self.subTest(url=url):
+                self.assertQueryBudget(url, budget, data=dict(data or ()), max_duplicates=max_duplicates)
@@ -11,6 +11,7 @@ urlpatterns = [
     path('<int:pk>/comment_add/', views.CommentCreateView.as_view(), name='comment_create'),
     # Search
     path('search/', views.search_view, name='search'),
+    path('autocomplete/', views.autocomplete_view, name='autocomplete'),
     # Keep ordering like this: str after int; because str-path catches numbers too
     path('<str:major_category>/', views.product_major_category_list_view, name='product_major_cat_list'),
     path('<str:major_category>/<str:category>/', views.product_category_list_view, name='product_category_list'),
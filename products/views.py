@@ -1,16 +1,20 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponseNotFound
+from django.http import HttpResponseNotFound, JsonResponse
 from django.views import generic
 from django.contrib import messages
 from django.utils.translation import gettext_lazy as _
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_http_methods
+from django.views.decorators.cache import cache_control
 from django.core.paginator import Paginator
-from django.db.models import Q
+from django.conf import settings
 
 from .models import Product, Comment
-from .forms import CommentForm
+from .forms import CommentForm, ProductFilterForm
+from .search_index import get_product_search_index, tokenize
+from .autocomplete import get_product_suggestions, suggest_categories
+from .pagination import paginate_listing
 from cart.forms import AddToCartForm
 
 
@@ -19,15 +23,13 @@ class ProductListView(generic.ListView):
     context_object_name = 'products'
     queryset = Product.active_product_manager.all()
 
-    # Product.objects.filter(variants__size=42) I'm gonna use it later
-
     def get_queryset(self):
-        return Product.active_product_manager.all()
+        return Product.active_product_manager.for_listing()
 
     def get_context_data(self, **kwargs):
         context = super(ProductListView, self).get_context_data(**kwargs)
         query_dict = {
-            major_category: Product.objects.filter(major_category=major_category).order_by('-is_active')[:5]
+            major_category: Product.objects.for_listing().filter(major_category=major_category).order_by('-is_active')[:5]
             for major_category in Product.get_major_categories_list()
         }
         context['query_dict'] = query_dict
@@ -39,9 +41,14 @@ class ProductDetailView(generic.DetailView):
     context_object_name = 'product'
     template_name = 'products/product_detail.html'
 
+    def get_queryset(self):
+        # Active variants are prefetched once for colors, sizes and the add to cart forms
+        return Product.objects.for_listing()
+
     def get_context_data(self, **kwargs):
         context = super(ProductDetailView, self).get_context_data()
         context['comment_form'] = CommentForm()
+        context['comments_count'] = self.object.comments.count()
 
         comments = self.object.comments.filter(is_active=True).order_by('-datetime_modified')
 
@@ -52,11 +59,11 @@ class ProductDetailView(generic.DetailView):
         context['comments_num_pages'] = paginator.num_pages
 
         color_form_dict = {}
+        variants = sorted(self.object.active_variants, key=lambda variant: variant.size)
         for color, color_display in self.object.get_active_variants_colors().items():
-            variants = self.object.variants.filter(is_active=True, color=color).order_by('size')
             size_choices = [
                 (variant.size, variant.get_size_display())
-                for variant in variants
+                for variant in variants if variant.color == color
             ]
 
             if size_choices:
@@ -71,10 +78,10 @@ class ProductDetailView(generic.DetailView):
 
 
 def product_major_category_list_view(request, major_category):
-    if major_category not in Product.get_major_categories_list():
+    if major_category not in Product.MAJOR_CATEGORY_SET:
         return HttpResponseNotFound('Page not found')
     categories = Product.get_categories_from_major_cat(major_category)
-    query_dict = {category_display: Product.objects.filter(category=category, is_active=True)[:5]
+    query_dict = {category_display: Product.objects.for_listing().filter(category=category, is_active=True)[:5]
                   for category,category_display in categories.items()}
     return render(
         request,
@@ -84,17 +91,22 @@ def product_major_category_list_view(request, major_category):
 
 
 def product_category_list_view(request, major_category, category):
-    if major_category not in Product.get_major_categories_list():
+    if major_category not in Product.MAJOR_CATEGORY_SET:
         return HttpResponseNotFound('Page not found. Major category not found')
-    if category not in Product.get_categories_list():
+    if category not in Product.CATEGORY_SET:
         return HttpResponseNotFound('Page not found. Category not found')
-    if category not in Product.get_categories_from_major_cat(major_category):
+    if Product.CATEGORY_MAJOR_CATEGORIES[category] != major_category:
         return HttpResponseNotFound('Page not found. Category is not in this major category')
 
-    products = Product.objects.filter(is_active=True, category=category).order_by('-sell_count')
+    products = Product.objects.filter(is_active=True, category=category)
+
+    # Facet filters (size, color, price range, offer) and product counts of each facet value
+    filter_form = ProductFilterForm(request.GET, major_category=major_category)
+    filters = filter_form.get_filters()
+    filter_form.set_facet_counts(products.get_facet_counts(filter_form.get_size_values(), **filters))
+    products = products.filter_facets(**filters).for_listing()
 
-    paginator = Paginator(products, 30)
-    page_obj = paginator.get_page(request.GET.get('page'))
+    paginator, page_obj = paginate_listing(request, products, 30, ['-sell_count', '-pk'])
 
     category_display = Product.find_category_display_from_category(category)
 
@@ -103,15 +115,21 @@ def product_category_list_view(request, major_category, category):
         'products_num_pages':paginator.num_pages,
         'category':category_display,
         'major_category': major_category,
+        'filter_form': filter_form,
     })
 
 
 class ProductOfferListView(generic.ListView):
     template_name = 'products/offer_list.html'
-    queryset = Product.objects.filter(is_active=True, offer=True).order_by('-datetime_created', '-sell_count')
+    queryset = Product.objects.for_listing().filter(is_active=True, offer=True)
+    ordering = ['-datetime_created', '-sell_count', '-pk']
     context_object_name = 'products'
     paginate_by = 30
 
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page = paginate_listing(self.request, queryset, page_size, self.get_ordering())
+        return paginator, page, page.object_list, page.has_other_pages()
+
 
 @method_decorator(require_http_methods(["POST", ]), name='dispatch')
 class CommentCreateView(generic.CreateView):
@@ -147,27 +165,37 @@ class CommentCreateView(generic.CreateView):
 
 def search_view(request):
     """
-    Implement search among products
+    Implement search among products (ranked full text search, then similar titles for typos)
+    With PRODUCT_SEARCH_BACKEND = 'index', the in-process inverted index answers and only the page is read from db
     """
     results_count = 0
     query = request.GET.get('q')
-
-    if query:
-        products = Product.objects.filter(
-            Q(title__icontains=query)|
-            Q(category__icontains=query)|
-            Q(major_category__icontains=query)|
-            Q(short_description__icontains=query)
-        # distinct prevents duplicates
-        ).distinct().order_by('-is_active')
-
-        results_count = products.count()
-
-    if results_count == 0 or not query:
-        products = Product.active_product_manager.all()
-
-    paginator = Paginator(products, 25)
-    page_obj = paginator.get_page(request.GET.get('page'))
+    page_obj = None
+
+    if query and settings.PRODUCT_SEARCH_BACKEND == 'index':
+        product_ids = get_product_search_index().search(query)
+        results_count = len(product_ids)
+
+        if results_count:
+            paginator = Paginator(product_ids, 25)
+            page_obj = paginator.get_page(request.GET.get('page'))
+            products = Product.objects.for_listing().in_bulk(page_obj.object_list)
+            page_obj.object_list = [products[pk] for pk in page_obj.object_list if pk in products]
+
+    elif query:
+        products, ordering = Product.objects.search(query), ['-is_active', '-rank', '-pk']
+        found = products.exists()
+        if not found:
+            products, ordering = Product.objects.search_similar(query), ['-is_active', '-similarity', '-pk']
+            found = products.exists()
+
+        if found:
+            # The count of the paginator is the number of results
+            paginator, page_obj = paginate_listing(request, products.for_listing(), 25, ordering)
+            results_count = paginator.count
+
+    if page_obj is None:
+        paginator, page_obj = paginate_listing(request, Product.active_product_manager.for_listing(), 25, ['-pk'])
     num_pages = paginator.num_pages
 
     return render(
@@ -175,3 +203,26 @@ def search_view(request):
         'products/search_results.html',
         {'query':query, 'page_obj': page_obj, 'num_pages': num_pages, 'results_count': results_count}
     )
+
+
+@cache_control(public=True, max_age=60)
+def autocomplete_view(request):
+    """
+    Suggest product titles and categories for the prefix typed in search box (answered from memory, no db queries)
+    """
+    prefix = ' '.join(tokenize(request.GET.get('q', '')))
+    if len(prefix) < 2:
+        return JsonResponse({'products': [], 'categories': []})
+
+    products = get_product_suggestions().suggest(prefix, limit=8)
+    categories = suggest_categories(prefix, limit=3)
+    return JsonResponse({
+        'products': [
+            {'title': title, 'url': reverse('products:product_detail', args=[product_id])}
+            for product_id, title in products
+        ],
+        'categories': [
+            {'title': display, 'url': reverse('products:product_category_list', args=[major_category, category])}
+            for display, category, major_category in categories
+        ],
+    })
@@ -80,7 +80,7 @@ class FavoriteListView(LoginRequiredMixin, generic.ListView):
 
     def get_queryset(self):
         print(self.request.user.favorites.all())
-        return self.request.user.favorites.all()
+        return self.request.user.favorites.select_related('product__primary_cover')
 
 
 @login_required
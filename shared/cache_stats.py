@@ -0,0 +1,93 @@
+import functools
+import threading
+from collections import Counter, defaultdict
+
+from django.utils.module_loading import import_string
+
+
+# {alias: Counter(hits=, misses=)} of this process
+_stats = defaultdict(Counter)
+_stats_lock = threading.Lock()
+# Backends implement get() with get_many() (or the other way around); only the outer call is counted
+_local = threading.local()
+_MISSING = object()
+
+
+def record(alias, hits, misses):
+    with _stats_lock:
+        _stats[alias].update(hits=hits, misses=misses)
+
+
+def get_cache_stats():
+    """
+    Hits, misses and hit rate (percent, None before the first read) of each alias since the process started
+    """
+    with _stats_lock:
+        counters = {alias: counter.copy() for alias, counter in _stats.items()}
+    stats = {}
+    for alias, counter in sorted(counters.items()):
+        reads = counter['hits'] + counter['misses']
+        stats[alias] = {
+            'hits': counter['hits'],
+            'misses': counter['misses'],
+            'hit_rate': counter['hits'] * 100 / reads if reads else None,
+        }
+    return stats
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+class InstrumentedCacheMixin:
+    stats_alias = None
+
+    def get(self, key, default=None, version=None):
+        if getattr(_local, 'counting', False):
+            return super().get(key, default, version)
+        _local.counting = True
+        try:
+            value = super().get(key, _MISSING, version)
+        finally:
+            _local.counting = False
+        if value is _MISSING:
+            record(self.stats_alias, 0, 1)
+            return default
+        record(self.stats_alias, 1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        if getattr(_local, 'counting', False):
+            return super().get_many(keys, version)
+        keys = list(keys)
+        _local.counting = True
+        try:
+            values = super().get_many(keys, version)
+        finally:
+            _local.counting = False
+        record(self.stats_alias, len(values), len(keys) - len(values))
+        return values
+
+
+@functools.cache
+def get_instrumented_backend(path):
+    backend = import_string(path)
+    return type(f'Instrumented{backend.__name__}', (InstrumentedCacheMixin, backend), {})
+
+
+class InstrumentedCache:
+    """
+    Cache BACKEND counting hits and misses of the backend in INSTRUMENTED_BACKEND
+
+        CACHES = {'default': {'BACKEND': 'shared.cache_stats.InstrumentedCache', 'ALIAS': 'default',
+                              'INSTRUMENTED_BACKEND': 'django.core.cache.backends.redis.RedisCache', ...}}
+    """
+
+    def __new__(cls, location, params):
+        params = params.copy()
+        backend = get_instrumented_backend(params.pop('INSTRUMENTED_BACKEND'))
+        alias = params.pop('ALIAS', backend.__name__)
+        cache = backend(location, params)
+        cache.stats_alias = alias
+        return cache
@@ -0,0 +1,63 @@
+import re
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestFilesMixin, staticfiles_storage
+from django.core.checks import Error, register
+
+
+STATIC_TAG_RE = re.compile(r"""{%\s*static\s+(['"])(?P<path>[^'"]+)\1""")
+
+
+def get_project_template_dirs():
+    """
+    Template directories of the project (settings DIRS and local apps, not third party apps)
+    """
+    base_dir = Path(settings.BASE_DIR).resolve()
+    template_dirs = [Path(directory) for engine in settings.TEMPLATES for directory in engine.get('DIRS', [])]
+    for app_config in apps.get_app_configs():
+        path = Path(app_config.path).resolve()
+        if path.is_relative_to(base_dir):
+            template_dirs.append(path / 'templates')
+    return [directory for directory in template_dirs if directory.is_dir()]
+
+
+def find_static_references(template_dirs):
+    """
+    Yield (template path, line number, static path) of {% static '...' %} tags with a literal path
+    """
+    for directory in template_dirs:
+        for template in sorted(Path(directory).rglob('*.html')):
+            for number, line in enumerate(template.read_text(encoding='utf-8').splitlines(), 1):
+                for match in STATIC_TAG_RE.finditer(line):
+                    yield template, number, match['path']
+
+
+def get_static_exists():
+    """
+    Test of static paths: in the manifest once it's collected (manifest storage), otherwise found by the finders
+    """
+    if isinstance(staticfiles_storage, ManifestFilesMixin) and staticfiles_storage.exists(staticfiles_storage.manifest_name):
+        return lambda path: path in staticfiles_storage.hashed_files
+    return lambda path: finders.find(path) is not None
+
+
+# Not tagged staticfiles: collectstatic runs those checks, and it's what updates the manifest
+@register('static_references')
+def check_static_references(app_configs=None, **kwargs):
+    """
+    Templates must not refer to static files which don't exist (they'd be 404s with unhashed urls)
+    """
+    exists = get_static_exists()
+    return [
+        Error(
+            f"Static file '{path}' used in {template}:{number} doesn't exist.",
+            hint='Add the file to static/ (and run collectstatic) or fix the path.',
+            obj=str(template),
+            id='shared.E001',
+        )
+        for template, number, path in find_static_references(get_project_template_dirs())
+        if not exists(path)
+    ]
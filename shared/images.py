@@ -0,0 +1,163 @@
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+# {format: (extension, Pillow save options)}
+DERIVATIVE_FORMATS = {
+    'webp': ('webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Seconds an image without derivatives is remembered as such (they may be created by another process meanwhile)
+MISSING_DERIVATIVES_TIMEOUT = 60
+
+
+def get_cache():
+    return caches[settings.IMAGE_DERIVATIVE_CACHE_ALIAS]
+
+
+def get_derivatives_key(name):
+    return f'image-derivatives:{name}'
+
+
+def get_derivative_name(name, width, image_format):
+    """
+    Name of a derivative, next to the original: products/covers/a.jpg -> products/covers/a.320w.webp
+    """
+    root = name.rsplit('.', 1)[0]
+    return f'{root}.{width}w.{DERIVATIVE_FORMATS[image_format][0]}'
+
+
+def get_derivative_names(name):
+    """
+    [(width, format, name)] of the derivatives of an image (the last one is created last)
+    """
+    return [
+        (width, image_format, get_derivative_name(name, width, image_format))
+        for width in sorted(settings.IMAGE_DERIVATIVE_WIDTHS)
+        for image_format in DERIVATIVE_FORMATS
+    ]
+
+
+def has_derivatives(field_file):
+    """
+    Are the derivatives of the image created? Recorded in cache by create_derivatives, so pages don't check the storage
+    The storage is only checked (for the one created last) when the cache has no record
+    """
+    if not field_file:
+        return False
+    key = get_derivatives_key(field_file.name)
+    created = get_cache().get(key)
+    if created is None:
+        created = field_file.storage.exists(get_derivative_names(field_file.name)[-1][2])
+        get_cache().set(key, created, None if created else MISSING_DERIVATIVES_TIMEOUT)
+    return created
+
+
+def resize(image, width):
+    if image.width <= width:
+        return image
+    return image.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+
+
+def to_rgb(image):
+    """
+    JPEG has no transparency: transparent parts become white
+    """
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def create_derivatives(field_file, force=False):
+    """
+    Create the derivatives of the image (each width of settings.IMAGE_DERIVATIVE_WIDTHS as WebP and JPEG)
+    Returns False if they already existed
+    """
+    storage = field_file.storage
+    if not force and has_derivatives(field_file):
+        return False
+
+    with storage.open(field_file.name, 'rb') as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original.load()
+
+    for width, image_format, name in get_derivative_names(field_file.name):
+        image = resize(original, width)
+        if image_format == 'jpeg':
+            image = to_rgb(image)
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        content = io.BytesIO()
+        image.save(content, **DERIVATIVE_FORMATS[image_format][1])
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(content.getvalue()))
+    get_cache().set(get_derivatives_key(field_file.name), True, None)
+    return True
+
+
+def delete_derivatives(storage, name):
+    """
+    Delete the derivatives of an image once the transaction is committed (the image was deleted or replaced)
+    """
+    if not name:
+        return
+
+    def delete():
+        get_cache().delete(get_derivatives_key(name))
+        for width, image_format, derivative_name in get_derivative_names(name):
+            storage.delete(derivative_name)
+
+    transaction.on_commit(delete, robust=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_DERIVATIVE_WORKERS, thread_name_prefix='image-derivatives',
+            )
+        return _executor
+
+
+def create_derivatives_safely(field_file):
+    try:
+        create_derivatives(field_file)
+    except Exception:
+        logger.exception('Creating derivatives of %s failed', field_file.name)
+
+
+def schedule_derivatives(field_file):
+    """
+    Create the derivatives in the worker pool once the transaction is committed (not during the request)
+    With IMAGE_DERIVATIVE_WORKERS = 0 they are created on commit, in this thread
+    """
+    if not field_file:
+        return
+
+    def submit():
+        if settings.IMAGE_DERIVATIVE_WORKERS:
+            get_executor().submit(create_derivatives_safely, field_file)
+        else:
+            create_derivatives_safely(field_file)
+
+    transaction.on_commit(submit)
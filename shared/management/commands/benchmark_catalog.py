@@ -0,0 +1,155 @@
+import json
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from products.autocomplete import reset_product_suggestions
+from products.catalog_cache import get_cache
+from products.models import ProductVariant
+from products.search_index import reset_product_search_index
+from shared.query_budget import count_queries
+from .generate_catalog import delete_synthetic_data, get_synthetic_products, get_synthetic_users
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the home page, a category listing, a product page, search, cart and checkout with catalogs of '
+        'growing sizes (synthetic products are added with generate_catalog) and write the results as JSON. '
+        'Use a throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Catalog sizes')
+        parser.add_argument('--requests', type=int, default=30, help='Timed requests of each page')
+        parser.add_argument('--output', default='benchmark-catalog.json', help='JSON file of the results')
+        parser.add_argument('--label', help='Name of the results (default: current git revision)')
+        parser.add_argument('--cold', action='store_true', help='Clear cached catalog fragments before each request')
+        parser.add_argument('--host', default='localhost', help='Host header (must be in ALLOWED_HOSTS)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of generate_catalog')
+        parser.add_argument('--clear', action='store_true', help='Delete synthetic data first')
+
+    def handle(self, *args, **options):
+        results = {
+            'label': options['label'] or self.get_git_revision(),
+            'datetime': timezone.now().isoformat(),
+            'database': f'{connection.vendor} {connection.Database.__name__}',
+            'settings': {
+                'cold': options['cold'],
+                'PRODUCT_SEARCH_BACKEND': settings.PRODUCT_SEARCH_BACKEND,
+                'PRODUCT_LISTING_PAGINATION': settings.PRODUCT_LISTING_PAGINATION,
+                'CART_BACKEND': settings.CART_BACKEND,
+            },
+            'sizes': {},
+        }
+        sizes = sorted(options['sizes'])
+        if options['clear']:
+            delete_synthetic_data()
+        elif get_synthetic_products().count() > sizes[0]:
+            raise CommandError(f'There are more than {sizes[0]} synthetic products already (use --clear)')
+
+        for size in sizes:
+            call_command('generate_catalog', size, seed=options['seed'], stdout=self.stdout)
+            # Bulk inserts don't update the search structures of this process
+            reset_product_search_index()
+            reset_product_suggestions()
+            results['sizes'][size] = self.benchmark_pages(size, options)
+
+        with open(options['output'], 'w') as file:
+            json.dump(results, file, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+
+    def get_git_revision(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def benchmark_pages(self, size, options):
+        """
+        {page: timings} of each page on the current catalog
+        """
+        variant = ProductVariant.objects.filter(
+            product__in=get_synthetic_products().filter(is_active=True), is_active=True,
+        ).select_related('product').order_by('pk').first()
+        user = get_synthetic_users().order_by('pk').first()
+        if variant is None or user is None:
+            raise CommandError('There is no active synthetic product to request')
+        product = variant.product
+        # Every checkout takes one item (the first one two: the cart page has one in the cart)
+        ProductVariant.objects.filter(pk=variant.pk).update(quantity=F('quantity') + options['requests'] + 2)
+
+        client = Client(HTTP_HOST=options['host'])
+        client.force_login(user)
+
+        def add_to_cart():
+            client.post(
+                reverse('cart:cart_add', kwargs={'pk': product.pk}),
+                {'quantity': 1, 'color': variant.color, 'size': variant.size},
+            )
+
+        order_data = {
+            'first_name': 'Synthetic', 'last_name': 'Customer', 'email': user.email,
+            'phone_number': '09900000000', 'address': 'Synthetic address',
+        }
+        word = product.title.split()[1]
+        # {name: (method, url, data, expected status, prepare)}
+        pages = {
+            'home': ('get', reverse('pages:home_page'), None, 200, None),
+            'category': ('get', reverse('products:product_category_list', args=[product.major_category, product.category]), None, 200, None),
+            'product_detail': ('get', product.get_absolute_url(), None, 200, None),
+            'search': ('get', reverse('products:search'), {'q': word}, 200, None),
+            'cart_detail': ('get', reverse('cart:cart_detail'), None, 200, None),
+            'checkout': ('post', reverse('orders:order_create'), order_data, 302, add_to_cart),
+        }
+        orders = user.orders.count()
+        results = {}
+        for name, (method, url, data, status_code, prepare) in pages.items():
+            if name == 'cart_detail':
+                add_to_cart()
+            results[name] = self.benchmark_page(client, method, url, data, status_code, prepare, options)
+            self.stdout.write(
+                f'{size} products, {name}: median {results[name]["median_ms"]} ms, '
+                f'p95 {results[name]["p95_ms"]} ms, {results[name]["queries"]} queries'
+            )
+        # Checkouts failing (out of stock) redirect too
+        if user.orders.count() - orders != options['requests'] + 1:
+            raise CommandError('Some checkouts did not create an order')
+        return results
+
+    def benchmark_page(self, client, method, url, data, status_code, prepare, options):
+        timings = []
+        # First request warms up templates, caches and search indexes
+        for i in range(options['requests'] + 1):
+            if prepare:
+                prepare()
+            if options['cold']:
+                get_cache().clear()
+            with count_queries() as stats:
+                start = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                duration = time.perf_counter() - start
+            if response.status_code != status_code:
+                raise CommandError(f'{method.upper()} {url} responded {response.status_code}')
+            if i:
+                timings.append(duration * 1000)
+
+        return {
+            'url': url,
+            'requests': len(timings),
+            'median_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(statistics.quantiles(timings, n=20, method='inclusive')[18], 2) if len(timings) > 1 else round(timings[0], 2),
+            'max_ms': round(max(timings), 2),
+            'queries': stats.count,
+            'duplicate_queries': stats.duplicates,
+        }
@@ -0,0 +1,89 @@
+import statistics
+import time
+from wsgiref.util import setup_testing_defaults
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.urls import reverse
+
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure requests per second of the home page and a product page through the WSGI handler, '
+        'with new connections per request and with persistent connections (or the connection pool)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests to each page')
+        parser.add_argument(
+            '--conn-max-age', type=int, nargs='+',
+            help='CONN_MAX_AGE values to compare (default: 0 and the configured one)',
+        )
+        parser.add_argument('--host', default='localhost', help='Host header (must be in ALLOWED_HOSTS)')
+
+    def handle(self, *args, **options):
+        product = Product.active_product_manager.order_by('-sell_count').first()
+        if product is None:
+            raise CommandError('There is no active product to request')
+        urls = [reverse('pages:home_page'), product.get_absolute_url()]
+
+        if 'pool' in connection.settings_dict.get('OPTIONS', {}):
+            # Pooled connections can't be persistent (CONN_MAX_AGE is 0)
+            configurations = [('pool', 0)]
+        else:
+            conn_max_ages = options['conn_max_age'] or list(dict.fromkeys([0, connection.settings_dict['CONN_MAX_AGE']]))
+            configurations = [(f'CONN_MAX_AGE={conn_max_age}', conn_max_age) for conn_max_age in conn_max_ages]
+
+        handler = WSGIHandler()
+        configured_conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            for name, conn_max_age in configurations:
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+                for url in urls:
+                    self.benchmark(handler, name, url, options['host'], options['requests'])
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = configured_conn_max_age
+
+    def request(self, handler, url, host):
+        environ = {'PATH_INFO': url, 'HTTP_HOST': host}
+        setup_testing_defaults(environ)
+        statuses = []
+        response = handler(environ, lambda status, headers: statuses.append(status))
+        b''.join(response)
+        # Fires request_finished, which closes connections older than CONN_MAX_AGE (like a WSGI server)
+        response.close()
+        if not statuses[0].startswith('200'):
+            raise CommandError(f'{url} responded {statuses[0]}')
+
+    def benchmark(self, handler, name, url, host, count):
+        # Warm up templates and caches
+        self.request(handler, url, host)
+
+        connects = []
+
+        def on_connection_created(**kwargs):
+            # With the pool, connections taken from it
+            connects.append(kwargs['connection'])
+
+        connection_created.connect(on_connection_created)
+        timings = []
+        try:
+            start = time.perf_counter()
+            for _ in range(count):
+                request_start = time.perf_counter()
+                self.request(handler, url, host)
+                timings.append((time.perf_counter() - request_start) * 1000)
+            elapsed = time.perf_counter() - start
+        finally:
+            connection_created.disconnect(on_connection_created)
+
+        self.stdout.write(
+            f'{name} {url}: {count / elapsed:.1f} requests/s, median {statistics.median(timings):.1f} ms, '
+            f'{len(connects)} connections'
+        )
@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.models import CustomUser
+from products.models import Cover
+from shared.images import create_derivatives
+
+
+class Command(BaseCommand):
+    help = (
+        'Create missing derivatives (WebP/JPEG thumbnails) of product covers and profile photos, '
+        'like images uploaded before derivatives existed or after IMAGE_DERIVATIVE_WIDTHS changed (with --force)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Recreate existing derivatives too')
+        parser.add_argument(
+            '--workers', type=int, default=max(settings.IMAGE_DERIVATIVE_WORKERS, 1), help='Images processed at once',
+        )
+
+    def handle(self, *args, **options):
+        images = [cover.cover for cover in Cover.objects.exclude(cover='').only('pk', 'cover').iterator()]
+        images += [user.profile_photo for user in CustomUser.objects.exclude(profile_photo='').only('pk', 'profile_photo').iterator()]
+
+        created = skipped = failed = 0
+
+        def create(image):
+            try:
+                return create_derivatives(image, force=options['force'])
+            except Exception as error:
+                return error
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for image, result in zip(images, executor.map(create, images)):
+                if isinstance(result, Exception):
+                    failed += 1
+                    self.stderr.write(f'{image.name}: {result}')
+                elif result:
+                    created += 1
+                else:
+                    skipped += 1
+
+        self.stdout.write(f'{len(images)} images: {created} created, {skipped} already had derivatives, {failed} failed')
@@ -0,0 +1,228 @@
+import random
+
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from cart.models import CartItem
+from orders.models import Order, OrderItem
+from products.catalog_cache import invalidate_catalog
+from products.models import Product, ProductVariant, Cover, Comment
+from profiles.models import CustomUserFavorite
+from products.search import is_full_text_search_available
+
+
+User = get_user_model()
+
+# Synthetic users (and so their products, comments and orders) have emails of this domain
+SYNTHETIC_EMAIL_DOMAIN = 'synthetic.invalid'
+
+ADJECTIVES = ('Leather', 'Suede', 'Classic', 'Light', 'Canvas', 'Waterproof', 'Comfort', 'Slim', 'Vintage', 'Soft')
+NOUNS = {
+    'Women': ('Sandal', 'Sneaker', 'Loafer', 'Pump', 'Boot'),
+    'Men': ('Sneaker', 'Loafer', 'Oxford', 'Boot', 'Slipper'),
+    'Bags': ('Tote', 'Backpack', 'Satchel', 'Wallet', 'Duffel'),
+    'Clothing': ('Jacket', 'Coat', 'Hat', 'Parka', 'Vest'),
+    'Accessory': ('Belt', 'Strap', 'Lace', 'Buckle', 'Keychain'),
+    'ShoesCare': ('Insole', 'Wax', 'Brush', 'Spray', 'Polish'),
+}
+
+
+def get_synthetic_users():
+    return User.objects.filter(email__endswith=f'@{SYNTHETIC_EMAIL_DOMAIN}')
+
+
+def get_synthetic_products():
+    return Product.objects.filter(user__email__endswith=f'@{SYNTHETIC_EMAIL_DOMAIN}')
+
+
+def delete_synthetic_data():
+    """
+    Delete synthetic users and their rows with one DELETE per table, children first
+    (delete() would load every row to cascade and send its signals; foreign keys are checked at commit)
+    Returns the number of deleted rows
+    """
+    users = get_synthetic_users()
+    products = Product.objects.filter(user__in=users)
+    variants = ProductVariant.objects.filter(product__in=products)
+    querysets = [
+        OrderItem.objects.filter(Q(order__user__in=users) | Q(product_variant__in=variants)),
+        CartItem.objects.filter(product_variant__in=variants),
+        CustomUserFavorite.objects.filter(Q(user__in=users) | Q(product__in=products)),
+        Comment.objects.filter(Q(user__in=users) | Q(product__in=products)),
+        Cover.objects.filter(product__in=products),
+        variants,
+        Order.objects.filter(user__in=users),
+        LogEntry.objects.filter(user__in=users),
+        products,
+        users,
+    ]
+    with transaction.atomic():
+        deleted = sum(queryset._raw_delete(queryset.db) for queryset in querysets)
+    invalidate_catalog()
+    return deleted
+
+
+class Command(BaseCommand):
+    help = (
+        'Add synthetic products (with variants, covers and comments), users and orders with bulk inserts, '
+        'until the catalog has the given number of synthetic products. For benchmarks: use a throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('products', type=int, help='Number of synthetic products to reach')
+        parser.add_argument('--users', type=int, default=200, help='Number of synthetic users to reach')
+        parser.add_argument('--orders', type=int, help='Orders added per product added / 10 (default)')
+        parser.add_argument('--comments', type=int, default=3, help='Maximum comments of each product')
+        parser.add_argument('--covers', type=int, default=2, help='Covers of each product')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Products inserted per transaction')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (same seed, same catalog)')
+        parser.add_argument('--clear', action='store_true', help='Delete synthetic data first')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.stdout.write(f'Deleted {delete_synthetic_data()} synthetic rows')
+
+        existing = get_synthetic_products().count()
+        missing = options['products'] - existing
+        if missing <= 0:
+            self.stdout.write(f'There are {existing} synthetic products already')
+            return
+        self.random = random.Random(options['seed'] + existing)
+
+        users = self.create_users(options['users'])
+        if not users:
+            raise CommandError('Synthetic products need at least one synthetic user')
+
+        variant_ids = []
+        for offset in range(0, missing, options['batch_size']):
+            count = min(options['batch_size'], missing - offset)
+            with transaction.atomic():
+                variant_ids += self.create_products(
+                    existing + offset, count, users, options['covers'], options['comments'],
+                )
+            self.stdout.write(f'{existing + offset + count} synthetic products')
+
+        orders = options['orders'] if options['orders'] is not None else missing // 10
+        if orders and variant_ids:
+            with transaction.atomic():
+                self.create_orders(orders, users, variant_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'{get_synthetic_products().count()} synthetic products, {len(users)} users, {orders} orders added'
+        ))
+
+    def create_users(self, count):
+        users = list(get_synthetic_users().values_list('pk', flat=True))
+        start = len(users)
+        # Benchmarks log in with force_login
+        password = make_password(None)
+        created = User.objects.bulk_create([
+            User(
+                email=f'user{i}@{SYNTHETIC_EMAIL_DOMAIN}', username=f'synthetic{i}', phone_number=f'0990{i:07d}',
+                first_name='Synthetic', last_name=f'User {i}', password=password,
+            )
+            for i in range(start, count)
+        ])
+        return users + [user.pk for user in created]
+
+    def create_products(self, start, count, users, covers, comments):
+        """
+        Insert count products with their variants, covers and comments; returns the variant ids
+        """
+        categories = sorted(Product.CATEGORY_SET)
+        colors = [color for color, label in ProductVariant.COLORS]
+        products = []
+        for i in range(start, start + count):
+            category = self.random.choice(categories)
+            major_category = Product.CATEGORY_MAJOR_CATEGORIES[category]
+            price = self.random.randrange(200_000, 10_000_000, 10_000)
+            offer = self.random.random() < 0.2
+            product = Product(
+                title=f'{self.random.choice(ADJECTIVES)} {self.random.choice(NOUNS[major_category])} {i}',
+                short_description=f'Synthetic {major_category.lower()} product {i}',
+                description=f'<p>Synthetic product {i} for benchmarks.</p>',
+                material=self.random.choice(('Leather', 'Canvas', 'Suede', 'Rubber', '')),
+                price=price,
+                offer=offer,
+                offer_price=price * 8 // 10 if offer else None,
+                category=category,
+                user_id=self.random.choice(users),
+            )
+            product.update_derived_fields()
+            products.append(product)
+        Product.objects.bulk_create(products)
+
+        variants = []
+        for product in products:
+            sizes = [size for size, label in ProductVariant.SIZES_BY_MAJOR_CATEGORY[product.major_category]]
+            for color in self.random.sample(colors, self.random.randint(1, 3)):
+                for size in self.random.sample(sizes, min(len(sizes), self.random.randint(1, 4))):
+                    # Some variants are sold out
+                    quantity = self.random.choice((0, 1, 2, 5, 10, 20))
+                    variants.append(ProductVariant(
+                        product_id=product.pk, color=color, size=size, quantity=quantity, is_active=quantity > 0,
+                    ))
+        ProductVariant.objects.bulk_create(variants)
+
+        Cover.objects.bulk_create([
+            Cover(product_id=product.pk, cover=f'products/covers/synthetic_{product.pk % 50}_{position}.jpg', position=position)
+            for product in products for position in range(covers)
+        ])
+        Comment.objects.bulk_create([
+            Comment(
+                product_id=product.pk, user_id=self.random.choice(users), text='Synthetic comment',
+                rate=self.random.randint(1, 5), recommend=self.random.random() < 0.8,
+            )
+            for product in products for _ in range(self.random.randint(0, comments))
+        ])
+
+        # Rows bulk inserts (and signals) don't maintain
+        product_ids = [product.pk for product in products]
+        batch = Product.objects.filter(pk__in=product_ids)
+        batch.sync_activation()
+        batch.update_primary_covers(product_ids)
+        batch.rebuild_ratings()
+        if is_full_text_search_available():
+            batch.update_search_vectors()
+        return [variant.pk for variant in variants]
+
+    def create_orders(self, count, users, variant_ids):
+        """
+        Insert count orders (most of them paid) of random variants; stock isn't reserved
+        """
+        now = timezone.now()
+        orders = []
+        for _ in range(count):
+            is_paid = self.random.random() < 0.7
+            orders.append(Order(
+                user_id=self.random.choice(users), first_name='Synthetic', last_name='Customer',
+                email=f'customer@{SYNTHETIC_EMAIL_DOMAIN}', phone_number='09900000000', address='Synthetic address',
+                is_paid=is_paid, status=1 if is_paid else 0, datetime_payment=now if is_paid else None,
+            ))
+        Order.objects.bulk_create(orders)
+
+        order_variants = [
+            (order, self.random.sample(variant_ids, min(len(variant_ids), self.random.randint(1, 3))))
+            for order in orders
+        ]
+        sold_variant_ids = {variant_id for order, chosen in order_variants for variant_id in chosen}
+        prices = dict(ProductVariant.objects.filter(pk__in=sold_variant_ids).values_list('pk', 'product__offer_price'))
+        items = []
+        for order, chosen in order_variants:
+            order_items = [
+                OrderItem(order_id=order.pk, product_variant_id=variant_id, quantity=self.random.randint(1, 2), price=prices[variant_id])
+                for variant_id in chosen
+            ]
+            # Total price of paid orders is stored (Order.activate_order)
+            if order.is_paid:
+                order.total_price = sum(item.quantity * item.price for item in order_items)
+            items += order_items
+        OrderItem.objects.bulk_create(items)
+        Order.objects.bulk_update([order for order in orders if order.is_paid], ['total_price'])
+
+        sold_products = ProductVariant.objects.filter(pk__in=sold_variant_ids).values('product')
+        Product.objects.filter(pk__in=sold_products).rebuild_sell_counts()
@@ -0,0 +1,317 @@
+import json
+import random
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
+from django.test import Client
+from django.urls import Resolver404, resolve, reverse
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from payment.views import get_zarinpal_url
+from products.models import ProductVariant
+from .generate_catalog import get_synthetic_products, get_synthetic_users
+
+
+def percentile(timings, percent):
+    return statistics.quantiles(timings, n=100, method='inclusive')[percent - 1] if len(timings) > 1 else timings[0]
+
+
+class LockWaitMonitor(threading.Thread):
+    """
+    Sample the sessions of the database waiting for a lock (postgres), every interval seconds
+    """
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.samples = []
+
+    def run(self):
+        try:
+            with connection.cursor() as cursor:
+                while not self.stopped.is_set():
+                    cursor.execute(
+                        "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND wait_event_type = 'Lock'"
+                    )
+                    self.samples.append(cursor.fetchone()[0])
+                    self.stopped.wait(self.interval)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return {
+            'samples': len(self.samples),
+            'samples_with_waits': sum(1 for waiting in self.samples if waiting),
+            'max_waiting_sessions': max(self.samples, default=0),
+        }
+
+
+class VirtualUser:
+    """
+    A customer browsing, adding a (hot) variant to the cart, ordering and paying, with its own HTTP session
+    """
+
+    def __init__(self, command, base_url, session_key, variants, options):
+        self.command = command
+        self.base_url = base_url
+        self.variants = variants
+        self.options = options
+        self.random = random.Random(session_key)
+        self.http = requests.Session()
+        self.http.cookies.set(settings.SESSION_COOKIE_NAME, session_key)
+
+    def request(self, step, method, path, data=None):
+        """
+        Timed request (redirects aren't followed); None if it failed
+        """
+        url = urljoin(self.base_url, path)
+        if data is not None:
+            data = {**data, 'csrfmiddlewaretoken': self.http.cookies.get(settings.CSRF_COOKIE_NAME, '')}
+        start = time.perf_counter()
+        try:
+            response = self.http.request(method, url, data=data, allow_redirects=False, timeout=self.options['timeout'])
+        except requests.RequestException:
+            response = None
+        duration = time.perf_counter() - start
+        ok = response is not None and response.status_code < 400
+        self.command.record(step, duration, ok)
+        return response if ok else None
+
+    def run(self):
+        for _ in range(self.options['iterations']):
+            self.checkout()
+            if self.options['think_time']:
+                time.sleep(self.options['think_time'])
+
+    def checkout(self):
+        variant = self.random.choice(self.variants)
+        # Carts are refilled when payments fail
+        if not self.request('cart_clear', 'GET', reverse('cart:cart_clear')):
+            return self.command.outcome('error')
+        if not self.request('home', 'GET', reverse('pages:home_page')):
+            return self.command.outcome('error')
+        if not self.request('product', 'GET', reverse('products:product_detail', kwargs={'pk': variant.product_id})):
+            return self.command.outcome('error')
+        if not self.request('add_to_cart', 'POST', reverse('cart:cart_add', kwargs={'pk': variant.product_id}), {
+            'quantity': self.options['quantity'], 'color': variant.color, 'size': variant.size,
+        }):
+            return self.command.outcome('error')
+
+        response = self.request('order_create', 'POST', reverse('orders:order_create'), {
+            'first_name': 'Load', 'last_name': 'Test', 'email': 'load@synthetic.invalid',
+            'phone_number': '09900000000', 'address': 'Load test address',
+        })
+        if response is None:
+            return self.command.outcome('error')
+        location = urlsplit(response.headers.get('Location', '')).path
+        try:
+            view_name = resolve(location).view_name
+        except Resolver404:
+            view_name = None
+        if view_name in ('cart:cart_detail', 'products:product_list'):
+            # Back to the cart (sold out after it was added) or the product list (sold out when added: empty cart)
+            return self.command.outcome('out_of_stock')
+        if view_name != 'orders:order_confirm':
+            return self.command.outcome('error')
+
+        response = self.request('order_confirm', 'POST', location, {})
+        if response is None:
+            return self.command.outcome('error')
+        response = self.request('payment_request', 'GET', response.headers['Location'])
+        if response is None or not response.headers.get('Location', '').startswith(get_zarinpal_url('StartPay/')):
+            return self.command.outcome('payment_request_failed' if response is not None else 'error')
+        # The (stubbed) gateway sends the customer back to the callback
+        response = self.request('start_pay', 'GET', response.headers['Location'])
+        if response is None:
+            return self.command.outcome('error')
+        if not self.request('payment_callback', 'GET', response.headers['Location']):
+            return self.command.outcome('error')
+        self.command.outcome('checked_out')
+
+
+class Command(BaseCommand):
+    help = (
+        'Run concurrent checkouts (browse, add to cart, order_create, payment, callback) of synthetic users '
+        '(generate_catalog) against a running server using the Zarinpal stub (run_zarinpal_stub, '
+        'DJANGO_ZARINPAL_SANDBOX_URL), then report throughput, latency percentiles, oversold variants, empty orders and lock waits. '
+        'Changes stock of the hot variants: use a throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000', help='Site under test')
+        parser.add_argument('--users', type=int, default=10, help='Concurrent virtual users')
+        parser.add_argument('--iterations', type=int, default=5, help='Checkouts of each user')
+        parser.add_argument('--hot-variants', type=int, default=3, help='Variants all users buy')
+        parser.add_argument('--stock', type=int, default=20, help='Quantity of each hot variant at start')
+        parser.add_argument('--quantity', type=int, default=1, help='Quantity of each checkout')
+        parser.add_argument('--think-time', type=float, default=0, help='Seconds between checkouts of a user')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for a response')
+        parser.add_argument('--output', help='JSON file of the results')
+
+    def handle(self, *args, **options):
+        if 'zarinpal.com' in settings.ZARINPAL_SANDBOX_URL:
+            raise CommandError('Set DJANGO_ZARINPAL_SANDBOX_URL to the stub (run_zarinpal_stub), here and on the server')
+        variants = list(ProductVariant.objects.filter(
+            product__in=get_synthetic_products(), is_active=True,
+        ).order_by('pk')[:options['hot_variants']])
+        users = list(get_synthetic_users().order_by('pk')[:options['users']])
+        if len(variants) < options['hot_variants'] or len(users) < options['users']:
+            raise CommandError('Not enough synthetic variants or users (run generate_catalog)')
+        ProductVariant.objects.filter(pk__in=[variant.pk for variant in variants]).update(
+            quantity=options['stock'], is_active=True,
+        )
+
+        # Logged in sessions of the users
+        session_keys = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            session_keys.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.failures = Counter()
+        self.outcomes = Counter()
+        virtual_users = [VirtualUser(self, options['base_url'], key, variants, options) for key in session_keys]
+
+        started_at = timezone.now()
+        deadlocks = self.get_deadlocks()
+        monitor = LockWaitMonitor() if connection.vendor == 'postgresql' else None
+        if monitor:
+            monitor.start()
+        start = time.perf_counter()
+        threads = [threading.Thread(target=virtual_user.run) for virtual_user in virtual_users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        lock_waits = monitor.stop() if monitor else None
+        if lock_waits is not None:
+            lock_waits['deadlocks'] = self.get_deadlocks() - deadlocks
+
+        results = {
+            'users': options['users'],
+            'iterations': options['iterations'],
+            'elapsed_s': round(elapsed, 2),
+            'checkouts_per_s': round(self.outcomes['checked_out'] / elapsed, 2),
+            'requests_per_s': round(sum(map(len, self.timings.values())) / elapsed, 2),
+            'outcomes': dict(self.outcomes),
+            'steps': self.get_step_results(),
+            'orders': self.get_order_results(users, started_at),
+            'stock': self.get_stock_results(variants, options['stock'], started_at),
+            'lock_waits': lock_waits,
+        }
+        results['incidents'] = self.get_incidents(users, started_at)
+        self.write_report(results)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+
+    def record(self, step, duration, ok):
+        with self.lock:
+            self.timings[step].append(duration * 1000)
+            if not ok:
+                self.failures[step] += 1
+
+    def outcome(self, name):
+        with self.lock:
+            self.outcomes[name] += 1
+
+    def get_deadlocks(self):
+        if connection.vendor != 'postgresql':
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()')
+            return cursor.fetchone()[0]
+
+    def get_step_results(self):
+        return {
+            step: {
+                'requests': len(timings),
+                'failures': self.failures[step],
+                'median_ms': round(statistics.median(timings), 2),
+                'p90_ms': round(percentile(timings, 90), 2),
+                'p99_ms': round(percentile(timings, 99), 2),
+                'max_ms': round(max(timings), 2),
+            }
+            for step, timings in self.timings.items()
+        }
+
+    def get_order_results(self, users, started_at):
+        orders = Order.objects.filter(user__in=users, datetime_created__gte=started_at)
+        return {
+            'created': orders.count(),
+            'paid': orders.filter(is_paid=True).count(),
+            'canceled': orders.filter(status=4).count(),
+            'not_paid': orders.filter(is_paid=False, status=0).count(),
+        }
+
+    def get_incidents(self, users, started_at):
+        """
+        Orders no checkout should create: without items, or with items of no amount
+        """
+        orders = Order.objects.filter(user__in=users, datetime_created__gte=started_at).annotate(
+            item_count=Count('items'), amount=Coalesce(Sum(F('items__quantity') * F('items__price')), 0),
+        )
+        return {
+            'empty_orders': list(orders.filter(item_count=0).values_list('pk', flat=True)),
+            'zero_amount_orders': list(orders.filter(item_count__gt=0, amount=0).values_list('pk', flat=True)),
+        }
+
+    def get_stock_results(self, variants, stock, started_at):
+        """
+        Oversold variants (more reserved by orders than the stock) and variants whose quantity doesn't add up
+        """
+        reserved = dict(OrderItem.objects.filter(
+            product_variant__in=variants, order__datetime_created__gte=started_at,
+        ).exclude(order__status=4).values('product_variant').annotate(total=Sum('quantity')).values_list(
+            'product_variant', 'total',
+        ))
+        quantities = dict(ProductVariant.objects.filter(pk__in=[variant.pk for variant in variants]).values_list('pk', 'quantity'))
+        return {
+            'reserved': sum(reserved.values()),
+            'oversold_variants': [pk for pk in quantities if reserved.get(pk, 0) > stock],
+            'mismatched_variants': [pk for pk, quantity in quantities.items() if quantity != stock - reserved.get(pk, 0)],
+        }
+
+    def write_report(self, results):
+        self.stdout.write(f'{"step":<18}{"requests":>9}{"failures":>9}{"median":>9}{"p90":>9}{"p99":>9}{"max":>9}  (ms)')
+        for step, row in results['steps'].items():
+            self.stdout.write(
+                f'{step:<18}{row["requests"]:>9}{row["failures"]:>9}{row["median_ms"]:>9.1f}'
+                f'{row["p90_ms"]:>9.1f}{row["p99_ms"]:>9.1f}{row["max_ms"]:>9.1f}'
+            )
+        self.stdout.write(
+            f'{results["checkouts_per_s"]} checkouts/s, {results["requests_per_s"]} requests/s in {results["elapsed_s"]} s'
+        )
+        self.stdout.write(f'Outcomes: {results["outcomes"]}, orders: {results["orders"]}')
+        self.stdout.write(f'Lock waits: {results["lock_waits"]}')
+        incidents = results['incidents']
+        message = f'Empty orders: {incidents["empty_orders"]}, zero amount orders: {incidents["zero_amount_orders"]}'
+        if incidents['empty_orders'] or incidents['zero_amount_orders']:
+            self.stdout.write(self.style.ERROR(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
+        stock = results['stock']
+        message = (
+            f'{stock["reserved"]} items reserved, oversold variants: {stock["oversold_variants"]}, '
+            f'mismatched quantities: {stock["mismatched_variants"]}'
+        )
+        if stock['oversold_variants'] or stock['mismatched_variants']:
+            self.stdout.write(self.style.ERROR(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
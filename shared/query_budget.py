@@ -0,0 +1,94 @@
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """
+    Number, total duration and duplicates of the SQL queries run in a block (see count_queries)
+    Duplicates are queries with the same SQL (whatever the parameters), like the queries of an N+1 loop
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() wrapper
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values())
+
+    def most_duplicated(self, limit=3):
+        return [(sql, count) for sql, count in self.statements.most_common(limit) if count > 1]
+
+    def describe(self):
+        lines = [f'{self.count} queries ({self.duplicates} duplicates) in {self.duration * 1000:.1f} ms']
+        lines += [f'  {count}x {sql}' for sql, count in self.most_duplicated()]
+        return '\n'.join(lines)
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the queries run on every database connection of this thread in the block
+
+        with count_queries() as stats:
+            ...
+        stats.count, stats.duration, stats.duplicates
+    """
+    stats = QueryStats()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        yield stats
+
+
+class QueryBudgetMiddleware:
+    """
+    Count queries of each request (settings.QUERY_BUDGET_ENABLED) and report them in the Server-Timing header
+    Requests running more than settings.QUERY_BUDGET queries are logged with their most duplicated SQL
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_BUDGET_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with count_queries() as stats:
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        server_timing = (
+            f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries, {stats.duplicates} duplicates", '
+            f'app;dur={duration * 1000:.1f}'
+        )
+        if response.has_header('Server-Timing'):
+            server_timing = f"{response['Server-Timing']}, {server_timing}"
+        response['Server-Timing'] = server_timing
+
+        if stats.count > settings.QUERY_BUDGET:
+            logger.warning(
+                '%s %s is over the query budget (%s): %s',
+                request.method, request.path, settings.QUERY_BUDGET, stats.describe(),
+            )
+        return response
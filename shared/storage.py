@@ -0,0 +1,22 @@
+from urllib.parse import urlsplit
+
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """
+    Hashed file names and gzip/brotli compressed copies of static files (production profile)
+    WhiteNoise serves hashed files as immutable, cached by browsers for ten years
+    CSS references to files missing from static/ are left as they are, instead of failing collectstatic
+    (vendor.css refers to jQuery UI theme images which aren't shipped)
+    """
+    # {% static %} of a file missing from the manifest gives its unhashed url (not a server error)
+    manifest_strict = False
+
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            if content is not None or self.exists(urlsplit(name).path):
+                raise
+            return name
@@ -0,0 +1,29 @@
+from django import template
+
+from shared.images import get_derivative_names, has_derivatives
+
+
+register = template.Library()
+
+
+@register.inclusion_tag('shared/partials/picture.html')
+def picture(image, sizes='100vw', **attributes):
+    """
+    <picture> of an uploaded image with srcsets of its derivatives (WebP and JPEG), or the original until they're created
+    Other keyword arguments are attributes of <img>
+
+        {% picture cover.cover sizes='100px' alt=product.title class='img-fluid' %}
+    """
+    attributes.setdefault('loading', 'lazy')
+    context = {'image': image, 'sizes': sizes, 'attributes': attributes}
+    if has_derivatives(image):
+        srcsets = {}
+        for width, image_format, name in get_derivative_names(image.name):
+            srcsets.setdefault(image_format, []).append((image.storage.url(name), width))
+        context['webp_srcset'] = ', '.join(f'{url} {width}w' for url, width in srcsets['webp'])
+        context['jpeg_srcset'] = ', '.join(f'{url} {width}w' for url, width in srcsets['jpeg'])
+        # Largest JPEG, for browsers without srcset
+        context['src'] = srcsets['jpeg'][-1][0]
+    else:
+        context['src'] = image.url
+    return context
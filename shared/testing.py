@@ -0,0 +1,22 @@
+from .query_budget import count_queries
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin pinning the number of queries of views
+
+        self.assertQueryBudget(reverse('pages:home_page'), 6)
+    """
+
+    def assertQueryBudget(self, url, budget, data=None, max_duplicates=None, status_code=200):
+        """
+        GET url and fail if it runs more than budget queries (or more than max_duplicates duplicate ones)
+        """
+        with count_queries() as stats:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, status_code)
+        if stats.count > budget:
+            self.fail(f'{url} is over its query budget ({budget}): {stats.describe()}')
+        if max_duplicates is not None and stats.duplicates > max_duplicates:
+            self.fail(f'{url} runs more than {max_duplicates} duplicate queries: {stats.describe()}')
+        return response
@@ -0,0 +1,366 @@
+from django.test import TestCase, SimpleTestCase, LiveServerTestCase, override_settings
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.urls import reverse
+
+import io
+import json
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock
+from PIL import Image
+
+from orders.models import Order, OrderItem
+from payment.zarinpal_stub import ZarinpalStub, make_stub_server
+from products.models import Product, ProductVariant, Cover
+from .cache_stats import InstrumentedCache, get_cache_stats, reset_cache_stats
+from .checks import check_static_references
+from .images import get_cache as get_derivatives_cache, get_derivative_names, has_derivatives
+from .management.commands.generate_catalog import get_synthetic_products, get_synthetic_users
+from .query_budget import count_queries
+
+
+class InstrumentedCacheTest(SimpleTestCase):
+    def setUp(self):
+        reset_cache_stats()
+        self.cache = InstrumentedCache('instrumented-test', {
+            'INSTRUMENTED_BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'ALIAS': 'test',
+        })
+        self.cache.clear()
+
+    def test_hits_and_misses_counted(self):
+        """
+        Test get, get_many and get_or_set count the reads of the backend
+        """
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertEqual(self.cache.get_many(['key', 'other']), {'key': 'value'})
+        # Miss, then the value is read back after it's added
+        self.assertEqual(self.cache.get_or_set('other', 'default'), 'default')
+
+        self.assertEqual(get_cache_stats(), {'test': {'hits': 3, 'misses': 3, 'hit_rate': 50.0}})
+
+    def test_cached_falsy_value_is_hit(self):
+        """
+        Test cached None and defaults aren't mistaken for misses
+        """
+        self.cache.set('key', None)
+        self.assertEqual(self.cache.get('key', 'default'), None)
+        self.assertEqual(self.cache.get('missing', 'default'), 'default')
+        self.assertEqual(get_cache_stats()['test']['hits'], 1)
+        self.assertEqual(get_cache_stats()['test']['misses'], 1)
+
+
+class CacheStatsViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = get_user_model().objects.create_user(
+            email='staff@test.com',
+            phone_number='09123456789',
+            is_staff=True,
+        )
+
+    def test_cache_stats_view_requires_staff(self):
+        response = self.client.get(reverse('cache_stats'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_cache_stats_view_lists_aliases(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('cache_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'shared/cache_stats.html')
+        for alias in ('default', 'sessions', 'template_fragments', 'catalog'):
+            self.assertContains(response, f'<td>{alias}</td>', html=True)
+
+
+class StaticReferencesCheckTest(SimpleTestCase):
+    def test_project_templates_refer_to_existing_files(self):
+        self.assertEqual(check_static_references(), [])
+
+    def test_missing_static_file_is_error(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, 'page.html').write_text(
+                "{% load static %}\n<link href=\"{% static 'css/main.css' %}\">\n<img src=\"{% static 'img/missing.png' %}\">\n"
+            )
+            templates = [{**settings.TEMPLATES[0], 'DIRS': [directory]}]
+            with override_settings(TEMPLATES=templates):
+                errors = check_static_references()
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].id, 'shared.E001')
+        self.assertIn("'img/missing.png'", errors[0].msg)
+        self.assertIn('page.html:3', errors[0].msg)
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_DERIVATIVE_WIDTHS=[100, 320], IMAGE_DERIVATIVE_WORKERS=0)
+class ImageDerivativesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.product = Product.objects.create(
+            title='Loafer 320 Sport',
+            short_description='The newest 2026 sport model',
+            description='Men sport TestDescription',
+            category='m-sport',
+            price=4560000,
+            user=cls.user,
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        get_derivatives_cache().clear()
+
+    def get_upload(self, name='cover.png', size=(800, 600)):
+        content = io.BytesIO()
+        Image.new('RGBA', size, (200, 30, 30, 128)).save(content, format='PNG')
+        return SimpleUploadedFile(name, content.getvalue(), content_type='image/png')
+
+    def render_picture(self, image):
+        return Template("{% load image_tags %}{% picture image sizes='100px' alt='Cover' class='img-fluid' %}").render(
+            Context({'image': image})
+        )
+
+    def test_derivatives_created_after_commit(self):
+        """
+        Test uploading a cover creates each width as WebP and JPEG once committed
+        """
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            cover = Cover.objects.create(product=self.product, cover=self.get_upload())
+        self.assertFalse(has_derivatives(cover.cover))
+
+        for callback in callbacks:
+            callback()
+        self.assertTrue(has_derivatives(cover.cover))
+
+        names = [name for width, image_format, name in get_derivative_names(cover.cover.name)]
+        self.assertEqual(len(names), 4)
+        self.assertTrue(names[0].endswith('.100w.webp'))
+        with cover.cover.storage.open(names[-1]) as file:
+            image = Image.open(file)
+            self.assertEqual((image.format, image.size), ('JPEG', (320, 240)))
+
+    def test_picture_tag(self):
+        """
+        Test <picture> with srcsets once derivatives exist, the original before
+        """
+        with self.captureOnCommitCallbacks(execute=False):
+            cover = Cover.objects.create(product=self.product, cover=self.get_upload())
+        html = self.render_picture(cover.cover)
+        self.assertNotIn('srcset', html)
+        self.assertIn(f'src="{cover.cover.url}"', html)
+
+        call_command('create_image_derivatives', stdout=io.StringIO())
+        html = self.render_picture(cover.cover)
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('.100w.webp 100w', html)
+        self.assertIn('.320w.jpg 320w', html)
+        self.assertIn('class="img-fluid"', html)
+        self.assertIn('loading="lazy"', html)
+
+    def test_picture_tag_does_not_check_storage(self):
+        """
+        Test rendering reads the record of the derivative job, not the storage
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            cover = Cover.objects.create(product=self.product, cover=self.get_upload())
+        with mock.patch.object(cover.cover.storage, 'exists', side_effect=AssertionError('Storage checked')):
+            self.assertIn('.100w.webp 100w', self.render_picture(cover.cover))
+
+    def test_derivatives_deleted_with_cover(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cover = Cover.objects.create(product=self.product, cover=self.get_upload())
+        names = [name for width, image_format, name in get_derivative_names(cover.cover.name)]
+        with self.captureOnCommitCallbacks(execute=True):
+            cover.delete()
+        self.assertFalse([name for name in names if cover.cover.storage.exists(name)])
+        self.assertFalse(has_derivatives(cover.cover))
+
+    def test_derivatives_deleted_with_replaced_profile_photo(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.profile_photo = self.get_upload('photo.png')
+            self.user.save()
+        user = get_user_model().objects.get(pk=self.user.pk)
+        old_photo = user.profile_photo.name
+        self.assertTrue(has_derivatives(user.profile_photo))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.profile_photo = self.get_upload('new_photo.png')
+            user.save()
+        storage = user.profile_photo.storage
+        self.assertFalse([
+            name for width, image_format, name in get_derivative_names(old_photo) if storage.exists(name)
+        ])
+        self.assertTrue(has_derivatives(user.profile_photo))
+
+    def test_backfill_command(self):
+        """
+        Test existing covers without derivatives are backfilled once
+        """
+        with self.captureOnCommitCallbacks(execute=False):
+            cover = Cover.objects.create(product=self.product, cover=self.get_upload(size=(60, 40)))
+
+        out = io.StringIO()
+        call_command('create_image_derivatives', stdout=out)
+        self.assertIn('1 created', out.getvalue())
+        self.assertTrue(has_derivatives(cover.cover))
+
+        out = io.StringIO()
+        call_command('create_image_derivatives', stdout=out)
+        self.assertIn('1 already had derivatives', out.getvalue())
+
+
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email='test@test.com',
+            phone_number='09123456789',
+        )
+        cls.product = Product.objects.create(
+            title='Budget Loafer',
+            short_description='Budget short description',
+            description='Budget description',
+            category='m-sport',
+            price=4560000,
+            user=cls.user,
+        )
+
+    def test_count_queries(self):
+        """
+        Test queries with the same SQL (whatever the parameters) are duplicates
+        """
+        with count_queries() as stats:
+            for pk in (self.product.pk, 0, self.product.pk):
+                list(Product.objects.filter(pk=pk))
+            Product.objects.count()
+        self.assertEqual(stats.count, 4)
+        self.assertEqual(stats.duplicates, 2)
+        self.assertEqual(len(stats.most_duplicated()), 1)
+        self.assertGreater(stats.duration, 0)
+
+    @override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET=1)
+    def test_server_timing_header_and_log(self):
+        """
+        Test requests over the budget are logged and every response has the Server-Timing header
+        """
+        self.client.force_login(self.user)
+        with self.assertLogs('shared.query_budget', 'WARNING') as logs:
+            response = self.client.get(reverse('products:product_detail', kwargs={'pk': self.product.pk}))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries, \d+ duplicates", app;dur=[\d.]+$')
+        self.assertIn('is over the query budget (1)', logs.output[0])
+
+        with self.assertNoLogs('shared.query_budget'):
+            response = self.client.get(reverse('pages:about_page'))
+        self.assertIn('desc="1 queries, 0 duplicates"', response['Server-Timing'])
+
+    @override_settings(QUERY_BUDGET_ENABLED=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('pages:about_page'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class GenerateCatalogTest(TestCase):
+    def generate(self, products, **options):
+        call_command('generate_catalog', products, users=3, batch_size=20, stdout=io.StringIO(), **options)
+
+    def test_generate_catalog(self):
+        """
+        Test generated rows are consistent (what signals and model saves would maintain)
+        """
+        self.generate(30, orders=5)
+        products = get_synthetic_products()
+        self.assertEqual(products.count(), 30)
+        self.assertEqual(get_synthetic_users().count(), 3)
+        self.assertEqual(Order.objects.count(), 5)
+
+        for product in products.prefetch_related('variants', 'comments'):
+            sizes = dict(ProductVariant.SIZES_BY_MAJOR_CATEGORY[product.major_category])
+            self.assertTrue(all(variant.size in sizes for variant in product.variants.all()))
+            self.assertEqual(product.is_active, any(variant.is_active for variant in product.variants.all()))
+            self.assertEqual(product.rating_count, len(product.comments.all()))
+            self.assertIsNotNone(product.primary_cover_id)
+        for order in Order.objects.filter(is_paid=True):
+            self.assertEqual(order.total_price, sum(item.quantity * item.price for item in order.items.all()))
+        self.assertEqual(
+            sum(products.values_list('sell_count', flat=True)),
+            sum(OrderItem.objects.filter(order__is_paid=True).values_list('quantity', flat=True)),
+        )
+
+    def test_generate_catalog_adds_missing_products(self):
+        self.generate(10)
+        self.generate(25)
+        self.assertEqual(get_synthetic_products().count(), 25)
+
+        self.generate(0, clear=True)
+        self.assertFalse(get_synthetic_users().exists())
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(ProductVariant.objects.exists())
+
+
+class BenchmarkCatalogTest(TestCase):
+    def test_benchmark_catalog(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'results.json'
+            call_command(
+                'benchmark_catalog', sizes=[5, 10], requests=2, output=str(output), host='testserver', label='test',
+                stdout=io.StringIO(),
+            )
+            results = json.loads(output.read_text())
+
+        self.assertEqual(results['label'], 'test')
+        self.assertEqual(list(results['sizes']), ['5', '10'])
+        self.assertEqual(
+            list(results['sizes']['10']),
+            ['home', 'category', 'product_detail', 'search', 'cart_detail', 'checkout'],
+        )
+        self.assertEqual(results['sizes']['10']['checkout']['requests'], 2)
+        self.assertEqual(get_synthetic_products().count(), 10)
+
+
+class LoadTestCheckoutTest(LiveServerTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        server = make_stub_server(ZarinpalStub(seed=0))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(server.server_close)
+        cls.addClassCleanup(server.shutdown)
+        settings_override = override_settings(ZARINPAL_SANDBOX_URL=f'http://127.0.0.1:{server.server_port}/pg/')
+        settings_override.enable()
+        cls.addClassCleanup(settings_override.disable)
+
+    def test_loadtest_checkout(self):
+        """
+        Test concurrent checkouts of a variant in stock once sell it once
+        """
+        call_command('generate_catalog', 5, users=3, stdout=io.StringIO())
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'results.json'
+            call_command(
+                'loadtest_checkout', base_url=self.live_server_url, users=3, iterations=2, hot_variants=1, stock=1,
+                output=str(output), stdout=io.StringIO(),
+            )
+            results = json.loads(output.read_text())
+
+        self.assertEqual(results['outcomes'], {'checked_out': 1, 'out_of_stock': 5})
+        self.assertEqual(results['orders']['paid'], 1)
+        self.assertEqual(results['stock'], {'reserved': 1, 'oversold_variants': [], 'mismatched_variants': []})
+        self.assertEqual(results['incidents'], {'empty_orders': [], 'zero_amount_orders': []})
+        self.assertEqual(results['steps']['order_create']['requests'], 6)
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.shortcuts import render
+
+from .cache_stats import get_cache_stats
+
+
+@staff_member_required
+def cache_stats_view(request):
+    """
+    Hits and misses of each cache alias in this process (settings.CACHE_STATS)
+    """
+    stats = get_cache_stats()
+    caches = [
+        {
+            'alias': alias,
+            'backend': cache_settings.get('INSTRUMENTED_BACKEND', cache_settings['BACKEND']),
+            **stats.get(alias, {'hits': 0, 'misses': 0, 'hit_rate': None}),
+        }
+        for alias, cache_settings in settings.CACHES.items()
+    ]
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Cache stats',
+        'enabled': settings.CACHE_STATS,
+        'caches': caches,
+    }
+    return render(request, 'shared/cache_stats.html', context)